@@ -1,6 +1,15 @@
 import streamlit as st
 import uuid
-from chatbot_backend import chatbot, retrieve_all_threads, delete_thread_data, generate_summary
+from chatbot_backend import (
+    chatbot,
+    retrieve_all_threads,
+    delete_thread_data,
+    generate_summary,
+    get_thread_meta,
+    record_thread_turn,
+    compaction_queue,
+    BACKGROUND_SUMMARY,
+)
 from langchain_core.messages import HumanMessage, AIMessage
 from streamlit_mic_recorder import speech_to_text
 
@@ -145,13 +154,9 @@ def load_chat(thread_id):
             st.session_state["messages"].append({"role": "assistant", "content": msg.content})
             
     if thread_id not in st.session_state["titles"]:
-        user_msgs = [m for m in history if isinstance(m, HumanMessage)]
-        if user_msgs:
-            if len(user_msgs[0].content) < 15:
-                st.session_state["titles"][thread_id] = "New Conversation"
-            else:
-                title = generate_summary(user_msgs[0].content)
-                st.session_state["titles"][thread_id] = title
+        meta = get_thread_meta(thread_id)
+        if meta:
+            st.session_state["titles"][thread_id] = meta["title"]
 
 # SIDEBAR UI 
 with st.sidebar:
@@ -293,6 +298,8 @@ if final_prompt:
         full_response = ""
         
         try:
+            if BACKGROUND_SUMMARY:
+                compaction_queue.wait(st.session_state["thread_id"])
             for chunk, _ in chatbot.stream(
                 {"messages": [HumanMessage(content=final_prompt)]},
                 config={"configurable": {"thread_id": st.session_state["thread_id"]}},
@@ -304,6 +311,9 @@ if final_prompt:
             
             message_placeholder.markdown(full_response)
             st.session_state["messages"].append({"role": "assistant", "content": full_response})
+            record_thread_turn(st.session_state["thread_id"], final_prompt, full_response)
+            if BACKGROUND_SUMMARY:
+                compaction_queue.request(st.session_state["thread_id"])
             
         except Exception as e:
             st.error(f"Error: {str(e)}")
@@ -0,0 +1,183 @@
+"""
+Adaptive admission limit for chat streams (ADAPTIVE_CONCURRENCY=1), AIMD style.
+
+- The limit starts at ADAPTIVE_INITIAL_STREAMS and moves between ADAPTIVE_MIN_STREAMS and
+  MAX_CONCURRENT_STREAMS. Every ADAPTIVE_WINDOW_SEC it looks at the last window:
+  - Groq 429 / 5xx responses above ADAPTIVE_ERROR_RATE, or an average time-to-first-output
+    above ADAPTIVE_TTFT_TARGET_SEC: multiply the limit by ADAPTIVE_BACKOFF.
+  - Otherwise, if streams queued for a slot (demand above the limit): add ADAPTIVE_STEP.
+  - Otherwise hold — an idle server has no evidence that more would be safe.
+- Time to first output is measured per stream (first token or tool status after the slot
+  is granted, so the thread-lock and compaction waits before it are not included), minus
+  the time the turn spent queued in groq_scheduler: our own throttling is not upstream
+  latency. Upstream status codes come from the Groq clients' response hooks (groq_limits),
+  so tool HTTP errors do not count; each SDK retry is a response of its own.
+- With ADAPTIVE_CONCURRENCY=0 the limit is fixed at MAX_CONCURRENT_STREAMS, but the same
+  signals are still collected and reported.
+- acquire/release run on the event loop; record_* may be called from any thread.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "0") == "1"
+ADAPTIVE_MIN_STREAMS = max(1, int(os.getenv("ADAPTIVE_MIN_STREAMS", "4")))
+ADAPTIVE_INITIAL_STREAMS = int(os.getenv("ADAPTIVE_INITIAL_STREAMS", "16"))
+ADAPTIVE_WINDOW_SEC = float(os.getenv("ADAPTIVE_WINDOW_SEC", "5"))
+ADAPTIVE_TTFT_TARGET_SEC = float(os.getenv("ADAPTIVE_TTFT_TARGET_SEC", "3.0"))
+ADAPTIVE_ERROR_RATE = float(os.getenv("ADAPTIVE_ERROR_RATE", "0.05"))
+ADAPTIVE_BACKOFF = float(os.getenv("ADAPTIVE_BACKOFF", "0.75"))
+ADAPTIVE_STEP = float(os.getenv("ADAPTIVE_STEP", "2"))
+# TTFT and the upstream error rate need a few samples before they may shrink the limit: one
+# slow answer (or one request's 429 and its retries) is not a trend.
+ADAPTIVE_MIN_SAMPLES = max(1, int(os.getenv("ADAPTIVE_MIN_SAMPLES", "3")))
+
+
+class AdaptiveLimiter:
+    """Semaphore whose size follows observed latency, upstream errors and queueing."""
+
+    def __init__(self, max_limit: int, min_limit: int = ADAPTIVE_MIN_STREAMS, enabled: bool = ADAPTIVE_CONCURRENCY):
+        self.enabled = enabled
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        initial = ADAPTIVE_INITIAL_STREAMS if enabled else max_limit
+        self.limit = float(min(max(initial, self.min_limit), max_limit))
+        self.in_flight = 0
+        self._cond = None  # asyncio.Condition, created on the serving loop
+        self._signals = threading.Lock()
+        self._window_started = time.monotonic()
+        self._reset_window()
+        self.increases = 0
+        self.decreases = 0
+        self.decisions = deque(maxlen=20)
+
+    def _reset_window(self) -> None:
+        self._ttft_sum = 0.0
+        self._ttft_n = 0
+        self._upstream = 0
+        self._upstream_errors = 0
+        self._queued = 0
+        self._queue_wait = 0.0
+        self._admitted = 0
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self) -> float:
+        """Wait for a slot under the current limit; returns seconds spent queued."""
+        cond = self._condition()
+        started = time.monotonic()
+        async with cond:
+            queued = self.in_flight >= int(self.limit)
+            await cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        waited = time.monotonic() - started
+        with self._signals:
+            self._admitted += 1
+            if queued:
+                self._queued += 1
+                self._queue_wait += waited
+        await self._maybe_adjust()
+        return waited
+
+    async def release(self) -> None:
+        cond = self._condition()
+        async with cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            cond.notify()
+        await self._maybe_adjust()
+
+    def set_max_limit(self, max_limit: int) -> None:
+        """Re-cap the limit, e.g. when streams turn out to need a pool thread each after all."""
+        self.max_limit = max_limit
+        self.min_limit = min(self.min_limit, max_limit)
+        self.limit = float(min(self.limit, max_limit)) if self.enabled else float(max_limit)
+
+    def record_ttft(self, seconds: float) -> None:
+        with self._signals:
+            self._ttft_sum += seconds
+            self._ttft_n += 1
+
+    def record_upstream(self, status_code: int) -> None:
+        with self._signals:
+            self._upstream += 1
+            if status_code == 429 or status_code >= 500:
+                self._upstream_errors += 1
+
+    def _decide(self, ttft_avg, ttft_n, error_rate, upstream_n, queued) -> tuple:
+        if error_rate is not None and upstream_n >= ADAPTIVE_MIN_SAMPLES and error_rate > ADAPTIVE_ERROR_RATE:
+            return "decrease", f"upstream 429/5xx rate {error_rate:.0%}"
+        if ttft_avg is not None and ttft_n >= ADAPTIVE_MIN_SAMPLES and ttft_avg > ADAPTIVE_TTFT_TARGET_SEC:
+            return "decrease", f"avg time to first output {ttft_avg:.2f}s"
+        if queued:
+            return "increase", f"{queued} streams queued for a slot"
+        return "hold", "no queueing"
+
+    async def _maybe_adjust(self) -> None:
+        now = time.monotonic()
+        with self._signals:
+            if now - self._window_started < ADAPTIVE_WINDOW_SEC:
+                return
+            ttft_n = self._ttft_n
+            ttft_avg = self._ttft_sum / ttft_n if ttft_n else None
+            upstream_n = self._upstream
+            error_rate = self._upstream_errors / upstream_n if upstream_n else None
+            queued = self._queued
+            queue_wait = self._queue_wait / queued if queued else 0.0
+            self._window_started = now
+            self._reset_window()
+        action, reason = self._decide(ttft_avg, ttft_n, error_rate, upstream_n, queued)
+        if not self.enabled or action == "hold":
+            return
+        previous = self.limit
+        if action == "decrease":
+            self.limit = max(float(self.min_limit), self.limit * ADAPTIVE_BACKOFF)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + ADAPTIVE_STEP)
+        if int(self.limit) == int(previous):
+            return
+        if action == "decrease":
+            self.decreases += 1
+        else:
+            self.increases += 1
+            cond = self._condition()
+            async with cond:
+                cond.notify(int(self.limit) - int(previous))
+        self.decisions.append(
+            {
+                "at": round(time.time()),
+                "action": action,
+                "limit": int(self.limit),
+                "reason": reason,
+                "avg_queue_wait_sec": round(queue_wait, 3),
+            }
+        )
+        print(f"[concurrency] chat limit {int(previous)} -> {int(self.limit)} ({reason})")
+
+    def stats(self) -> dict:
+        with self._signals:
+            window = {
+                "ttft_samples": self._ttft_n,
+                "avg_ttft_sec": round(self._ttft_sum / self._ttft_n, 3) if self._ttft_n else None,
+                "upstream_responses": self._upstream,
+                "upstream_errors": self._upstream_errors,
+                "queued": self._queued,
+                "avg_queue_wait_sec": round(self._queue_wait / self._queued, 3) if self._queued else None,
+            }
+        return {
+            "enabled": self.enabled,
+            "limit": int(self.limit),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "ttft_target_sec": ADAPTIVE_TTFT_TARGET_SEC,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "current_window": window,
+            "recent_decisions": list(self.decisions),
+        }
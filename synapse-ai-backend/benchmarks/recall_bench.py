@@ -0,0 +1,100 @@
+"""
+Recall-vs-latency benchmark for FAISS index types against the exact flat index.
+
+Queries are stored vectors plus small Gaussian noise (no embedding model needed), so the
+numbers reflect index behaviour only. Ground truth is the flat index's top-k.
+
+    python benchmarks/recall_bench.py                          # faiss_ethics_ch10
+    python benchmarks/recall_bench.py --index-dir big_corpus --queries 500 --k 10
+    python benchmarks/recall_bench.py --synthetic 200000       # random vectors, no index needed
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import faiss_index  # noqa: E402
+
+NPROBE_SWEEP = (1, 4, 16, 64)
+EF_SEARCH_SWEEP = (16, 32, 64, 128)
+
+
+def _load_vectors(args) -> np.ndarray:
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        return rng.standard_normal((args.synthetic, args.dim)).astype("float32")
+    index = faiss.read_index(os.path.join(args.index_dir, faiss_index.INDEX_FILE))
+    vectors, _labels = faiss_index.reconstruct_all(index)
+    return vectors
+
+
+def _queries(vectors: np.ndarray, n: int, noise: float) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    picks = vectors[rng.choice(len(vectors), size=min(n, len(vectors)), replace=False)]
+    return (picks + noise * rng.standard_normal(picks.shape)).astype("float32")
+
+
+def _measure(index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    latencies = []
+    hits = 0
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        _d, ids = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(ids[0]) & set(truth[i]))
+    lat = np.array(latencies)
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=os.path.join(BACKEND_DIR, "faiss_ethics_ch10"))
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random vectors instead of an index")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--pq-m", type=int, default=48)
+    args = parser.parse_args()
+
+    vectors = _load_vectors(args)
+    queries = _queries(vectors, args.queries, args.noise)
+    k = min(args.k, len(vectors))
+
+    flat = faiss_index.build_index(vectors, "flat")
+    _d, truth = flat.search(queries, k)
+
+    rows = [("flat", "-", _measure(flat, queries, truth, k))]
+    for kind in ("ivf", "ivfpq"):
+        try:
+            index = faiss_index.build_index(vectors, kind, pq_m=args.pq_m)
+        except (ValueError, RuntimeError) as exc:
+            print(f"skip {kind}: {exc}")
+            continue
+        for nprobe in NPROBE_SWEEP:
+            faiss_index.apply_search_params(index, nprobe=nprobe)
+            rows.append((kind, f"nprobe={nprobe}", _measure(index, queries, truth, k)))
+    hnsw = faiss_index.build_index(vectors, "hnsw")
+    for ef in EF_SEARCH_SWEEP:
+        faiss_index.apply_search_params(hnsw, ef_search=ef)
+        rows.append(("hnsw", f"efSearch={ef}", _measure(hnsw, queries, truth, k)))
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, recall@{k} vs flat")
+    print(f"{'index':<8} {'params':<14} {'recall':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for kind, params, m in rows:
+        print(f"{kind:<8} {params:<14} {m['recall']:>8.3f} {m['p50_ms']:>9.3f} {m['p95_ms']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Startup-time benchmark: import cost of the backend modules and retriever warm-up time.
+
+Each import is measured in a fresh interpreter so module caches don't hide regressions.
+
+    python benchmarks/startup_bench.py                  # table
+    python benchmarks/startup_bench.py --runs 5 --json  # machine-readable
+    python benchmarks/startup_bench.py --max-import-sec 3  # exit 1 if main imports slower
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["retriever", "tools", "chatbot_backend", "main"]
+
+_IMPORT_SNIPPET = """
+import time, importlib
+t0 = time.perf_counter()
+importlib.import_module({module!r})
+print(time.perf_counter() - t0)
+"""
+
+_WARMUP_SNIPPET = """
+import time
+import retriever
+t0 = time.perf_counter()
+retriever.wait_until_ready(timeout=None)
+print(time.perf_counter() - t0)
+"""
+
+
+def _run(snippet: str) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--skip-warmup", action="store_true")
+    parser.add_argument("--max-import-sec", type=float, default=None)
+    args = parser.parse_args()
+
+    results = {}
+    for module in MODULES:
+        samples = [_run(_IMPORT_SNIPPET.format(module=module)) for _ in range(args.runs)]
+        results[f"import {module}"] = samples
+    if not args.skip_warmup:
+        results["retriever warm-up"] = [_run(_WARMUP_SNIPPET) for _ in range(args.runs)]
+
+    summary = {
+        name: {"median_sec": round(statistics.median(s), 4), "min_sec": round(min(s), 4)}
+        for name, s in results.items()
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for name, row in summary.items():
+            print(f"{name:<26} median {row['median_sec']:>8.3f}s   min {row['min_sec']:>8.3f}s")
+
+    if args.max_import_sec is not None and summary["import main"]["median_sec"] > args.max_import_sec:
+        print(f"FAIL: import main exceeded {args.max_import_sec}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
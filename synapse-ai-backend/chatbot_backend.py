@@ -1,21 +1,42 @@
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from typing import TypedDict, Annotated, Literal, Iterator, Tuple, Optional
+from typing import TypedDict, Annotated, Literal, Iterator, AsyncIterator, Tuple, Optional
 
 from langchain_core.messages import SystemMessage, HumanMessage, RemoveMessage, AIMessage, AIMessageChunk
 from langchain_core.runnables import RunnableConfig
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.prebuilt import ToolNode
 from langgraph.config import get_stream_writer
 from dotenv import load_dotenv
+import asyncio
+import functools
 import json
+import operator
 import os
 import re
 import sqlite3
 import threading
 import uuid
+from contextlib import aclosing, closing
 from datetime import datetime
 import pytz
+from thread_store import DEFAULT_TITLE, ThreadStore
+from thread_locks import THREAD_LOCK_BACKEND, acquire_turn_lock, get_thread_lock, release_turn_lock, waiting
+from compaction import COMPACTION_WAIT_SEC, CompactionQueue
+from groq_limits import PRIORITY_BACKGROUND, PRIORITY_CHAT, PRIORITY_VOICE, groq_scheduler, http_clients
+from response_cache import RESPONSE_CACHE_ENABLED, cacheable_question, response_cache
+from tool_router import TOOL_ROUTER_ENABLED, acall_with_route, call_with_route, is_routing_miss, tool_router
+from db_maintenance import CheckpointMaintenance
+from sqlite_pool import AsyncPooledSqliteSaver, PooledSqliteSaver, SqliteReaderPool, SqliteWriter
+from collections import ChainMap
+from token_budget import (
+    SUMMARY_KEEP_RATIO,
+    context_limit,
+    count_message_tokens,
+    count_tokens,
+    history_budget,
+    merge_token_counts,
+    trim_start,
+)
 from tools import (
     rag_tool,
     web_search,
@@ -44,7 +65,13 @@ TOOL_FALLBACK_MODEL = os.getenv("GROQ_TOOL_FALLBACK_MODEL", "qwen/qwen3.6-27b")
 SUMMARY_MODEL = os.getenv("GROQ_SUMMARY_MODEL", "openai/gpt-oss-20b")
 
 
-def _make_groq(model: str, streaming: bool = True, timeout: int = 120, max_tokens: int = 1024) -> ChatGroq:
+CHAT_MAX_TOKENS = 1024
+SUMMARY_MAX_TOKENS = 400
+
+
+def _make_groq(model: str, streaming: bool = True, timeout: int = 120, max_tokens: int = CHAT_MAX_TOKENS) -> ChatGroq:
+    # Per-model httpx clients feed Groq's rate-limit headers back to groq_scheduler.
+    http_client, http_async_client = http_clients(model)
     return ChatGroq(
         model=model,
         temperature=0,
@@ -52,6 +79,8 @@ def _make_groq(model: str, streaming: bool = True, timeout: int = 120, max_token
         streaming=streaming,
         request_timeout=timeout,
         max_tokens=max_tokens,
+        http_client=http_client,
+        http_async_client=http_async_client,
     )
 
 
@@ -59,6 +88,10 @@ llm = _make_groq(CHAT_MODEL)
 llm_invoke = _make_groq(CHAT_MODEL, streaming=False)
 summary_llm = _make_groq(SUMMARY_MODEL, streaming=False, timeout=60)
 
+# Opt-in: end the turn right after the reply and compact history in a background worker
+# (compaction.py) instead of in the summarize_conversation node before END.
+BACKGROUND_SUMMARY = os.getenv("BACKGROUND_SUMMARY", "0") == "1"
+
 # 2. DEFINE TOOLS
 tools = [
     rag_tool,
@@ -74,7 +107,14 @@ tools = [
 ]
 TOOL_NAMES = {t.name for t in tools}
 
-_bind_kw = {"tool_choice": "auto", "parallel_tool_calls": False}
+# Opt-in: let the model emit several independent tool calls in one response.
+# ToolNode runs them concurrently (at most MAX_PARALLEL_TOOL_CALLS at a time; atool_node
+# batches them on the async graph) and returns the ToolMessages in tool_call order, so
+# merged results are deterministic.
+PARALLEL_TOOL_CALLS = os.getenv("PARALLEL_TOOL_CALLS", "0") == "1"
+MAX_PARALLEL_TOOL_CALLS = max(1, int(os.getenv("MAX_PARALLEL_TOOL_CALLS", "4")))
+
+_bind_kw = {"tool_choice": "auto", "parallel_tool_calls": PARALLEL_TOOL_CALLS}
 llm_with_tools = llm.bind_tools(tools, **_bind_kw)
 llm_with_tools_invoke = llm_invoke.bind_tools(tools, **_bind_kw)
 
@@ -93,6 +133,17 @@ if TOOL_FALLBACK_MODEL and TOOL_FALLBACK_MODEL != CHAT_MODEL:
 class ChatState(TypedDict):
     messages: Annotated[list, add_messages]
     summary: str
+    # Token count per message id (counted once) and their running total — see token_budget.py.
+    token_counts: Annotated[dict, merge_token_counts]
+    history_tokens: Annotated[int, operator.add]
+    # Router result for the latest user message: {"message_id": ..., "tools": [...] | None}.
+    tool_route: dict
+
+
+# Summarize once raw history outgrows what either model that may answer can take.
+_HISTORY_BUDGET = min(
+    history_budget(m) for m in (CHAT_MODEL, TOOL_FALLBACK_MODEL if _tool_fallback_llm else None) if m
+)
 
 # 4. NODES
 
@@ -121,6 +172,9 @@ Greetings, thanks, small talk, creative writing, static explanations — no live
 ## Tool loop behavior
 After a tool returns, either call another tool if still needed, or write your final answer. Never stop at raw tool output alone."""
 
+PARALLEL_TOOLS_ADDENDUM = """## Parallel tool calls
+When a request needs several independent lookups (e.g. a stock price AND news), request all of those tool calls together in a single response instead of one after another. Only wait for a result first when the next call depends on it."""
+
 VOICE_ADDENDUM = """## Voice mode (user is speaking aloud)
 - **Be brief.** Prefer 1–3 short sentences. Aim for under 60 words unless the user asked for detail.
 - **Write for fast speech.** Use short sentences. End each thought with a full stop. Keep moving — do not pause with long clauses or commas; split into separate sentences instead so the voice can speak quickly after every full stop.
@@ -176,16 +230,27 @@ def extract_chunk_text(chunk) -> str:
     return ""
 
 
-_thread_locks: dict[str, threading.Lock] = {}
-_thread_locks_guard = threading.Lock()
+_LOCK_POLL_SEC = 0.05
 
 
-def get_thread_lock(thread_id: str) -> threading.Lock:
-    """Serialize checkpoint access per conversation thread (allows parallel different threads)."""
-    with _thread_locks_guard:
-        if thread_id not in _thread_locks:
-            _thread_locks[thread_id] = threading.Lock()
-        return _thread_locks[thread_id]
+async def acquire_thread_turn(thread_id: str, lock, blocking: bool = True) -> bool:
+    """
+    Admit a chat turn from the event loop without parking an OS thread: wait out the
+    thread's pending background compaction, then take `lock` by polling a non-blocking
+    acquire (counted as a waiter meanwhile). blocking=False makes a single attempt.
+    With a cross-process THREAD_LOCK_BACKEND each try is one check on the shared store, run on
+    the thread-lock pool (acquire_turn_lock) so the event loop never waits on that I/O.
+    """
+    if BACKGROUND_SUMMARY and not await compaction_queue.await_pending(thread_id, COMPACTION_WAIT_SEC):
+        print(f"[compaction] thread={thread_id}: still running, starting turn on uncompacted history")
+    if await acquire_turn_lock(lock):
+        return True
+    if not blocking:
+        return False
+    with waiting(thread_id):
+        while not await acquire_turn_lock(lock):
+            await asyncio.sleep(_LOCK_POLL_SEC)
+    return True
 
 
 def configure_sqlite_connection(conn: sqlite3.Connection) -> None:
@@ -205,46 +270,219 @@ def _unpack_stream_event(event) -> Tuple[str, object]:
     return "custom", event
 
 
+def _chat_stream_config(thread_id: str, voice: bool, user_id: Optional[str] = None) -> dict:
+    configurable = {"thread_id": thread_id, "voice_mode": voice}
+    if user_id:
+        configurable["user_id"] = user_id  # selects the user's document collection in rag_tool
+    return {
+        "configurable": configurable,
+        # Bounds the sync ToolNode's fan-out when the model emits several tool calls (atool_node on the async graph).
+        "max_concurrency": MAX_PARALLEL_TOOL_CALLS,
+    }
+
+
+def _to_chat_event(event) -> Optional[Tuple[str, object]]:
+    """Map one LangGraph stream item to an SSE-oriented event (or None to skip)."""
+    mode, payload = _unpack_stream_event(event)
+
+    if mode == "custom":
+        if isinstance(payload, dict):
+            token = payload.get("token")
+            if token:
+                return ("token", token)
+            if payload.get("scheduler_wait"):
+                return ("scheduler_wait", payload["scheduler_wait"])
+        return None
+
+    if mode == "messages":
+        if isinstance(payload, tuple) and len(payload) == 2:
+            _msg, metadata = payload
+        else:
+            metadata = {}
+
+        node = metadata.get("langgraph_node") if metadata else None
+        if node == "tools":
+            return ("status", "using_tools")
+    return None
+
+
+_CHAT_ERROR_TEXT = "Something went wrong on my end. Please try again in a moment."
+
+
+class TurnCancelled(Exception):
+    """The client went away mid-turn; raised inside the graph at the next model chunk or node."""
+
+
+# Cancel flag of the turn in flight per thread (the thread lock allows only one).
+_turn_cancel_flags: dict[str, threading.Event] = {}
+
+
+def _turn_cancel_flag(config: Optional[RunnableConfig]) -> Optional[threading.Event]:
+    thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+    return _turn_cancel_flags.get(thread_id) if thread_id else None
+
+
+def _raise_if_cancelled(cancel: Optional[threading.Event]) -> None:
+    if cancel is not None and cancel.is_set():
+        raise TurnCancelled()
+
+
+def _chat_turn(
+    message: str, thread_id: str, config: dict, cancel: Optional[threading.Event]
+) -> Iterator[Tuple[str, object]]:
+    """One turn on the sync graph; the caller holds the thread lock."""
+    reply_parts = []
+    if cancel is not None:
+        _turn_cancel_flags[thread_id] = cancel
+    try:
+        with closing(
+            chatbot.stream(
+                {"messages": [HumanMessage(content=message)]},
+                config=config,
+                stream_mode=["custom", "messages"],
+            )
+        ) as events:
+            for event in events:
+                _raise_if_cancelled(cancel)
+                chat_event = _to_chat_event(event)
+                if chat_event is None:
+                    continue
+                if chat_event[0] == "token":
+                    reply_parts.append(chat_event[1])
+                yield chat_event
+
+        yield ("done", None)
+    except TurnCancelled:
+        print(f"[chat_stream] thread={thread_id}: client disconnected, turn cancelled")
+        # The checkpoint already has the message: keep the thread listed, without a title call.
+        record_thread_turn(thread_id, message, "", generate_title=False)
+        return
+    except GeneratorExit:  # the worker stopped reading (client gone) at a yield
+        record_thread_turn(thread_id, message, "", generate_title=False)
+        raise
+    except Exception as exc:
+        print(f"[chat_stream error] thread={thread_id}: {type(exc).__name__}: {exc}")
+        record_thread_turn(thread_id, message, "", generate_title=False)
+        yield ("error", _CHAT_ERROR_TEXT)
+        return
+    finally:
+        _turn_cancel_flags.pop(thread_id, None)
+
+    # After [DONE]; the title itself is generated once the turn has let go of its lock and slot.
+    record_thread_turn(thread_id, message, "".join(reply_parts))
+    if BACKGROUND_SUMMARY:
+        compaction_queue.request(thread_id)
+
+
 def iter_chat_stream(
-    message: str, thread_id: str, voice: bool = False
+    message: str,
+    thread_id: str,
+    voice: bool = False,
+    user_id: Optional[str] = None,
+    lock_held: bool = False,
+    cancel: Optional[threading.Event] = None,
 ) -> Iterator[Tuple[str, object]]:
     """
     Sync generator of SSE-oriented events: ('token', str), ('status', str), ('done', None), ('error', str).
-    Tokens are streamed live from Groq via LangGraph custom stream mode.
+    Tokens are streamed live from Groq via LangGraph custom stream mode; ('scheduler_wait', sec)
+    reports time a model call spent queued in groq_scheduler (not sent to the client).
     voice=True adds concise spoken-response instructions (same graph, tools, and thread state).
+    lock_held=True: the caller already took the thread lock (acquire_thread_turn) and releases it,
+    then starts the new thread's title job (take_pending_title / generate_thread_title).
+    Setting `cancel` (client disconnected) stops the model stream at its next chunk and the
+    graph before its next node; the turn then ends without 'done'. Its thread metadata is still
+    recorded (the checkpoint has the user's message), but no title is generated.
     """
-    config = {"configurable": {"thread_id": thread_id, "voice_mode": voice}}
-    lock = get_thread_lock(thread_id)
-    with lock:
-        try:
-            for event in chatbot.stream(
+    config = _chat_stream_config(thread_id, voice, user_id)
+    if lock_held:
+        yield from _chat_turn(message, thread_id, config, cancel)
+        return
+    if BACKGROUND_SUMMARY and not compaction_queue.wait(thread_id, COMPACTION_WAIT_SEC):
+        print(f"[compaction] thread={thread_id}: still running, starting turn on uncompacted history")
+    with get_thread_lock(thread_id):
+        yield from _chat_turn(message, thread_id, config, cancel)
+    first_message = take_pending_title(thread_id)
+    if first_message is not None:
+        generate_thread_title(thread_id, first_message)
+
+
+async def _achat_turn(
+    message: str, thread_id: str, config: dict, cancel: Optional[threading.Event]
+) -> AsyncIterator[Tuple[str, object]]:
+    """One turn on the async graph; the caller holds the thread lock."""
+    reply_parts = []
+    if cancel is not None:
+        _turn_cancel_flags[thread_id] = cancel
+    try:
+        async with aclosing(
+            achatbot.astream(
                 {"messages": [HumanMessage(content=message)]},
                 config=config,
                 stream_mode=["custom", "messages"],
-            ):
-                mode, payload = _unpack_stream_event(event)
-
-                if mode == "custom":
-                    if isinstance(payload, dict):
-                        token = payload.get("token")
-                        if token:
-                            yield ("token", token)
+            )
+        ) as events:
+            async for event in events:
+                _raise_if_cancelled(cancel)
+                chat_event = _to_chat_event(event)
+                if chat_event is None:
                     continue
-
-                if mode == "messages":
-                    if isinstance(payload, tuple) and len(payload) == 2:
-                        _msg, metadata = payload
-                    else:
-                        metadata = {}
-
-                    node = metadata.get("langgraph_node") if metadata else None
-                    if node == "tools":
-                        yield ("status", "using_tools")
-
-            yield ("done", None)
-        except Exception as exc:
-            print(f"[chat_stream error] thread={thread_id}: {type(exc).__name__}: {exc}")
-            yield ("error", "Something went wrong on my end. Please try again in a moment.")
+                if chat_event[0] == "token":
+                    reply_parts.append(chat_event[1])
+                yield chat_event
+
+        yield ("done", None)
+    except TurnCancelled:
+        print(f"[chat_stream] thread={thread_id}: client disconnected, turn cancelled")
+        await asyncio.to_thread(record_thread_turn, thread_id, message, "", False)
+        return
+    except (GeneratorExit, asyncio.CancelledError):  # stream closed or worker task cancelled
+        await asyncio.to_thread(record_thread_turn, thread_id, message, "", False)
+        raise
+    except Exception as exc:
+        print(f"[chat_stream error] thread={thread_id}: {type(exc).__name__}: {exc}")
+        await asyncio.to_thread(record_thread_turn, thread_id, message, "", False)
+        yield ("error", _CHAT_ERROR_TEXT)
+        return
+    finally:
+        _turn_cancel_flags.pop(thread_id, None)
+
+    # The metadata write is sync; keep it off the event loop.
+    await asyncio.to_thread(record_thread_turn, thread_id, message, "".join(reply_parts))
+    if BACKGROUND_SUMMARY:
+        compaction_queue.request(thread_id)
+
+
+async def aiter_chat_stream(
+    message: str,
+    thread_id: str,
+    voice: bool = False,
+    user_id: Optional[str] = None,
+    lock_held: bool = False,
+    cancel: Optional[threading.Event] = None,
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Async twin of iter_chat_stream on the async graph (achatbot): model calls, tools and
+    checkpoint writes are awaited, so an idle stream holds no OS thread. Cancelling the
+    consuming task also works and stops the Groq stream immediately.
+    """
+    if achatbot is None:
+        raise RuntimeError("Async graph is not initialised — call init_async_graph() first.")
+
+    config = _chat_stream_config(thread_id, voice, user_id)
+    if lock_held:
+        async for chat_event in _achat_turn(message, thread_id, config, cancel):
+            yield chat_event
+        return
+    lock = get_thread_lock(thread_id)
+    await acquire_thread_turn(thread_id, lock)
+    try:
+        async for chat_event in _achat_turn(message, thread_id, config, cancel):
+            yield chat_event
+    finally:
+        await release_turn_lock(lock)
+    first_message = take_pending_title(thread_id)
+    if first_message is not None:
+        await asyncio.to_thread(generate_thread_title, thread_id, first_message)
 
 
 def _is_groq_tool_failure(exc: Exception) -> bool:
@@ -287,17 +525,21 @@ def _tool_calls_from_text(text: str) -> list:
 
     pattern = _tool_name_pattern()
 
-    xml_match = re.search(
+    recovered = []
+    for xml_match in re.finditer(
         rf"<({pattern})>\s*(\{{.*?\}})\s*</\1>",
         text,
         re.DOTALL | re.IGNORECASE,
-    )
-    if xml_match:
+    ):
         name, args_str = xml_match.group(1), xml_match.group(2)
         try:
-            return [{"name": name, "args": json.loads(args_str)}]
+            recovered.append({"name": name, "args": json.loads(args_str)})
         except json.JSONDecodeError:
-            pass
+            continue
+        if not PARALLEL_TOOL_CALLS:
+            break
+    if recovered:
+        return recovered
 
     inline_match = re.match(rf"^({pattern})\s*(\{{.*\}})\s*$", text, re.DOTALL)
     if inline_match:
@@ -311,20 +553,38 @@ def _tool_calls_from_text(text: str) -> list:
 
 
 def _aimessage_with_tool_calls(name: str, args: dict, msg: Optional[AIMessage] = None) -> AIMessage:
+    return _aimessage_with_recovered_calls([{"name": name, "args": args}], msg)
+
+
+def _aimessage_with_recovered_calls(calls: list, msg: Optional[AIMessage] = None) -> AIMessage:
     return AIMessage(
         content="",
         tool_calls=[
             {
-                "name": name,
-                "args": args,
+                "name": c["name"],
+                "args": c["args"],
                 "id": f"call_{uuid.uuid4().hex[:8]}",
                 "type": "tool_call",
             }
+            for c in calls
         ],
         id=getattr(msg, "id", None) if msg else None,
     )
 
 
+def _dedupe_tool_calls(tool_calls: list) -> list:
+    """Drop exact duplicate calls (same tool + args) — parallel mode sometimes repeats one."""
+    seen = set()
+    unique = []
+    for tc in tool_calls:
+        key = (tc.get("name"), json.dumps(tc.get("args") or {}, sort_keys=True, default=str))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(tc)
+    return unique
+
+
 def _sanitize_ai_response(msg: AIMessage) -> AIMessage:
     """
     Repair malformed tool calls from Groq/Llama before LangGraph runs ToolNode.
@@ -351,6 +611,7 @@ def _sanitize_ai_response(msg: AIMessage) -> AIMessage:
             else:
                 dropped_any = True
         if fixed_calls:
+            fixed_calls = _dedupe_tool_calls(fixed_calls)
             return AIMessage(content=msg.content or "", tool_calls=fixed_calls, id=getattr(msg, "id", None))
         if dropped_any:
             fallback = extract_ai_text(msg.content) or "I couldn't complete that tool call — could you rephrase?"
@@ -361,11 +622,9 @@ def _sanitize_ai_response(msg: AIMessage) -> AIMessage:
     if not text:
         return msg
 
-    recovered = _tool_calls_from_text(text)
+    recovered = [tc for tc in _tool_calls_from_text(text) if tc["name"] in TOOL_NAMES]
     if recovered:
-        tc = recovered[0]
-        if tc["name"] in TOOL_NAMES:
-            return _aimessage_with_tool_calls(tc["name"], tc["args"], msg)
+        return _aimessage_with_recovered_calls(_dedupe_tool_calls(recovered), msg)
 
     inline = re.match(
         rf"^({_tool_name_pattern()})\s*(\{{.*\}})\s*$",
@@ -384,10 +643,11 @@ def _emit_text_to_writer(text: str, writer) -> None:
         writer({"token": text})
 
 
-def _stream_bound_llm(bound_llm, messages, writer) -> AIMessage:
-    """Stream tokens from Groq; return the assembled AIMessage."""
+def _stream_bound_llm(bound_llm, messages, writer, cancel=None) -> AIMessage:
+    """Stream tokens from Groq; return the assembled AIMessage. Leaving the loop closes the HTTP stream."""
     gathered = None
     for chunk in bound_llm.stream(messages):
+        _raise_if_cancelled(cancel)
         gathered = chunk if gathered is None else gathered + chunk
         if getattr(chunk, "tool_call_chunks", None) or getattr(chunk, "tool_calls", None):
             continue
@@ -401,58 +661,368 @@ def _stream_bound_llm(bound_llm, messages, writer) -> AIMessage:
     return _sanitize_ai_response(result)
 
 
-def _invoke_bound_llm(bound_llm, messages, writer) -> AIMessage:
+def _invoke_bound_llm(bound_llm, messages, writer, cancel=None) -> AIMessage:
     """Non-stream invoke — more reliable for tool calls on Groq Llama."""
+    _raise_if_cancelled(cancel)
     response = _sanitize_ai_response(bound_llm.invoke(messages))
     if not (getattr(response, "tool_calls", None) or []):
         _emit_text_to_writer(extract_ai_text(response.content), writer)
     return response
 
 
-def _run_chat_llm(messages, writer) -> AIMessage:
+def _fit_context(messages, counts, history_tokens: int, model: str) -> list:
+    """
+    Drop the oldest history (whole turns, starting at a HumanMessage) until system prompt +
+    history fit the model's CONTEXT_TOKEN_LIMIT. O(1) when it already fits.
+    """
+    limit = context_limit(model)
+    system_tokens = count_message_tokens(messages[0])
+    if system_tokens + history_tokens <= limit:
+        return messages
+    history = messages[1:]
+    cut = trim_start(history, counts, limit - system_tokens)
+    print(f"[context] {model}: dropped {cut} oldest messages to fit {limit} tokens")
+    return [messages[0]] + history[cut:]
+
+
+_routed_llms: dict = {}
+_routed_llms_lock = threading.Lock()
+
+
+def _bound_llms(tool_names: tuple) -> tuple:
+    """(chat invoke, chat stream, fallback invoke, fallback stream) bound to a tool subset; cached per subset."""
+    with _routed_llms_lock:
+        bound = _routed_llms.get(tool_names)
+        if bound is None:
+            subset = [t for t in tools if t.name in tool_names]
+
+            def bind(model):
+                if model is None or not subset:
+                    return model  # no tools: plain model, smallest prompt
+                return model.bind_tools(subset, **_bind_kw)
+
+            bound = (bind(llm_invoke), bind(llm), bind(_tool_fallback_invoke), bind(_tool_fallback_llm))
+            _routed_llms[tool_names] = bound
+        return bound
+
+
+def _chat_candidates(tool_names: Optional[tuple] = None):
+    if tool_names is None:
+        return [
+            (CHAT_MODEL, llm_with_tools_invoke, llm_with_tools),
+            (TOOL_FALLBACK_MODEL, _tool_fallback_with_tools_invoke, _tool_fallback_with_tools),
+        ]
+    invoke, stream, fallback_invoke, fallback_stream = _bound_llms(tool_names)
+    return [(CHAT_MODEL, invoke, stream), (TOOL_FALLBACK_MODEL, fallback_invoke, fallback_stream)]
+
+
+def _groq_request_tokens(messages, history_tokens: int, model: str) -> int:
+    """Rate-limit estimate for one chat call: the (fitted) prompt plus a full completion."""
+    prompt = count_message_tokens(messages[0]) + history_tokens
+    return min(prompt, context_limit(model)) + CHAT_MAX_TOKENS
+
+
+def _chat_priority(config: RunnableConfig) -> int:
+    voice_mode = bool((config or {}).get("configurable", {}).get("voice_mode", False))
+    return PRIORITY_VOICE if voice_mode else PRIORITY_CHAT
+
+
+def _run_chat_llm(
+    messages,
+    writer,
+    counts,
+    history_tokens: int,
+    cancel=None,
+    tool_names: Optional[tuple] = None,
+    priority: int = PRIORITY_CHAT,
+) -> AIMessage:
     """
     Run chat with tools. Invoke-first for reliable tool JSON on Groq Llama.
     Streaming is fallback only — avoids narrating XML tool calls as the answer.
+    Each model gets the history trimmed to its own context limit.
+    tool_names (from the router) limits the bound tools; None binds all of them. If the model
+    calls a tool the route left out, the turn is retried once with all tools (call_with_route).
+    Every attempt waits for its model's rate-limit budget at `priority` (groq_limits).
     """
-    candidates = [
-        (llm_with_tools_invoke, llm_with_tools),
-        (_tool_fallback_with_tools_invoke, _tool_fallback_with_tools),
-    ]
-
     # Always invoke-first: stream-first caused models to print <tool>{json}</tool> as text
-    last_error = None
-    for invoke_llm, stream_llm in candidates:
-        if invoke_llm is None or stream_llm is None:
+    def attempt(names: Optional[tuple]) -> AIMessage:
+        last_error = None
+        for model, invoke_llm, stream_llm in _chat_candidates(names):
+            if invoke_llm is None or stream_llm is None:
+                continue
+            fitted = _fit_context(messages, counts, history_tokens, model)
+            estimate = _groq_request_tokens(messages, history_tokens, model)
+            for runner, bound in ((_stream_bound_llm, stream_llm), (_invoke_bound_llm, invoke_llm)):
+                waited = groq_scheduler.wait_turn(model, priority, estimate)
+                if waited and writer:
+                    writer({"scheduler_wait": waited})  # kept out of the admission limiter's TTFT
+                try:
+                    return runner(bound, fitted, writer, cancel)
+                except Exception as exc:
+                    last_error = exc
+                    # A routing miss fails the same way on every model: rebind all tools instead.
+                    if not _is_groq_tool_failure(exc) or is_routing_miss(exc, names):
+                        raise
+
+        raise last_error or RuntimeError("Chat model failed without a specific error.")
+
+    return call_with_route(attempt, tool_names)
+
+
+async def _astream_bound_llm(bound_llm, messages, writer, cancel=None) -> AIMessage:
+    """Async twin of _stream_bound_llm."""
+    gathered = None
+    async for chunk in bound_llm.astream(messages):
+        _raise_if_cancelled(cancel)
+        gathered = chunk if gathered is None else gathered + chunk
+        if getattr(chunk, "tool_call_chunks", None) or getattr(chunk, "tool_calls", None):
             continue
-        for runner, bound in ((_stream_bound_llm, stream_llm), (_invoke_bound_llm, invoke_llm)):
-            try:
-                return runner(bound, messages, writer)
-            except Exception as exc:
-                last_error = exc
-                if not _is_groq_tool_failure(exc):
-                    raise
+        token = extract_chunk_text(chunk)
+        if not token or not writer:
+            continue
+        if re.search(rf"</?({_tool_name_pattern()})>", token, re.IGNORECASE):
+            continue
+        writer({"token": token})
+    result = gathered if gathered is not None else AIMessage(content="")
+    return _sanitize_ai_response(result)
 
-    raise last_error or RuntimeError("Chat model failed without a specific error.")
 
+async def _ainvoke_bound_llm(bound_llm, messages, writer, cancel=None) -> AIMessage:
+    """Async twin of _invoke_bound_llm."""
+    _raise_if_cancelled(cancel)
+    response = _sanitize_ai_response(await bound_llm.ainvoke(messages))
+    if not (getattr(response, "tool_calls", None) or []):
+        _emit_text_to_writer(extract_ai_text(response.content), writer)
+    return response
 
-def chat_node(state: ChatState, config: RunnableConfig):
-    """Main Chat Node — streams Groq tokens to the client while building the final AIMessage."""
+
+async def _arun_chat_llm(
+    messages,
+    writer,
+    counts,
+    history_tokens: int,
+    cancel=None,
+    tool_names: Optional[tuple] = None,
+    priority: int = PRIORITY_CHAT,
+) -> AIMessage:
+    """Async twin of _run_chat_llm — same candidates, fallback order and context trimming."""
+
+    async def attempt(names: Optional[tuple]) -> AIMessage:
+        last_error = None
+        for model, invoke_llm, stream_llm in _chat_candidates(names):
+            if invoke_llm is None or stream_llm is None:
+                continue
+            fitted = _fit_context(messages, counts, history_tokens, model)
+            estimate = _groq_request_tokens(messages, history_tokens, model)
+            for runner, bound in ((_astream_bound_llm, stream_llm), (_ainvoke_bound_llm, invoke_llm)):
+                waited = await groq_scheduler.await_turn(model, priority, estimate)
+                if waited and writer:
+                    writer({"scheduler_wait": waited})
+                try:
+                    return await runner(bound, fitted, writer, cancel)
+                except Exception as exc:
+                    last_error = exc
+                    if not _is_groq_tool_failure(exc) or is_routing_miss(exc, names):
+                        raise
+
+        raise last_error or RuntimeError("Chat model failed without a specific error.")
+
+    return await acall_with_route(attempt, tool_names)
+
+
+_TOOL_GUIDE_LINE = re.compile(r"^- \*\*(\w+)\*\*")
+# Sections that only make sense with tools bound (all of them: none; Multi-tool: fewer than two).
+_TOOL_SECTIONS = ("## Your tools", "## Multi-tool queries", "## Tool loop behavior")
+_MULTI_TOOL_SECTION = "## Multi-tool queries"
+
+
+@functools.lru_cache(maxsize=512)
+def _system_prompt(tool_names: Optional[tuple]) -> str:
+    """SYSTEM_PROMPT without the "Your tools" lines (and tool sections) that do not apply to this call."""
+    if tool_names is None:
+        return SYSTEM_PROMPT
+    if not tool_names:
+        dropped = _TOOL_SECTIONS
+    elif len(tool_names) < 2:
+        dropped = (_MULTI_TOOL_SECTION,)
+    else:
+        dropped = ()
+    lines = []
+    skipping = False
+    for line in SYSTEM_PROMPT.splitlines():
+        if line.startswith("## "):
+            skipping = line in dropped
+        if skipping:
+            continue
+        match = _TOOL_GUIDE_LINE.match(line)
+        if match and match.group(1) not in tool_names:
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _route_tools(state: ChatState) -> Tuple[Optional[tuple], Optional[dict]]:
+    """
+    Tools to bind for this model call (None = all), and the tool_route state update when the
+    route was computed here. The latest user message is routed (embedded) once per turn; the
+    turn's later model calls reuse state["tool_route"]. Tools already called since that message
+    stay bound so the rest of the turn can still use them.
+    """
+    if not TOOL_ROUTER_ENABLED:
+        return None, None
+    called = set()
+    for m in reversed(state["messages"]):
+        if isinstance(m, HumanMessage):
+            human = m
+            break
+        called.update(call.get("name") for call in getattr(m, "tool_calls", None) or [])
+    else:
+        return None, None
+    route = state.get("tool_route") or {}
+    update = None
+    if human.id and route.get("message_id") == human.id:
+        routed = route.get("tools")
+        routed = None if routed is None else tuple(routed)
+    else:
+        routed = tool_router.route(extract_ai_text(human.content))
+        update = {"message_id": human.id, "tools": None if routed is None else list(routed)}
+    if routed is None:
+        return None, update
+    return tuple(sorted(set(routed) | (called & TOOL_NAMES))), update
+
+
+def _chat_messages(state: ChatState, config: RunnableConfig, tool_names: Optional[tuple] = None) -> list:
+    """System prompt (+ voice / summary context) followed by the thread messages."""
     summary = state.get("summary", "")
     messages = state["messages"]
 
     voice_mode = bool((config or {}).get("configurable", {}).get("voice_mode", False))
-    system_parts = [SYSTEM_PROMPT, _reference_datetime_context()]
+    system_parts = [_system_prompt(tool_names), _reference_datetime_context()]
+    if PARALLEL_TOOL_CALLS and tool_names != ():
+        system_parts.append(PARALLEL_TOOLS_ADDENDUM)
     if voice_mode:
         system_parts.append(VOICE_ADDENDUM)
     if summary:
         system_parts.append(f"Long-Term Memory (Summary of past events):\n{summary}")
 
     system_msg = SystemMessage(content="\n\n".join(system_parts))
-    messages = [system_msg] + messages
+    return [system_msg] + messages
+
 
+def _count_new_messages(state: ChatState) -> dict:
+    """
+    Token counts for messages not yet in state.token_counts. New messages (user input,
+    tool results) are only ever appended, so this walks the uncounted tail — O(new), except
+    once for threads created before counts were kept.
+    """
+    known = state.get("token_counts") or {}
+    new_counts = {}
+    for m in reversed(state["messages"]):
+        if m.id in known:
+            break
+        new_counts[m.id] = count_message_tokens(m)
+    return new_counts
+
+
+def _counted_turn_update(new_counts: dict, gathered: AIMessage, tool_route: Optional[dict] = None) -> dict:
+    if not gathered.id:
+        gathered.id = str(uuid.uuid4())
+    new_counts[gathered.id] = count_message_tokens(gathered)
+    update = {
+        "messages": [gathered],
+        "token_counts": new_counts,
+        "history_tokens": sum(new_counts.values()),
+    }
+    if tool_route is not None:
+        update["tool_route"] = tool_route
+    return update
+
+
+def _response_cache_key(state: ChatState, config: RunnableConfig) -> Optional[Tuple[str, str]]:
+    """(namespace, question) when this call may use the answer cache: the thread's first
+    message, no summary, and no tool round yet in this turn (history would change the answer);
+    never for questions about the date or time (cacheable_question)."""
+    if not RESPONSE_CACHE_ENABLED or state.get("summary"):
+        return None
+    messages = state["messages"]
+    if len(messages) != 1 or not isinstance(messages[0], HumanMessage):
+        return None
+    question = extract_ai_text(messages[0].content).strip()
+    if not question or not cacheable_question(question):
+        return None
+    voice_mode = bool((config or {}).get("configurable", {}).get("voice_mode", False))
+    return ("voice" if voice_mode else "text", question)
+
+
+def _emit_cached_answer(answer: str, writer) -> AIMessage:
+    """Replay a cached answer through the normal token path, word by word like a model stream."""
+    if writer:
+        for piece in re.findall(r"\s*\S+\s*", answer) or [answer]:
+            writer({"token": piece})
+    return AIMessage(content=answer)
+
+
+def _cacheable_answer(gathered: AIMessage) -> Optional[str]:
+    if getattr(gathered, "tool_calls", None):
+        return None
+    return extract_ai_text(gathered.content).strip() or None
+
+
+def chat_node(state: ChatState, config: RunnableConfig):
+    """Main Chat Node — streams Groq tokens to the client while building the final AIMessage."""
+    cancel = _turn_cancel_flag(config)
+    _raise_if_cancelled(cancel)  # e.g. the client left while tools were running
     writer = get_stream_writer()
-    gathered = _run_chat_llm(messages, writer)
-    return {"messages": [gathered]}
+    new_counts = _count_new_messages(state)
+    counts = ChainMap(new_counts, state.get("token_counts") or {})
+    history_tokens = state.get("history_tokens", 0) + sum(new_counts.values())
+    cache_key = _response_cache_key(state, config)
+    cached = response_cache.lookup(*cache_key) if cache_key else None
+    if cached is not None:
+        return _counted_turn_update(new_counts, _emit_cached_answer(cached, writer))
+    tool_names, tool_route = _route_tools(state)
+    gathered = _run_chat_llm(
+        _chat_messages(state, config, tool_names),
+        writer,
+        counts,
+        history_tokens,
+        cancel,
+        tool_names,
+        _chat_priority(config),
+    )
+    answer = _cacheable_answer(gathered) if cache_key else None
+    if answer:
+        response_cache.store(*cache_key, answer)
+    return _counted_turn_update(new_counts, gathered, tool_route)
+
+
+async def achat_node(state: ChatState, config: RunnableConfig):
+    """Async Chat Node (async graph path)."""
+    cancel = _turn_cancel_flag(config)
+    _raise_if_cancelled(cancel)
+    writer = get_stream_writer()
+    new_counts = _count_new_messages(state)
+    counts = ChainMap(new_counts, state.get("token_counts") or {})
+    history_tokens = state.get("history_tokens", 0) + sum(new_counts.values())
+    cache_key = _response_cache_key(state, config)
+    # Embedding the question is CPU work; keep it off the event loop.
+    cached = await asyncio.to_thread(response_cache.lookup, *cache_key) if cache_key else None
+    if cached is not None:
+        return _counted_turn_update(new_counts, _emit_cached_answer(cached, writer))
+    tool_names, tool_route = await asyncio.to_thread(_route_tools, state) if TOOL_ROUTER_ENABLED else (None, None)
+    gathered = await _arun_chat_llm(
+        _chat_messages(state, config, tool_names),
+        writer,
+        counts,
+        history_tokens,
+        cancel,
+        tool_names,
+        _chat_priority(config),
+    )
+    answer = _cacheable_answer(gathered) if cache_key else None
+    if answer:
+        await asyncio.to_thread(response_cache.store, *cache_key, answer)
+    return _counted_turn_update(new_counts, gathered, tool_route)
 
 
 def _messages_to_plain_text(messages) -> str:
@@ -470,12 +1040,9 @@ def _messages_to_plain_text(messages) -> str:
     return "\n".join(lines)
 
 
-_RAW_WINDOW_CHAR_BUDGET = 4000
-
-
-def _split_by_char_budget(messages, budget: int):
+def _split_by_token_budget(messages, counts, budget: int):
     """Walk backwards from the most recent message, keeping messages raw
-    until the char budget runs out. Always keeps at least the last message,
+    until the token budget runs out (sizes from the cached per-message counts). Always keeps at least the last message,
     even if it alone exceeds the budget.
     Guarantee: the kept/raw window must include at least the most recent
     HumanMessage, even if that means exceeding the budget slightly. Some
@@ -484,8 +1051,7 @@ def _split_by_char_budget(messages, budget: int):
     kept = []
     total = 0
     for m in reversed(messages):
-        content = getattr(m, "content", "")
-        size = len(content) if isinstance(content, str) else len(str(content))
+        size = counts.get(m.id) or count_message_tokens(m)
         if kept and total + size > budget:
             break
         kept.append(m)
@@ -503,16 +1069,17 @@ def _split_by_char_budget(messages, budget: int):
     return messages[:cutoff], kept
 
 
-def summarize_conversation(state: ChatState):
-    """Compresses old messages into a summary. Only runs once a turn has fully
-    completed (see should_summarize) — never mid-tool-loop."""
+def _summary_request(state: ChatState):
+    """(prompt, messages_to_summarize) for summarize_conversation, or None when nothing to compact."""
     summary = state.get("summary", "")
     messages = state["messages"]
 
-    messages_to_summarize, _kept_raw = _split_by_char_budget(messages, _RAW_WINDOW_CHAR_BUDGET)
+    counts = state.get("token_counts") or {}
+    keep = int(_HISTORY_BUDGET * SUMMARY_KEEP_RATIO)
+    messages_to_summarize, _kept_raw = _split_by_token_budget(messages, counts, keep)
 
     if not messages_to_summarize:
-        return {"summary": summary}
+        return None
 
     plain_text = _messages_to_plain_text(messages_to_summarize)
 
@@ -530,16 +1097,50 @@ def summarize_conversation(state: ChatState):
             "PRESERVE specific entities (names, dates, errors, code snippets).\n\n"
             f"Lines:\n{plain_text}"
         )
+    return prompt, messages_to_summarize
+
+
+def _summary_update(state: ChatState, messages_to_summarize: list, new_summary: str) -> dict:
+    """New summary + RemoveMessages, with their token counts dropped from the running total."""
+    counts = state.get("token_counts") or {}
+    return {
+        "summary": new_summary,
+        "messages": [RemoveMessage(id=m.id) for m in messages_to_summarize],
+        "token_counts": {m.id: None for m in messages_to_summarize},
+        "history_tokens": -sum(counts.get(m.id, 0) for m in messages_to_summarize),
+    }
 
+
+def summarize_conversation(state: ChatState, config: RunnableConfig):
+    """Compresses old messages into a summary. Only runs once a turn has fully
+    completed (see should_summarize) — never mid-tool-loop."""
+    request = _summary_request(state)
+    if request is None:
+        return {"summary": state.get("summary", "")}
+    prompt, messages_to_summarize = request
+
+    # Inline: the turn (thread lock, chat slot, [DONE]) waits on this call, so it queues as chat.
+    groq_scheduler.wait_turn(SUMMARY_MODEL, _chat_priority(config), count_tokens(prompt) + SUMMARY_MAX_TOKENS)
     response = summary_llm.invoke(
         [HumanMessage(content=prompt)],
-        max_tokens=400,
+        max_tokens=SUMMARY_MAX_TOKENS,
     )
-    new_summary = response.content
+    return _summary_update(state, messages_to_summarize, response.content)
 
-    delete_messages = [RemoveMessage(id=m.id) for m in messages_to_summarize]
 
-    return {"summary": new_summary, "messages": delete_messages}
+async def asummarize_conversation(state: ChatState, config: RunnableConfig):
+    """Async twin of summarize_conversation."""
+    request = _summary_request(state)
+    if request is None:
+        return {"summary": state.get("summary", "")}
+    prompt, messages_to_summarize = request
+
+    await groq_scheduler.await_turn(SUMMARY_MODEL, _chat_priority(config), count_tokens(prompt) + SUMMARY_MAX_TOKENS)
+    response = await summary_llm.ainvoke(
+        [HumanMessage(content=prompt)],
+        max_tokens=SUMMARY_MAX_TOKENS,
+    )
+    return _summary_update(state, messages_to_summarize, response.content)
 
 
 def should_summarize(state: ChatState) -> Literal["tools", "summarize_conversation", END]:
@@ -550,49 +1151,231 @@ def should_summarize(state: ChatState) -> Literal["tools", "summarize_conversati
     messages = state["messages"]
     if hasattr(messages[-1], "tool_calls") and len(messages[-1].tool_calls) > 0:
         return "tools"
-    to_summarize, _kept_raw = _split_by_char_budget(messages, _RAW_WINDOW_CHAR_BUDGET)
-    if to_summarize:
+    if BACKGROUND_SUMMARY:
+        return END  # compaction_queue handles it after the turn
+    if state.get("history_tokens", 0) > _HISTORY_BUDGET:
         return "summarize_conversation"
     return END
 
 
 # 5. GRAPH CONSTRUCTION
 
-conn = sqlite3.connect("chatbot.db", check_same_thread=False, timeout=30)
-configure_sqlite_connection(conn)
-checkpointer = SqliteSaver(conn=conn)
-checkpointer.setup()
+CHATBOT_DB = "chatbot.db"
+# sqlite: chatbot.db on local disk (one host; pair with THREAD_LOCK_BACKEND=file or sqlite
+# when running several workers). postgres: shared by every replica (see pg_backend).
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite").strip().lower()
+
+if CHECKPOINT_BACKEND == "postgres":
+    import pg_backend
+
+    checkpointer = pg_backend.open_checkpointer()
+    db_readers = pg_backend.PgReaders()
+    db_writer = pg_backend.PgWriter()
+elif CHECKPOINT_BACKEND == "sqlite":
+    # One writer connection (queued, group-committed) + a pool of read-only WAL readers.
+    _writer_conn = sqlite3.connect(CHATBOT_DB, check_same_thread=False, timeout=30)
+    configure_sqlite_connection(_writer_conn)
+    db_writer = SqliteWriter(_writer_conn)
+    db_readers = SqliteReaderPool(CHATBOT_DB)
+    checkpointer = PooledSqliteSaver(db_writer, db_readers)
+else:
+    raise ValueError(f"Unknown CHECKPOINT_BACKEND {CHECKPOINT_BACKEND!r}; expected sqlite or postgres")
 
-graph = StateGraph(ChatState)
+thread_store = ThreadStore(db_readers, db_writer)
+thread_store.setup()
 
-graph.add_node("chat_node", chat_node)
-graph.add_node("tools", ToolNode(tools))
-graph.add_node("summarize_conversation", summarize_conversation)
+tool_node = ToolNode(tools)
 
-graph.add_edge(START, "chat_node")
-graph.add_conditional_edges("chat_node", should_summarize)
-graph.add_edge("tools", "chat_node")
-graph.add_edge("summarize_conversation", END)
 
+async def atool_node(state: ChatState, config: RunnableConfig):
+    """
+    ToolNode on the async graph. Its ainvoke gathers every tool call of the step at once —
+    max_concurrency only bounds the sync path's executor — so run at most
+    MAX_PARALLEL_TOOL_CALLS per batch. ToolMessages keep tool_call order.
+    """
+    last = state["messages"][-1]
+    calls = list(getattr(last, "tool_calls", None) or [])
+    if len(calls) <= MAX_PARALLEL_TOOL_CALLS:
+        return await tool_node.ainvoke(state, config)
+    results = []
+    for start in range(0, len(calls), MAX_PARALLEL_TOOL_CALLS):
+        batch = last.model_copy(update={"tool_calls": calls[start : start + MAX_PARALLEL_TOOL_CALLS]})
+        output = await tool_node.ainvoke({**state, "messages": [*state["messages"][:-1], batch]}, config)
+        results.extend(output["messages"])
+    return {"messages": results}
+
+
+def build_graph(chat_fn, summarize_fn, tools_fn=tool_node) -> StateGraph:
+    """Same topology for the sync and async paths; only the node callables differ."""
+    graph = StateGraph(ChatState)
+
+    graph.add_node("chat_node", chat_fn)
+    graph.add_node("tools", tools_fn)
+    graph.add_node("summarize_conversation", summarize_fn)
+
+    graph.add_edge(START, "chat_node")
+    graph.add_conditional_edges("chat_node", should_summarize)
+    graph.add_edge("tools", "chat_node")
+    graph.add_edge("summarize_conversation", END)
+    return graph
+
+
+graph = build_graph(chat_node, summarize_conversation)
 chatbot = graph.compile(checkpointer=checkpointer)
 
+# Async path (ASYNC_GRAPH=1): compiled lazily from FastAPI lifespan because the
+# Postgres async pool must be opened inside the running event loop.
+achatbot = None
+_async_conn = None  # psycopg AsyncConnectionPool (postgres); closed on shutdown
+
+
+async def init_async_graph() -> bool:
+    """Open the async checkpointer and compile achatbot. Returns False (sync fallback) on failure."""
+    global achatbot, _async_conn
+    if achatbot is not None:
+        return True
+    try:
+        if CHECKPOINT_BACKEND == "postgres":
+            async_checkpointer, _async_conn = await pg_backend.open_async_checkpointer()
+        else:
+            # Same writer and reader pool as the sync path: no second connection writing chatbot.db.
+            async_checkpointer = AsyncPooledSqliteSaver(checkpointer)
+        achatbot = build_graph(achat_node, asummarize_conversation, atool_node).compile(checkpointer=async_checkpointer)
+        return True
+    except Exception as exc:
+        print(f"WARNING: async graph unavailable, using thread-pool path: {type(exc).__name__}: {exc}")
+        achatbot = None
+        return False
+
+
+async def close_async_graph() -> None:
+    global achatbot, _async_conn
+    achatbot = None
+    if _async_conn is not None:
+        await _async_conn.close()
+        _async_conn = None
+
+
+def async_graph_ready() -> bool:
+    return achatbot is not None
+
+
+def compact_thread(thread_id: str) -> bool:
+    """
+    Background twin of summarize_conversation for one thread. The summary LLM call runs
+    without the thread lock; the update is applied under it only if the summarized
+    messages are still there and no other summary landed meanwhile.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    with get_thread_lock(thread_id):
+        values = chatbot.get_state(config).values
+    if values.get("history_tokens", 0) <= _HISTORY_BUDGET:
+        return False
+    request = _summary_request(values)
+    if request is None:
+        return False
+    prompt, messages_to_summarize = request
+
+    groq_scheduler.wait_turn(SUMMARY_MODEL, PRIORITY_BACKGROUND, count_tokens(prompt) + SUMMARY_MAX_TOKENS)
+    response = summary_llm.invoke([HumanMessage(content=prompt)], max_tokens=SUMMARY_MAX_TOKENS)
+
+    with get_thread_lock(thread_id):
+        current = chatbot.get_state(config).values
+        current_ids = {m.id for m in current.get("messages", [])}
+        if current.get("summary", "") != values.get("summary", "") or any(
+            m.id not in current_ids for m in messages_to_summarize
+        ):
+            return False
+        chatbot.update_state(
+            config,
+            _summary_update(current, messages_to_summarize, response.content),
+            as_node="summarize_conversation",
+        )
+    return True
+
+
+compaction_queue = CompactionQueue(compact_thread)
+
+# Checkpoint retention / vacuum (SQLite backend); the loop is started from FastAPI lifespan.
+db_maintenance = CheckpointMaintenance(CHATBOT_DB, thread_lock=get_thread_lock, writer=db_writer)
+
+
+def get_compaction_stats() -> dict:
+    return {"enabled": BACKGROUND_SUMMARY, **compaction_queue.stats()}
+
+
 # HELPER FUNCTIONS
 
 def retrieve_all_threads():
-    cursor = conn.cursor()
-    cursor.execute("SELECT DISTINCT thread_id FROM checkpoints")
-    return [row[0] for row in cursor.fetchall()]
+    """All thread ids, oldest first — served from the indexed thread_meta table."""
+    return thread_store.list_ids()
+
+def list_threads(limit: int = 50, offset: int = 0):
+    """Paginated thread metadata rows, most recently updated first."""
+    return thread_store.list_recent(limit=limit, offset=offset)
+
+def get_thread_meta(thread_id):
+    return thread_store.get(thread_id)
+
+# Threads created by a completed turn that are owed a generated title: thread_id -> first message.
+# Taken once the turn has released its thread lock and chat slot (take_pending_title).
+_pending_titles: dict[str, str] = {}
+
+def record_thread_turn(thread_id, message, reply, generate_title: bool = True):
+    """
+    Persist thread metadata after a turn. A new thread is stored with the message's fallback
+    title; with generate_title (completed turn) a generated one is then owed — see take_pending_title.
+    """
+    try:
+        created = thread_store.record_turn(thread_id, message, reply)
+    except Exception as exc:
+        print(f"[thread_meta error] thread={thread_id}: {type(exc).__name__}: {exc}")
+        return
+    if created and generate_title and message.strip():
+        _pending_titles[thread_id] = message
+
+def take_pending_title(thread_id) -> Optional[str]:
+    """The first message of a thread still owed a generated title (at most once), else None."""
+    return _pending_titles.pop(thread_id, None)
+
+def generate_thread_title(thread_id, message):
+    """Replace a new thread's fallback title with a generated one; runs outside the turn, at background priority."""
+    title = generate_summary(message)
+    if title == DEFAULT_TITLE:
+        return
+    try:
+        thread_store.set_title(thread_id, title)
+    except Exception as exc:
+        print(f"[thread_meta error] thread={thread_id}: {type(exc).__name__}: {exc}")
 
 def delete_thread_data(thread_id):
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
-    cursor.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
-    conn.commit()
+    """Checkpoints, writes and metadata of a thread, removed in one writer transaction."""
+    if CHECKPOINT_BACKEND == "postgres":
+        checkpointer.delete_thread(thread_id)
+        thread_store.delete(thread_id)
+        return
+
+    def delete(db: sqlite3.Connection) -> None:
+        db.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        db.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+        thread_store.delete(thread_id, db)
+
+    db_writer.run(delete)
+
+
+def get_db_stats() -> dict:
+    return {
+        "backend": CHECKPOINT_BACKEND,
+        "thread_lock_backend": THREAD_LOCK_BACKEND,
+        "writer": db_writer.stats(),
+        "readers": db_readers.stats(),
+    }
 
-def generate_summary(text):
+def generate_summary(text, priority: int = PRIORITY_BACKGROUND):
     """Title Generator (Separate from Memory Summary)"""
     try:
         msg = f"Summarize this into a 3-5 word title. No quotes: {text}"
+        groq_scheduler.wait_turn(SUMMARY_MODEL, priority, count_tokens(msg) + CHAT_MAX_TOKENS)
         response = summary_llm.invoke([HumanMessage(content=msg)])
         title = response.content.strip().replace('"', '').replace("'", "").replace("Title:", "").strip()
         return title if len(title) < 30 else title[:27] + "..."
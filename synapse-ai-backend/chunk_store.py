@@ -0,0 +1,246 @@
+"""
+On-disk chunk store (SQLite) keyed by FAISS label.
+
+- chunks.db lives next to index.faiss; each row is one chunk: label (the id FAISS returns),
+  doc_id (stable string id used by the ingestion manifest), text and JSON metadata.
+- rag_tool fetches only the k rows it returns — memory stays flat as the corpus grows and
+  nothing is unpickled at startup.
+- chunks_fts is an FTS5 inverted index over the chunk text (kept in sync by triggers) used
+  for BM25 lexical retrieval alongside the FAISS vectors.
+- Legacy LangChain indexes (index.pkl docstore) are migrated once with a restricted
+  unpickler that only accepts LangChain's InMemoryDocstore / Document classes, so no
+  arbitrary code can run:
+
+    python chunk_store.py migrate faiss_ethics_ch10
+
+  The Dockerfile runs this at build time; elsewhere the retriever migrates on first load
+  (the generated chunks.db is gitignored).
+"""
+
+import argparse
+import json
+import os
+import pickle
+import re
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+CHUNKS_DB = "chunks.db"
+LEGACY_DOCSTORE = "index.pkl"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    label    INTEGER PRIMARY KEY,
+    doc_id   TEXT NOT NULL UNIQUE,
+    text     TEXT NOT NULL,
+    metadata TEXT NOT NULL DEFAULT '{}'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    text, content='chunks', content_rowid='label', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, text) VALUES (new.label, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.label, old.text);
+END;
+"""
+
+# PRAGMA user_version: 1 = chunks only (first release), 2 = chunks + chunks_fts populated.
+_SCHEMA_VERSION = 2
+
+_FTS_PHRASE = re.compile(r'"([^"]+)"')
+_FTS_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(text: str) -> str:
+    """
+    User text → FTS5 MATCH expression: quoted phrases stay phrases, other words are OR'ed
+    terms (BM25 ranks documents matching more / rarer terms higher). Empty if nothing to match.
+    """
+    phrases = [" ".join(_FTS_TOKEN.findall(p)) for p in _FTS_PHRASE.findall(text or "")]
+    rest = _FTS_PHRASE.sub(" ", text or "")
+    terms = [f'"{p}"' for p in phrases if p]
+    terms += [f'"{t}"' for t in dict.fromkeys(_FTS_TOKEN.findall(rest))]
+    return " OR ".join(terms)
+
+
+class Chunk:
+    __slots__ = ("label", "doc_id", "text", "metadata")
+
+    def __init__(self, label: int, doc_id: str, text: str, metadata: dict):
+        self.label = label
+        self.doc_id = doc_id
+        self.text = text
+        self.metadata = metadata
+
+
+class ChunkStore:
+    """SQLite chunk table. Reads are safe to share across pool threads."""
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.executescript(_SCHEMA)
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                # Chunk stores written before chunks_fts existed: index their text once.
+                self.conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+                self.conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+                self.conn.commit()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_index_dir(cls, index_dir: str, readonly: bool = False) -> "ChunkStore":
+        return cls(os.path.join(index_dir, CHUNKS_DB), readonly=readonly)
+
+    def get_many(self, labels: Iterable[int]) -> dict[int, Chunk]:
+        labels = [int(i) for i in labels]
+        if not labels:
+            return {}
+        placeholders = ",".join("?" * len(labels))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT label, doc_id, text, metadata FROM chunks WHERE label IN ({placeholders})",
+                labels,
+            ).fetchall()
+        return {r[0]: Chunk(r[0], r[1], r[2], json.loads(r[3])) for r in rows}
+
+    def search_lexical(self, query: str, limit: int) -> list[int]:
+        """Labels of the best BM25 matches for query, best first."""
+        match = fts_query(query)
+        if not match:
+            return []
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, limit),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def next_label(self) -> int:
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(label) FROM chunks").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def add(self, doc_ids: list, texts: list, metadatas: list, labels: Optional[list] = None) -> list:
+        """Insert chunks (uncommitted until commit()); returns their FAISS labels."""
+        if labels is None:
+            start = self.next_label()
+            labels = list(range(start, start + len(doc_ids)))
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO chunks (label, doc_id, text, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (label, doc_id, text, json.dumps(meta, default=str))
+                    for label, doc_id, text, meta in zip(labels, doc_ids, texts, metadatas)
+                ],
+            )
+        return labels
+
+    def delete_doc_ids(self, doc_ids: list) -> list:
+        """Delete chunks by doc_id (uncommitted until commit()); returns the freed FAISS labels."""
+        if not doc_ids:
+            return []
+        placeholders = ",".join("?" * len(doc_ids))
+        with self.lock:
+            labels = [
+                r[0]
+                for r in self.conn.execute(
+                    f"SELECT label FROM chunks WHERE doc_id IN ({placeholders})", doc_ids
+                ).fetchall()
+            ]
+            self.conn.execute(f"DELETE FROM chunks WHERE doc_id IN ({placeholders})", doc_ids)
+        return labels
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM chunks")
+
+    def commit(self) -> None:
+        with self.lock:
+            self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# ── Legacy index.pkl migration ───────────────────────────────────────────────
+
+
+class _StateShim:
+    """Stand-in for pickled LangChain classes: keeps attribute state, runs no code."""
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # (dict_state, slots_state)
+            state = state[0] or {}
+        if isinstance(state, dict) and "__dict__" in state:  # pydantic v2
+            state = state["__dict__"]
+        self.__dict__.update(state or {})
+
+
+class _DocstoreShim(_StateShim):
+    pass
+
+
+class _DocumentShim(_StateShim):
+    pass
+
+
+class _LegacyDocstoreUnpickler(pickle.Unpickler):
+    _ALLOWED = {"InMemoryDocstore": _DocstoreShim, "Document": _DocumentShim}
+
+    def find_class(self, module, name):
+        if module.startswith("langchain") and name in self._ALLOWED:
+            return self._ALLOWED[name]
+        raise pickle.UnpicklingError(f"refusing to load {module}.{name} from legacy docstore")
+
+
+def migrate_legacy_docstore(index_dir: str) -> int:
+    """Convert index_dir/index.pkl into index_dir/chunks.db (labels = FAISS positions)."""
+    with open(os.path.join(index_dir, LEGACY_DOCSTORE), "rb") as f:
+        docstore, index_to_docstore_id = _LegacyDocstoreUnpickler(f).load()
+
+    docs = getattr(docstore, "_dict", {})
+    labels, doc_ids, texts, metadatas = [], [], [], []
+    for label, doc_id in sorted(index_to_docstore_id.items()):
+        doc = docs.get(doc_id)
+        if doc is None:
+            continue
+        labels.append(int(label))
+        doc_ids.append(str(doc_id))
+        texts.append(getattr(doc, "page_content", ""))
+        metadatas.append(getattr(doc, "metadata", {}) or {})
+
+    tmp_path = os.path.join(index_dir, CHUNKS_DB + ".tmp")
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    store = ChunkStore(tmp_path)
+    store.add(doc_ids, texts, metadatas, labels=labels)
+    store.commit()
+    store.close()
+    os.replace(tmp_path, os.path.join(index_dir, CHUNKS_DB))
+    return len(labels)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Chunk store utilities.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="convert a legacy index.pkl docstore into chunks.db")
+    migrate.add_argument("index_dir")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        n = migrate_legacy_docstore(args.index_dir)
+        print(f"migrated {n} chunks into {os.path.join(args.index_dir, CHUNKS_DB)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Background history compaction (BACKGROUND_SUMMARY=1).
+
+- The chat turn ends as soon as the reply is streamed; the summary LLM call runs here in a
+  small worker pool instead of as a graph node on the critical path.
+- Requests are coalesced per thread: while a thread's job is queued, further requests are
+  merged into it; a request arriving while it runs schedules exactly one re-run.
+- Before a thread's next turn the stream waits (bounded) for that thread's pending job, so
+  the summary / RemoveMessage update is applied before the model sees the history again.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+COMPACTION_WORKERS = max(1, int(os.getenv("COMPACTION_WORKERS", "2")))
+# How long a new turn waits for its thread's pending compaction before going ahead anyway.
+COMPACTION_WAIT_SEC = float(os.getenv("COMPACTION_WAIT_SEC", "30"))
+
+
+class _Job:
+    __slots__ = ("future", "running", "rerun")
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.running = False
+        self.rerun = False
+
+
+class CompactionQueue:
+    """Per-thread coalescing job queue; `compact_fn(thread_id) -> bool` does the work (True = applied)."""
+
+    def __init__(self, compact_fn: Callable[[str], bool], workers: int = COMPACTION_WORKERS):
+        self._compact_fn = compact_fn
+        self._workers = workers
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._jobs: dict = {}
+        self._lock = threading.Lock()
+        self._threads: list = []
+        self.requested = 0
+        self.coalesced = 0
+        self.applied = 0
+        self.skipped = 0
+        self.failed = 0
+        self.total_sec = 0.0
+
+    def _ensure_workers(self) -> None:
+        if self._threads:
+            return
+        for i in range(self._workers):
+            t = threading.Thread(target=self._run, name=f"compaction-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def request(self, thread_id: str) -> None:
+        """Schedule compaction for thread_id (no-op merge if one is already queued)."""
+        with self._lock:
+            self.requested += 1
+            job = self._jobs.get(thread_id)
+            if job is not None:
+                self.coalesced += 1
+                if job.running:
+                    job.rerun = True
+                return
+            self._jobs[thread_id] = _Job()
+            self._ensure_workers()
+        self._queue.put(thread_id)
+
+    def _pending(self, thread_id: str) -> Optional[Future]:
+        with self._lock:
+            job = self._jobs.get(thread_id)
+            return job.future if job is not None else None
+
+    def wait(self, thread_id: str, timeout: float = COMPACTION_WAIT_SEC) -> bool:
+        """Block until thread_id has no pending compaction; False if timeout expired first."""
+        future = self._pending(thread_id)
+        if future is None:
+            return True
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            return future.done()
+        return True
+
+    async def await_pending(self, thread_id: str, timeout: float = COMPACTION_WAIT_SEC) -> bool:
+        """Async twin of wait() — waits on the job's future without holding a pool thread."""
+        future = self._pending(thread_id)
+        if future is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            return False
+        except Exception:
+            pass
+        return True
+
+    def _run(self) -> None:
+        while True:
+            thread_id = self._queue.get()
+            if thread_id is None:
+                return
+            with self._lock:
+                job = self._jobs[thread_id]
+                job.running = True
+            started = time.perf_counter()
+            error = None
+            try:
+                applied = self._compact_fn(thread_id)
+            except Exception as exc:
+                applied = False
+                error = exc
+                print(f"[compaction error] thread={thread_id}: {type(exc).__name__}: {exc}")
+            with self._lock:
+                self.total_sec += time.perf_counter() - started
+                if error is not None:
+                    self.failed += 1
+                elif applied:
+                    self.applied += 1
+                else:
+                    self.skipped += 1
+                if job.rerun:
+                    job.running = False
+                    job.rerun = False
+                    self._queue.put(thread_id)
+                    continue
+                del self._jobs[thread_id]
+            job.future.set_result(applied)
+
+    def shutdown(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            runs = self.applied + self.skipped + self.failed
+            return {
+                "pending": len(self._jobs),
+                "requested": self.requested,
+                "coalesced": self.coalesced,
+                "applied": self.applied,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "avg_sec": round(self.total_sec / runs, 3) if runs else None,
+            }
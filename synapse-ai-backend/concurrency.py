@@ -1,35 +1,174 @@
 """
 Async concurrency controls for Hugging Face Spaces (single-process, many clients).
 
-- Semaphores cap in-flight work (default 50 concurrent chat streams).
-- ThreadPoolExecutor runs sync LangGraph / LLM calls without blocking the event loop.
+- Admission limits cap in-flight work: MAX_CONCURRENT_STREAMS chat streams, and for the
+  other endpoints one slot per worker of the pool they run in (io_slot).
+- Sync work runs in per-workload thread pools (bulkheads) so it never blocks the event loop
+  and one workload cannot starve another: chat streams, I/O endpoints (threads, history,
+  deletes), title generation, document ingestion and DB maintenance each get their own
+  workers (CHAT_POOL_SIZE, IO_POOL_SIZE, TITLE_POOL_SIZE, INGEST_POOL_SIZE,
+  MAINTENANCE_POOL_SIZE), with queue depth and wait time reported per pool.
+- A run_in_pool timeout really stops the job: a queued job is dropped, and a running one
+  has its cancel flag set, which it checks at its blocking points (raise_if_job_cancelled)
+  to end early and free its worker.
+- ASYNC_GRAPH=1 runs chat streams on the event loop (achatbot.astream) instead of the
+  pool, so the stream cap is no longer a thread count (MAX_CONCURRENT_STREAMS, default 400).
+- ADAPTIVE_CONCURRENCY=1 lets the chat admission limit float below MAX_CONCURRENT_STREAMS
+  with observed time-to-first-output, Groq 429/5xx and queueing (adaptive_limit.py).
 """
 
 import asyncio
+import contextvars
 import os
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from functools import partial
 from typing import Callable, Optional, TypeVar
 
+from adaptive_limit import AdaptiveLimiter
+
 T = TypeVar("T")
 
 MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "50"))
 CHAT_STREAM_TIMEOUT_SEC = int(os.getenv("CHAT_STREAM_TIMEOUT_SEC", "120"))
 IO_TIMEOUT_SEC = int(os.getenv("IO_TIMEOUT_SEC", "60"))
-
-# Admission control — up to N chat streams / heavy jobs at once
-chat_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-
-# Lighter endpoints (history, summary, thread list)
-io_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-
-executor = ThreadPoolExecutor(
-    max_workers=MAX_CONCURRENT_REQUESTS,
-    thread_name_prefix="synapse-worker",
+INGEST_TIMEOUT_SEC = int(os.getenv("INGEST_TIMEOUT_SEC", "600"))  # document uploads (parse + embed)
+# How often a running chat stream checks whether its client is still connected.
+DISCONNECT_POLL_SEC = float(os.getenv("DISCONNECT_POLL_SEC", "1.0"))
+# How often a pool job blocked on a lock or queue re-checks its cancel flag.
+JOB_CANCEL_POLL_SEC = 0.1
+
+ASYNC_GRAPH = os.getenv("ASYNC_GRAPH", "0") == "1"
+MAX_CONCURRENT_STREAMS = int(
+    os.getenv("MAX_CONCURRENT_STREAMS", "400" if ASYNC_GRAPH else str(MAX_CONCURRENT_REQUESTS))
 )
 
+# Admission control — up to N chat streams at once (N adapts when ADAPTIVE_CONCURRENCY=1)
+chat_limiter = AdaptiveLimiter(MAX_CONCURRENT_STREAMS)
+
+
+class JobCancelled(Exception):
+    """Raised inside a pool job whose caller timed out or went away."""
+
+
+_job_cancel: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar("job_cancel", default=None)
+
+
+def job_cancelled() -> bool:
+    """True inside a pool job whose run_in_pool caller has given up on it."""
+    cancel = _job_cancel.get()
+    return cancel is not None and cancel.is_set()
+
+
+def raise_if_job_cancelled() -> None:
+    if job_cancelled():
+        raise JobCancelled()
+
+
+class WorkerPool:
+    """A named ThreadPoolExecutor with queue / wait / timeout accounting."""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"synapse-{name}")
+        # io_slot admission: never more callers than workers, so none waits in the executor queue.
+        self.slots = asyncio.Semaphore(self.max_workers)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.dropped_queued = 0
+        self.stopped_running = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _run(self, cancel: threading.Event, enqueued: float, fn: Callable[..., T], args, kwargs) -> T:
+        waited = time.monotonic() - enqueued
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        token = _job_cancel.set(cancel)
+        try:
+            raise_if_job_cancelled()  # timed out while queued, after cancel() could still stop it
+            return fn(*args, **kwargs)
+        except JobCancelled:
+            with self._lock:
+                self.stopped_running += 1
+            raise
+        finally:
+            _job_cancel.reset(token)
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def _on_done(self, future) -> None:
+        if future.cancelled():  # never started: _run did not take it off the queue count
+            with self._lock:
+                self.queued -= 1
+                self.dropped_queued += 1
+
+    def submit(self, fn: Callable[..., T], *args, cancel: Optional[threading.Event] = None, **kwargs) -> asyncio.Future:
+        """Queue `fn` and return an awaitable future; `cancel` becomes the job's cancel flag."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(self._run, cancel or threading.Event(), time.monotonic(), fn, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return asyncio.wrap_future(future, loop=loop)
+
+    async def run(self, fn: Callable[..., T], *args, timeout: Optional[float] = None, **kwargs) -> T:
+        """Run `fn` in this pool; on timeout (or caller cancellation) the job is told to stop."""
+        cancel = threading.Event()
+        future = self.submit(fn, *args, cancel=cancel, **kwargs)
+        try:
+            if timeout is None:
+                return await future
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            cancel.set()
+            with self._lock:
+                self.timed_out += 1
+            raise
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            started = self.completed + self.running
+            return {
+                "workers": self.max_workers,
+                "running": self.running,
+                "queued": self.queued,
+                "completed": self.completed,
+                "avg_wait_sec": round(self._wait_total / started, 3) if started else None,
+                "max_wait_sec": round(self._wait_max, 3),
+                "timed_out": self.timed_out,
+                "dropped_queued": self.dropped_queued,
+                "stopped_running": self.stopped_running,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Bulkheads. Chat streams on the sync path hold a worker for the whole answer, so they get
+# the large pool; the short I/O endpoints keep their own workers even when it is saturated.
+chat_pool = WorkerPool("chat", int(os.getenv("CHAT_POOL_SIZE", str(MAX_CONCURRENT_REQUESTS))))
+io_pool = WorkerPool("io", int(os.getenv("IO_POOL_SIZE", "8")))
+title_pool = WorkerPool("title", int(os.getenv("TITLE_POOL_SIZE", "4")))
+ingest_pool = WorkerPool("ingest", int(os.getenv("INGEST_POOL_SIZE", "2")))
+maintenance_pool = WorkerPool("maintenance", int(os.getenv("MAINTENANCE_POOL_SIZE", "1")))
+POOLS = (chat_pool, io_pool, title_pool, ingest_pool, maintenance_pool)
+
 _active_chat_streams = 0
+# Streams that ended before [DONE], by cause: client gone, no output in time, or a run error.
+_unfinished_chat_streams = {"cancelled": 0, "timeout": 0, "error": 0}
 _active_chat_lock = asyncio.Lock()
 
 
@@ -45,48 +184,61 @@ async def track_chat_stream_finished() -> None:
         _active_chat_streams = max(0, _active_chat_streams - 1)
 
 
+async def record_chat_stream_ended(outcome: str) -> None:
+    """A stream ended before [DONE] and its run was stopped; outcome: cancelled, timeout or error."""
+    async with _active_chat_lock:
+        _unfinished_chat_streams[outcome] += 1
+
+
 async def get_concurrency_stats() -> dict:
     async with _active_chat_lock:
         active = _active_chat_streams
+        unfinished = dict(_unfinished_chat_streams)
+    admission = chat_limiter.stats()
     return {
         "max_concurrent_requests": MAX_CONCURRENT_REQUESTS,
+        "max_concurrent_streams": admission["max_limit"],
         "active_chat_streams": active,
-        "chat_slots_available": max(0, MAX_CONCURRENT_REQUESTS - active),
+        "chat_slots_available": max(0, admission["limit"] - active),
         "chat_stream_timeout_sec": CHAT_STREAM_TIMEOUT_SEC,
+        "cancelled_chat_streams": unfinished["cancelled"],
+        "timed_out_chat_streams": unfinished["timeout"],
+        "failed_chat_streams": unfinished["error"],
+        "chat_admission": admission,
+        "pools": {pool.name: pool.stats() for pool in POOLS},
     }
 
 
 @asynccontextmanager
 async def chat_slot():
     """Hold one chat concurrency slot for the full lifetime of a stream."""
-    await chat_semaphore.acquire()
+    await chat_limiter.acquire()
     await track_chat_stream_started()
     try:
         yield
     finally:
         await track_chat_stream_finished()
-        chat_semaphore.release()
+        await chat_limiter.release()
 
 
 @asynccontextmanager
-async def io_slot():
-    """Hold one slot for short blocking I/O (DB read, title generation)."""
-    await io_semaphore.acquire()
+async def io_slot(pool: Optional[WorkerPool] = None):
+    """Hold one of `pool`'s admission slots (default: the I/O pool) for a blocking call run in it."""
+    slots = (pool or io_pool).slots
+    await slots.acquire()
     try:
         yield
     finally:
-        io_semaphore.release()
+        slots.release()
 
 
-async def run_in_pool(fn: Callable[..., T], *args, timeout: Optional[int] = None, **kwargs) -> T:
-    """Run a sync callable in the shared thread pool."""
-    loop = asyncio.get_running_loop()
-    bound = partial(fn, *args, **kwargs)
-    coro = loop.run_in_executor(executor, bound)
-    if timeout is not None:
-        return await asyncio.wait_for(coro, timeout=timeout)
-    return await coro
+async def run_in_pool(
+    fn: Callable[..., T], *args, timeout: Optional[int] = None, pool: WorkerPool = io_pool, **kwargs
+) -> T:
+    """Run a sync callable in `pool` (default: the I/O pool); a timeout stops the job."""
+    return await pool.run(fn, *args, timeout=timeout, **kwargs)
 
 
 def shutdown_pool() -> None:
-    executor.shutdown(wait=False, cancel_futures=True)
+    for pool in POOLS:
+        pool.shutdown()
@@ -0,0 +1,244 @@
+"""
+Checkpoint retention and compaction for chatbot.db.
+
+- SqliteSaver appends a checkpoint (plus pending writes) on every super-step and never
+  deletes. This keeps the newest CHECKPOINT_KEEP_PER_THREAD checkpoints per thread/namespace
+  (LangGraph only needs the latest to resume; older ones are history for time travel),
+  deletes their writes, and sweeps writes whose checkpoint no longer exists.
+- Deletes and vacuum steps go through the app's single SqliteWriter, so they queue with
+  checkpoint writes as short jobs instead of competing for the write lock.
+- Free pages are returned to the OS with incremental vacuum when the DB has
+  auto_vacuum=INCREMENTAL, and the WAL is checkpointed with TRUNCATE so it does not stay at
+  its high-water mark. Switching an existing DB to incremental vacuum rewrites the whole file,
+  so it is an offline step, never done by the server:
+      python db_maintenance.py --enable-incremental-vacuum chatbot.db   # with the server stopped
+- Runs in a background task every DB_MAINTENANCE_INTERVAL_SEC; threads with a turn in
+  flight are skipped until the next pass. Reclaimed bytes are reported in /health.
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+CHECKPOINT_KEEP_PER_THREAD = max(1, int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "10")))
+DB_MAINTENANCE_INTERVAL_SEC = float(os.getenv("DB_MAINTENANCE_INTERVAL_SEC", "900"))
+DB_MAINTENANCE_ENABLED = os.getenv("DB_MAINTENANCE_ENABLED", "1") != "0"
+# Pages released per incremental_vacuum call (keeps each write transaction short).
+VACUUM_PAGES_PER_STEP = 2000
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class CheckpointMaintenance:
+    """
+    Retention + vacuum for one checkpoint database; `thread_lock(thread_id)` guards live turns.
+    Writes run through `writer` (sqlite_pool.SqliteWriter); without one, on a private connection.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        thread_lock: Callable[[str], threading.Lock],
+        keep: int = CHECKPOINT_KEEP_PER_THREAD,
+        writer=None,
+    ):
+        self.db_path = db_path
+        self.thread_lock = thread_lock
+        self.writer = writer
+        self.keep = keep
+        self._run_lock = threading.Lock()
+        self.runs = 0
+        self.last_run: Optional[dict] = None
+        self.total_checkpoints_deleted = 0
+        self.total_writes_deleted = 0
+        self.total_bytes_reclaimed = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _disk_bytes(self) -> int:
+        return _file_size(self.db_path) + _file_size(self.db_path + "-wal")
+
+    def _has_checkpoint_tables(self, conn: sqlite3.Connection) -> bool:
+        names = {
+            r[0]
+            for r in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('checkpoints', 'writes')"
+            )
+        }
+        return names == {"checkpoints", "writes"}
+
+    def _write(self, conn: sqlite3.Connection, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        if self.writer is not None:
+            return self.writer.run(fn)
+        with conn:
+            return fn(conn)
+
+    def _prune_thread(self, conn: sqlite3.Connection, thread_id: str, ns: str) -> tuple[int, int]:
+        row = conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+            (thread_id, ns, self.keep - 1),
+        ).fetchone()
+        if row is None:
+            return 0, 0
+        params = (thread_id, ns, row[0])
+
+        def prune(db: sqlite3.Connection) -> tuple[int, int]:
+            writes = db.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?", params
+            ).rowcount
+            checkpoints = db.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?", params
+            ).rowcount
+            return checkpoints, writes
+
+        return self._write(conn, prune)
+
+    def _incremental_vacuum(self, conn: sqlite3.Connection) -> bool:
+        """Release free pages in short steps; False when the DB was never switched to INCREMENTAL."""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return False
+
+        def step(db: sqlite3.Connection) -> int:
+            db.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+            return db.execute("PRAGMA freelist_count").fetchone()[0]
+
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            if self._write(conn, step) == 0:
+                break
+        return True
+
+    def run_once(self) -> dict:
+        """One maintenance pass (blocking). Returns the pass report."""
+        with self._run_lock:
+            started = time.perf_counter()
+            bytes_before = self._disk_bytes()
+            conn = self._connect()
+            try:
+                if not self._has_checkpoint_tables(conn):
+                    return {}
+                over_limit = conn.execute(
+                    "SELECT thread_id, checkpoint_ns FROM checkpoints "
+                    "GROUP BY thread_id, checkpoint_ns HAVING COUNT(*) > ?",
+                    (self.keep,),
+                ).fetchall()
+
+                deleted_checkpoints = deleted_writes = skipped_busy = 0
+                for thread_id, ns in over_limit:
+                    lock = self.thread_lock(thread_id)
+                    if not lock.acquire(blocking=False):
+                        skipped_busy += 1
+                        continue
+                    try:
+                        c, w = self._prune_thread(conn, thread_id, ns)
+                    finally:
+                        lock.release()
+                    deleted_checkpoints += c
+                    deleted_writes += w
+
+                deleted_writes += self._write(
+                    conn,
+                    lambda db: db.execute(
+                        "DELETE FROM writes WHERE NOT EXISTS ("
+                        " SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id"
+                        " AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id)"
+                    ).rowcount,
+                )
+
+                incremental = self._incremental_vacuum(conn)
+                busy, _wal_pages, _moved = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            finally:
+                conn.close()
+
+            bytes_after = self._disk_bytes()
+            report = {
+                "finished_at": time.time(),
+                "duration_sec": round(time.perf_counter() - started, 3),
+                "threads_pruned": len(over_limit) - skipped_busy,
+                "threads_skipped_busy": skipped_busy,
+                "checkpoints_deleted": deleted_checkpoints,
+                "writes_deleted": deleted_writes,
+                "wal_checkpoint_busy": bool(busy),
+                "incremental_vacuum": incremental,
+                "bytes_before": bytes_before,
+                "bytes_after": bytes_after,
+                "bytes_reclaimed": max(0, bytes_before - bytes_after),
+            }
+            self.runs += 1
+            self.last_run = report
+            self.total_checkpoints_deleted += deleted_checkpoints
+            self.total_writes_deleted += deleted_writes
+            self.total_bytes_reclaimed += report["bytes_reclaimed"]
+            return report
+
+    async def run_forever(self, run_in_pool, interval: float = DB_MAINTENANCE_INTERVAL_SEC) -> None:
+        """Background loop for FastAPI lifespan; each pass runs in the worker pool."""
+        while True:
+            try:
+                report = await run_in_pool(self.run_once)
+                if report.get("checkpoints_deleted") or report.get("bytes_reclaimed"):
+                    print(
+                        f"[db_maintenance] deleted {report['checkpoints_deleted']} checkpoints, "
+                        f"{report['writes_deleted']} writes; reclaimed {report['bytes_reclaimed']} bytes"
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"[db_maintenance error] {type(exc).__name__}: {exc}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": DB_MAINTENANCE_ENABLED,
+            "keep_per_thread": self.keep,
+            "interval_sec": DB_MAINTENANCE_INTERVAL_SEC,
+            "runs": self.runs,
+            "db_bytes": self._disk_bytes(),
+            "total_checkpoints_deleted": self.total_checkpoints_deleted,
+            "total_writes_deleted": self.total_writes_deleted,
+            "total_bytes_reclaimed": self.total_bytes_reclaimed,
+            "last_run": self.last_run,
+        }
+
+
+def enable_incremental_vacuum(db_path: str) -> None:
+    """Switch a DB to auto_vacuum=INCREMENTAL. Rewrites the whole file: run with the server stopped."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print(f"{db_path}: auto_vacuum is already INCREMENTAL")
+            return
+        started = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        print(f"{db_path}: auto_vacuum=INCREMENTAL enabled in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline maintenance for the checkpoint database.")
+    parser.add_argument("db", help="path to chatbot.db")
+    parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="one-time full VACUUM so later passes can return free pages (server must be stopped)",
+    )
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum(args.db)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
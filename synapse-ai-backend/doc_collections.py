@@ -0,0 +1,171 @@
+"""
+Per-thread and per-user document collections for rag_tool.
+
+- Each collection is its own index directory (index.faiss + chunks.db + manifest.json,
+  exactly what embedder.py writes) under RAG_COLLECTIONS_DIR/<scope>/<owner>/, with the
+  uploaded originals kept in sources/ so re-uploads ingest incrementally.
+- rag_tool resolves collections from the run config: `thread_id` (always set by the chat
+  endpoints) and the optional `user_id`. Only collections that have an index are searched,
+  so threads without uploads cost nothing.
+- Loaded indexes live in retriever's memory-budgeted LRU; ingesting or deleting a
+  collection invalidates its cache entry.
+"""
+
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import retriever
+from concurrency import JOB_CANCEL_POLL_SEC, job_cancelled, raise_if_job_cancelled
+
+COLLECTIONS_DIR = os.getenv("RAG_COLLECTIONS_DIR", os.path.join(retriever.BASE_DIR, "collections"))
+SCOPES = ("thread", "user")
+SOURCES_DIR = "sources"
+UPLOAD_EXTENSIONS = (".pdf", ".txt", ".md")  # embedder.SUPPORTED_EXTENSIONS (not imported: pulls in FAISS)
+RAG_UPLOAD_MAX_MB = int(os.getenv("RAG_UPLOAD_MAX_MB", "20"))
+RAG_UPLOAD_WORKERS = int(os.getenv("RAG_UPLOAD_WORKERS", "1"))
+
+_SAFE_OWNER = re.compile(r"[A-Za-z0-9_.-]{1,128}")
+
+# index_dir -> [lock, refs]; an entry lives only while someone holds or waits for it.
+_ingest_locks: dict = {}
+_ingest_locks_guard = threading.Lock()
+
+
+def collection_dir(scope: str, owner: str) -> str:
+    """Index directory of a collection; ValueError for unknown scopes or unsafe owner ids."""
+    if scope not in SCOPES:
+        raise ValueError(f"Unknown collection scope {scope!r}; expected one of {SCOPES}")
+    if not _SAFE_OWNER.fullmatch(owner or "") or owner.strip(".") == "":
+        raise ValueError(f"Invalid {scope} id for a document collection: {owner!r}")
+    return os.path.join(COLLECTIONS_DIR, scope, owner)
+
+
+def _has_index(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, "index.faiss"))
+
+
+def resolve_collection_dirs(config: Optional[dict]) -> list:
+    """Existing collection directories for the run config's thread_id / user_id (thread first)."""
+    configurable = (config or {}).get("configurable") or {}
+    dirs = []
+    for scope, key in (("thread", "thread_id"), ("user", "user_id")):
+        owner = configurable.get(key)
+        if not owner:
+            continue
+        try:
+            index_dir = collection_dir(scope, str(owner))
+        except ValueError:
+            continue
+        if _has_index(index_dir):
+            dirs.append(index_dir)
+    return dirs
+
+
+@contextmanager
+def _ingest_lock(index_dir: str) -> Iterator[None]:
+    """Hold the collection's ingest lock; waits in steps so a timed-out job gives up."""
+    with _ingest_locks_guard:
+        entry = _ingest_locks.setdefault(index_dir, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        while not entry[0].acquire(timeout=JOB_CANCEL_POLL_SEC):
+            raise_if_job_cancelled()
+        try:
+            yield
+        finally:
+            entry[0].release()
+    finally:
+        with _ingest_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _ingest_locks[index_dir]
+
+
+def _safe_filename(filename: str) -> str:
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    if not name or name.startswith(".") or not name.lower().endswith(UPLOAD_EXTENSIONS):
+        raise ValueError(f"Unsupported file {filename!r}; upload {', '.join(UPLOAD_EXTENSIONS)} files")
+    return name
+
+
+def add_documents(scope: str, owner: str, files: list) -> dict:
+    """
+    Save uploaded (filename, bytes) pairs into the collection and ingest them (blocking —
+    call from the worker pool). Files with unchanged content are skipped by the manifest.
+    """
+    import embedder
+
+    index_dir = collection_dir(scope, owner)
+    limit = RAG_UPLOAD_MAX_MB << 20
+    named = []
+    for filename, data in files:
+        name = _safe_filename(filename)
+        if len(data) > limit:
+            raise ValueError(f"{name} is larger than {RAG_UPLOAD_MAX_MB} MB")
+        named.append((name, data))
+    if not named:
+        raise ValueError("No files uploaded")
+
+    sources = os.path.join(index_dir, SOURCES_DIR)
+    with _ingest_lock(index_dir):
+        os.makedirs(sources, exist_ok=True)
+        paths = []
+        for name, data in named:
+            path = os.path.join(sources, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            paths.append(path)
+        report = embedder.ingest(
+            paths,
+            index_dir=index_dir,
+            workers=RAG_UPLOAD_WORKERS,
+            embeddings=retriever.get_embeddings(),
+            should_stop=job_cancelled,  # stop between files once the upload request timed out
+        )
+        retriever.invalidate_collection(index_dir)
+    return {
+        "collection": f"{scope}/{owner}",
+        "added": [os.path.basename(p) for p in report.added],
+        "updated": [os.path.basename(p) for p in report.updated],
+        "skipped": [os.path.basename(p) for p in report.skipped],
+        "failed": {os.path.basename(p): err for p, err in report.failed.items()},
+        "chunks_added": report.chunks_added,
+        "elapsed_sec": report.elapsed_sec,
+    }
+
+
+def list_documents(scope: str, owner: str) -> dict:
+    """Files indexed in a collection, from its manifest."""
+    import json
+
+    index_dir = collection_dir(scope, owner)
+    manifest_path = os.path.join(index_dir, "manifest.json")
+    files = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            files = json.load(f).get("files", {})
+    return {
+        "collection": f"{scope}/{owner}",
+        "documents": [
+            {"name": os.path.basename(path), "chunks": entry.get("chunks", 0), "ingested_at": entry.get("ingested_at")}
+            for path, entry in sorted(files.items())
+        ],
+    }
+
+
+def delete_collection(scope: str, owner: str) -> bool:
+    """Remove a collection's index and sources; True if one existed."""
+    try:
+        index_dir = collection_dir(scope, owner)
+    except ValueError:
+        return False
+    with _ingest_lock(index_dir):
+        retriever.invalidate_collection(index_dir)
+        if not os.path.isdir(index_dir):
+            return False
+        shutil.rmtree(index_dir, ignore_errors=True)
+    return True
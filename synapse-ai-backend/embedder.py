@@ -1,18 +1,284 @@
-from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_huggingface import HuggingFaceEmbeddings
-
-def generate_vectorstore():
-    loader = PyPDFLoader("C:\\Users\\devam\\OneDrive\\Desktop\\CAMPUSX_GENAI\\Lang-Graph\\chatbot_with_ui\\Ethics of Data Science- Chapter10.pdf")
-    docs = loader.load()
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000,chunk_overlap=200)
-    chunks = splitter.split_documents(docs)
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vector_store = FAISS.from_documents(chunks,embeddings)
-    vector_store.save_local("faiss_ethics_ch10")
-    return vector_store
-
-if __name__=="__main__":
-    generate_vectorstore()
\ No newline at end of file
+"""
+Incremental document ingestion into the FAISS index used by rag_tool.
+
+- Takes files and/or directories (PDF, .txt, .md); directories are walked recursively.
+- Files are hashed first; unchanged files (same SHA-256 as in the manifest) are skipped.
+- Changed/new files are parsed + split in a process pool, then embedded in batches as each
+  file finishes and appended to the existing index — no full rebuild. A changed file's
+  old chunks are deleted from the index before its new chunks are added.
+- The pool uses the "spawn" start method: ingest also runs inside the multi-threaded
+  server (uploads), where a forked child can inherit a held lock and deadlock.
+- manifest.json next to the index records what is indexed (hash, chunk ids, timestamp);
+  chunk text/metadata go to chunks.db (chunk_store.py, which also maintains the BM25
+  inverted index used by hybrid search), vectors to index.faiss.
+
+CLI:
+    python embedder.py docs/                    # ingest a directory
+    python embedder.py a.pdf b.pdf --workers 4  # specific files
+    python embedder.py docs/ --prune            # also drop files no longer present
+    python embedder.py docs/ --rebuild          # start a fresh index
+
+Note: an index built before the manifest existed has no record of its sources — run once
+with --rebuild over the full corpus to avoid duplicating those chunks. A running server
+picks up the new index on its next start.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Optional
+
+import faiss
+import numpy as np
+
+import chunk_store
+import faiss_index
+from retriever import EMBEDDING_MODEL, FAISS_DIR
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md")
+MANIFEST_NAME = "manifest.json"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+
+@dataclass
+class IngestReport:
+    added: list = field(default_factory=list)
+    updated: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    failed: dict = field(default_factory=dict)
+    chunks_added: int = 0
+    elapsed_sec: float = 0.0
+    stopped: bool = False  # should_stop() ended the run early; the remaining files were not ingested
+
+
+def _iter_source_files(paths: Iterable[str]) -> Iterator[str]:
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for root, _dirs, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif os.path.isfile(path) and path.lower().endswith(SUPPORTED_EXTENSIONS):
+            yield path
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse_and_split(path: str) -> list:
+    """Runs in a worker process: load one file and split it into (text, metadata) chunks."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if path.lower().endswith(".pdf"):
+        from langchain_community.document_loaders import PyPDFLoader
+
+        docs = PyPDFLoader(path).load()
+    else:
+        from langchain_community.document_loaders import TextLoader
+
+        docs = TextLoader(path, encoding="utf-8").load()
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return [(c.page_content, dict(c.metadata)) for c in splitter.split_documents(docs)]
+
+
+def load_manifest(index_dir: str = FAISS_DIR) -> dict:
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"version": 1, "embedding_model": EMBEDDING_MODEL, "files": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(index_dir: str, manifest: dict) -> None:
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _batched(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class _IndexWriter:
+    """
+    Appends embedded batches to the flat master index (IndexIDMap2, labels = chunk_store
+    labels) and the chunk store, creating both on the first batch if needed.
+    """
+
+    def __init__(self, index_dir: str, embeddings, rebuild: bool):
+        self.index_dir = index_dir
+        self.index_path = os.path.join(index_dir, faiss_index.INDEX_FILE)
+        self.embeddings = embeddings
+        os.makedirs(index_dir, exist_ok=True)
+        if not rebuild and os.path.exists(self.index_path) and not os.path.exists(
+            os.path.join(index_dir, chunk_store.CHUNKS_DB)
+        ):
+            chunk_store.migrate_legacy_docstore(index_dir)
+        self.chunks = chunk_store.ChunkStore.for_index_dir(index_dir)
+        self.index = None
+        if rebuild:
+            self.chunks.clear()
+        elif os.path.exists(self.index_path):
+            self.index = faiss_index.ensure_id_map(faiss.read_index(self.index_path))
+
+    def delete(self, doc_ids: list) -> None:
+        labels = self.chunks.delete_doc_ids(doc_ids)
+        if self.index is not None and labels:
+            self.index.remove_ids(np.asarray(labels, dtype="int64"))
+
+    def add(self, texts: list, metadatas: list, doc_ids: list) -> None:
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype="float32")
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+        labels = self.chunks.add(doc_ids, texts, metadatas)
+        self.index.add_with_ids(vectors, np.asarray(labels, dtype="int64"))
+
+    def save(self) -> None:
+        if self.index is None:
+            return
+        tmp = self.index_path + ".tmp"
+        faiss.write_index(self.index, tmp)
+        os.replace(tmp, self.index_path)
+        self.chunks.commit()
+
+
+def ingest(
+    paths: Iterable[str],
+    index_dir: str = FAISS_DIR,
+    workers: Optional[int] = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    rebuild: bool = False,
+    prune: bool = False,
+    embeddings=None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> IngestReport:
+    """
+    Ingest files/directories into the index at index_dir; see module docstring.
+    Pass `embeddings` to reuse an already loaded model (the server's upload path).
+    `should_stop` is checked between files; once it returns True the files ingested so far
+    are saved and the rest are left for the next run.
+    """
+
+    started = time.perf_counter()
+    report = IngestReport()
+    manifest = {"version": 1, "embedding_model": EMBEDDING_MODEL, "files": {}} if rebuild else load_manifest(index_dir)
+    files = manifest["files"]
+
+    sources = sorted(set(_iter_source_files(paths)))
+    pending = {}
+    for path in sources:
+        sha = _file_sha256(path)
+        entry = files.get(path)
+        if entry and entry.get("sha256") == sha:
+            report.skipped.append(path)
+        else:
+            pending[path] = sha
+
+    stale = [p for p in files if p not in set(sources)] if prune else []
+    if not pending and not stale:
+        report.elapsed_sec = round(time.perf_counter() - started, 3)
+        return report
+
+    if embeddings is None:
+        from embeddings import load_embeddings
+
+        embeddings, _backend = load_embeddings(EMBEDDING_MODEL)
+    writer = _IndexWriter(index_dir, embeddings, rebuild=rebuild)
+
+    for path in stale:
+        writer.delete(files[path].get("chunk_ids", []))
+        del files[path]
+        report.removed.append(path)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(_parse_and_split, path): path for path in pending}
+        for future in as_completed(futures):
+            if should_stop is not None and should_stop():
+                for queued in futures:
+                    queued.cancel()
+                report.stopped = True
+                break
+            path = futures[future]
+            try:
+                chunks = future.result()
+            except Exception as exc:
+                report.failed[path] = f"{type(exc).__name__}: {exc}"
+                continue
+
+            previous = files.get(path)
+            if previous:
+                writer.delete(previous.get("chunk_ids", []))
+
+            sha = pending[path]
+            # Path + content in the id so identical copies of one file never collide.
+            path_key = hashlib.sha256(path.encode("utf-8")).hexdigest()[:12]
+            chunk_ids = [f"{path_key}:{sha[:12]}:{i}" for i in range(len(chunks))]
+            for batch in _batched(list(zip(chunk_ids, chunks)), batch_size):
+                ids = [cid for cid, _ in batch]
+                texts = [text for _, (text, _meta) in batch]
+                metadatas = [{**meta, "source": path, "sha256": sha} for _, (_text, meta) in batch]
+                writer.add(texts, metadatas, ids)
+
+            files[path] = {
+                "sha256": sha,
+                "chunks": len(chunks),
+                "chunk_ids": chunk_ids,
+                "ingested_at": time.time(),
+            }
+            (report.updated if previous else report.added).append(path)
+            report.chunks_added += len(chunks)
+
+    writer.save()
+    manifest["embedding_model"] = EMBEDDING_MODEL
+    _save_manifest(index_dir, manifest)
+    report.elapsed_sec = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Incrementally ingest documents into the FAISS index.")
+    parser.add_argument("paths", nargs="+", help="files or directories to ingest")
+    parser.add_argument("--index-dir", default=FAISS_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--rebuild", action="store_true", help="ignore the existing index and manifest")
+    parser.add_argument("--prune", action="store_true", help="remove indexed files not among the given paths")
+    args = parser.parse_args()
+
+    report = ingest(
+        args.paths,
+        index_dir=args.index_dir,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        rebuild=args.rebuild,
+        prune=args.prune,
+    )
+    print(
+        f"added={len(report.added)} updated={len(report.updated)} skipped={len(report.skipped)} "
+        f"removed={len(report.removed)} failed={len(report.failed)} "
+        f"chunks={report.chunks_added} in {report.elapsed_sec}s"
+    )
+    for path, err in report.failed.items():
+        print(f"  FAILED {path}: {err}")
+
+
+if __name__ == "__main__":
+    main()
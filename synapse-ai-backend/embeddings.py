@@ -0,0 +1,108 @@
+"""
+Embedding backends for the retriever.
+
+- EMBEDDING_BACKEND=torch (default): HuggingFaceEmbeddings on PyTorch, as before.
+- EMBEDDING_BACKEND=onnx: the same all-MiniLM-L6-v2 weights through ONNX Runtime with the
+  int8-quantized graph shipped in the model repo (needs `pip install optimum[onnxruntime]`).
+  Falls back to torch if ONNX Runtime is unavailable.
+- Either backend is wrapped in an LRU cache of query embeddings keyed by normalized text.
+
+Both backends run the same model with the same pooling/normalization, so vectors stay
+compatible with the existing faiss_ethics_ch10 index (the retriever checks the dimension).
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").strip().lower()
+# Portable AVX2 build; use onnx/model_qint8_avx512_vnni.onnx on AVX512-VNNI CPUs.
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+
+
+class OnnxSentenceTransformerEmbeddings(Embeddings):
+    """sentence-transformers model served by ONNX Runtime (CPU)."""
+
+    def __init__(self, model_name: str, onnx_file: str = EMBEDDING_ONNX_FILE):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.onnx_file = onnx_file
+        self._model = SentenceTransformer(
+            model_name,
+            backend="onnx",
+            model_kwargs={"file_name": onnx_file, "provider": "CPUExecutionProvider"},
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._model.encode(list(texts), convert_to_numpy=True).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _normalize_query(text: str) -> str:
+    # all-MiniLM-L6-v2 uses an uncased tokenizer, so case-folding does not change the vector.
+    return " ".join((text or "").split()).casefold()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """LRU cache in front of embed_query; embed_documents passes straight through."""
+
+    def __init__(self, inner: Embeddings, max_entries: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.inner = inner
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = _normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+        vector = self.inner.embed_query(key)
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def load_embeddings(model_name: str, backend: str = EMBEDDING_BACKEND):
+    """Return (embeddings, backend actually used)."""
+    inner = None
+    used = "torch"
+    if backend == "onnx":
+        try:
+            inner = OnnxSentenceTransformerEmbeddings(model_name)
+            used = "onnx"
+        except Exception as exc:
+            print(f"[embeddings] ONNX backend unavailable, using torch: {type(exc).__name__}: {exc}")
+    if inner is None:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        inner = HuggingFaceEmbeddings(model_name=model_name)
+    return CachedQueryEmbeddings(inner), used
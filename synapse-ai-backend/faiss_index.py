@@ -0,0 +1,184 @@
+"""
+FAISS index types for serving: flat, IVF, IVF-PQ and HNSW.
+
+- The ingestion pipeline (embedder.py) maintains a flat "master" index; `convert` derives a
+  serving index of another type from it (vectors are reconstructed, chunk store copied as-is).
+- Serving indexes are opened memory-mapped (read-only) when FAISS supports it for the type,
+  so several worker processes share the same page-cache pages.
+- Search parameters are per deployment: FAISS_NPROBE (IVF*) and FAISS_EF_SEARCH (HNSW).
+- Labels returned by search are chunk_store labels; the master index is an IndexIDMap2 so
+  chunks can be deleted without shifting the labels of the others.
+
+CLI:
+    python faiss_index.py faiss_ethics_ch10 faiss_ethics_ch10_hnsw --type hnsw
+    python faiss_index.py faiss_ethics_ch10 faiss_ethics_ch10_ivfpq --type ivfpq --nlist 256 --pq-m 48
+"""
+
+import argparse
+import math
+import os
+import shutil
+from typing import Optional
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw")
+INDEX_FILE = "index.faiss"
+
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") != "0"
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+
+def default_nlist(n_vectors: int) -> int:
+    """~4·sqrt(n) lists, capped so every list gets ≥39 training points (FAISS' minimum)."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39 or 1))
+
+
+def _pq_nbits(n_vectors: int) -> int:
+    # PQ training needs ≥ 2^nbits points per sub-quantizer.
+    return max(1, min(8, int(math.log2(max(2, n_vectors)))))
+
+
+def build_index(
+    vectors: np.ndarray,
+    kind: str,
+    ids: Optional[np.ndarray] = None,
+    nlist: Optional[int] = None,
+    pq_m: int = 48,
+    hnsw_m: int = 32,
+    ef_construction: int = 200,
+) -> faiss.Index:
+    """
+    Build and populate an index of `kind` over `vectors` (float32, shape n×d, L2 metric).
+    With `ids`, search returns those labels instead of positions.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, d = vectors.shape
+    if kind in ("flat", "hnsw"):
+        if kind == "flat":
+            index = faiss.IndexFlatL2(d)
+        else:
+            index = faiss.IndexHNSWFlat(d, hnsw_m)
+            index.hnsw.efConstruction = ef_construction
+        if ids is not None:
+            index = faiss.IndexIDMap2(index)
+    elif kind in ("ivf", "ivfpq"):
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatL2(d)
+        if kind == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            if d % pq_m:
+                raise ValueError(f"pq_m={pq_m} must divide the vector dimension {d}")
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, _pq_nbits(n))
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown index type {kind!r}; expected one of {INDEX_TYPES}")
+    if ids is not None:
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype="int64"))
+    else:
+        index.add(vectors)
+    return index
+
+
+def _unwrap(index: faiss.Index) -> faiss.Index:
+    """The underlying index of an IndexIDMap/IndexIDMap2 wrapper (or the index itself)."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def ensure_id_map(index: faiss.Index) -> faiss.Index:
+    """Wrap a plain flat index (labels = positions) in IndexIDMap2 so labels survive deletes."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) or faiss.try_extract_index_ivf(index):
+        return index
+    vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), "float32")
+    wrapped = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+    if index.ntotal:
+        wrapped.add_with_ids(vectors, np.arange(index.ntotal, dtype="int64"))
+    return wrapped
+
+
+def index_kind(index: faiss.Index) -> str:
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivfpq" if isinstance(ivf, faiss.IndexIVFPQ) else "ivf"
+    return "flat"
+
+
+def apply_search_params(
+    index: faiss.Index,
+    nprobe: int = FAISS_NPROBE,
+    ef_search: int = FAISS_EF_SEARCH,
+) -> faiss.Index:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    base = _unwrap(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+    return index
+
+
+def read_index(path: str, mmap: bool = FAISS_MMAP) -> faiss.Index:
+    """Open an index read-only and memory-mapped; fall back to a plain read for types that can't mmap."""
+    if mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path)
+
+
+def reconstruct_all(index: faiss.Index) -> tuple[np.ndarray, np.ndarray]:
+    """(vectors, labels) of everything stored (exact for flat/HNSW-flat masters)."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        labels = faiss.vector_to_array(index.id_map).astype("int64")
+        base = faiss.downcast_index(index.index)
+        return base.reconstruct_n(0, base.ntotal), labels
+    return index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype="int64")
+
+
+def convert(src_dir: str, dst_dir: str, kind: str, **build_kw) -> faiss.Index:
+    """Build a `kind` index from the index in src_dir; chunk store and manifest are copied unchanged."""
+    src = faiss.read_index(os.path.join(src_dir, INDEX_FILE))
+    vectors, labels = reconstruct_all(src)
+    index = build_index(vectors, kind, ids=labels, **build_kw)
+    os.makedirs(dst_dir, exist_ok=True)
+    for name in os.listdir(src_dir):
+        if name != INDEX_FILE and os.path.isfile(os.path.join(src_dir, name)):
+            shutil.copy2(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+    faiss.write_index(index, os.path.join(dst_dir, INDEX_FILE))
+    return index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Derive a serving FAISS index from a flat master index.")
+    parser.add_argument("src_dir")
+    parser.add_argument("dst_dir")
+    parser.add_argument("--type", choices=INDEX_TYPES, required=True)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    args = parser.parse_args()
+
+    index = convert(
+        args.src_dir,
+        args.dst_dir,
+        args.type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        hnsw_m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+    )
+    print(f"wrote {index_kind(index)} index with {index.ntotal} vectors to {args.dst_dir}")
+
+
+if __name__ == "__main__":
+    main()
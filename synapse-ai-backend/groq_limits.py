@@ -0,0 +1,309 @@
+"""
+Client-side Groq rate limiting: per-model token buckets served in priority order.
+
+- Each model can have a tokens-per-minute and a requests-per-minute bucket; a call takes its
+  estimated tokens (prompt + expected completion) and one request before it goes out.
+- The token bucket is learned from Groq's headers: x-ratelimit-limit/remaining-tokens are
+  per minute and set its size and level (GROQ_TPM / GROQ_TPM_<MODEL> only seed it before
+  the first response). Groq reports requests per *day*, so there is no request bucket unless
+  GROQ_RPM or e.g. GROQ_RPM_OPENAI_GPT_OSS_120B is set; remaining-requests=0 blocks the model
+  until x-ratelimit-reset-requests, and a 429's retry-after pauses it. Headers are read by
+  httpx response hooks on the clients handed to ChatGroq (http_clients()).
+- Waiters for a model are served by priority (CHAT > VOICE > BACKGROUND), then arrival.
+  BACKGROUND work (titles, summaries) only starts while GROQ_BACKGROUND_HEADROOM of the token
+  bucket stays free afterwards, so it fills idle capacity instead of competing at peak.
+- After GROQ_MAX_WAIT_SEC a call goes out anyway (Groq's 429 + the SDK's retries still
+  apply): the scheduler smooths bursts, it never drops work.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from concurrency import chat_limiter, raise_if_job_cancelled
+
+# Unset = no limit until Groq's headers (TPM) or a 429 say otherwise.
+GROQ_RPM = os.getenv("GROQ_RPM", "")
+GROQ_TPM = os.getenv("GROQ_TPM", "")
+GROQ_MAX_WAIT_SEC = float(os.getenv("GROQ_MAX_WAIT_SEC", "30"))
+GROQ_BACKGROUND_HEADROOM = float(os.getenv("GROQ_BACKGROUND_HEADROOM", "0.3"))
+GROQ_SCHEDULER_ENABLED = os.getenv("GROQ_SCHEDULER_ENABLED", "1") != "0"
+
+PRIORITY_CHAT = 0
+PRIORITY_VOICE = 1
+PRIORITY_BACKGROUND = 2
+_PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_VOICE: "voice", PRIORITY_BACKGROUND: "background"}
+
+# Longest single sleep while waiting, so a freed head-of-line slot is noticed quickly.
+_POLL_SEC = 0.05
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _model_key(model: str) -> str:
+    return re.sub(r"\W", "_", model).upper()
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Groq reset headers look like "7.66s", "2m59.56s" or "120ms"; retry-after is plain seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts) if parts else None
+
+
+def _header_float(headers, name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _configured_limit(name: str, model: str, default: str) -> Optional[float]:
+    value = os.getenv(f"{name}_{_model_key(model)}", default)
+    return float(value) if value else None
+
+
+class _Bucket:
+    """Refills `capacity` units per minute, continuously."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until `amount` is available (amounts above capacity wait for a full bucket)."""
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing * 60 / self.capacity
+
+
+class _ModelLimits:
+    def __init__(self, model: str):
+        rpm = _configured_limit("GROQ_RPM", model, GROQ_RPM)
+        tpm = _configured_limit("GROQ_TPM", model, GROQ_TPM)
+        self.requests: Optional[_Bucket] = _Bucket(rpm) if rpm else None
+        self.tokens: Optional[_Bucket] = _Bucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        self.waiting: list = []  # heap of (priority, seq)
+        self.granted = {p: 0 for p in _PRIORITY_NAMES}
+        self.waited_sec = {p: 0.0 for p in _PRIORITY_NAMES}
+        self.overdue = 0
+        self.rate_limited = 0
+
+
+class GroqScheduler:
+    """Thread-safe; sync callers sleep, async callers await, both share the same queues."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: dict[str, _ModelLimits] = {}
+        self._seq = itertools.count()
+
+    def _limits(self, model: str) -> _ModelLimits:
+        limits = self._models.get(model)
+        if limits is None:
+            limits = self._models[model] = _ModelLimits(model)
+        return limits
+
+    def _enqueue(self, model: str, priority: int) -> tuple:
+        ticket = (priority, next(self._seq))
+        with self._lock:
+            heapq.heappush(self._limits(model).waiting, ticket)
+        return ticket
+
+    def _take(self, limits: _ModelLimits, ticket: tuple, tokens: float) -> None:
+        limits.waiting.remove(ticket)
+        heapq.heapify(limits.waiting)
+        if limits.requests is not None:
+            limits.requests.level -= 1
+        if limits.tokens is not None:
+            limits.tokens.level -= tokens
+
+    def _try(self, model: str, ticket: tuple, tokens: float, overdue: bool) -> float:
+        """Take capacity for `ticket` if it is its turn; else seconds to wait before retrying."""
+        with self._lock:
+            limits = self._limits(model)
+            now = time.monotonic()
+            self._refill(limits, now)
+            if overdue:
+                limits.overdue += 1
+                self._take(limits, ticket, tokens)
+                return 0.0
+            if limits.waiting[0] != ticket:
+                return _POLL_SEC
+            wait = limits.blocked_until - now
+            if limits.requests is not None:
+                wait = max(wait, limits.requests.wait_for(1))
+            if limits.tokens is not None:
+                background = ticket[0] >= PRIORITY_BACKGROUND
+                headroom = GROQ_BACKGROUND_HEADROOM * limits.tokens.capacity if background else 0
+                wait = max(wait, limits.tokens.wait_for(tokens + headroom))
+            if wait > 0:
+                return wait
+            self._take(limits, ticket, tokens)
+            return 0.0
+
+    @staticmethod
+    def _refill(limits: _ModelLimits, now: float) -> None:
+        for bucket in (limits.requests, limits.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+
+    def _granted(self, model: str, priority: int, waited: float) -> None:
+        with self._lock:
+            limits = self._limits(model)
+            limits.granted[priority] += 1
+            limits.waited_sec[priority] += waited
+
+    def _abandon(self, model: str, ticket: tuple) -> None:
+        with self._lock:
+            waiting = self._limits(model).waiting
+            if ticket in waiting:
+                waiting.remove(ticket)
+                heapq.heapify(waiting)
+
+    def wait_turn(self, model: str, priority: int, tokens: float, max_wait: float = GROQ_MAX_WAIT_SEC) -> float:
+        """Block until `model` has capacity for one request of ~`tokens`; returns seconds waited."""
+        if not GROQ_SCHEDULER_ENABLED:
+            return 0.0
+        started = time.monotonic()
+        ticket = self._enqueue(model, priority)
+        try:
+            while True:
+                waited = time.monotonic() - started
+                wait = self._try(model, ticket, tokens, overdue=waited >= max_wait)
+                if wait <= 0:
+                    break
+                raise_if_job_cancelled()  # e.g. a title request that timed out while queued here
+                time.sleep(min(wait, _POLL_SEC, max(0.0, max_wait - waited)))
+        finally:
+            self._abandon(model, ticket)
+        waited = time.monotonic() - started
+        self._granted(model, priority, waited)
+        return waited
+
+    async def await_turn(
+        self, model: str, priority: int, tokens: float, max_wait: float = GROQ_MAX_WAIT_SEC
+    ) -> float:
+        """Async twin of wait_turn — waits on the event loop, no pool thread."""
+        if not GROQ_SCHEDULER_ENABLED:
+            return 0.0
+        started = time.monotonic()
+        ticket = self._enqueue(model, priority)
+        try:
+            while True:
+                waited = time.monotonic() - started
+                wait = self._try(model, ticket, tokens, overdue=waited >= max_wait)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(min(wait, _POLL_SEC, max(0.0, max_wait - waited)))
+        finally:
+            self._abandon(model, ticket)
+        waited = time.monotonic() - started
+        self._granted(model, priority, waited)
+        return waited
+
+    def observe(self, model: str, status_code: int, headers) -> None:
+        """Re-sync a model's buckets from a Groq response's rate-limit headers."""
+        token_limit = _header_float(headers, "x-ratelimit-limit-tokens")
+        tokens_left = _header_float(headers, "x-ratelimit-remaining-tokens")
+        requests_left = _header_float(headers, "x-ratelimit-remaining-requests")
+        now = time.monotonic()
+        with self._lock:
+            limits = self._limits(model)
+            if token_limit:
+                if limits.tokens is None:
+                    limits.tokens = _Bucket(token_limit)
+                limits.tokens.refill(now)
+                limits.tokens.capacity = token_limit
+            if tokens_left is not None and limits.tokens is not None:
+                limits.tokens.refill(now)
+                limits.tokens.level = min(limits.tokens.capacity, tokens_left)
+            if requests_left is not None and requests_left <= 0:
+                reset = _parse_duration(headers.get("x-ratelimit-reset-requests"))
+                if reset:
+                    limits.blocked_until = max(limits.blocked_until, now + reset)
+            if status_code == 429:
+                limits.rate_limited += 1
+                retry = _parse_duration(headers.get("retry-after")) or _parse_duration(
+                    headers.get("x-ratelimit-reset-tokens")
+                )
+                limits.blocked_until = max(limits.blocked_until, now + (retry or 1.0))
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            models = {}
+            for model, limits in self._models.items():
+                self._refill(limits, now)
+                models[model] = {
+                    "rpm": limits.requests.capacity if limits.requests is not None else None,
+                    "tpm": limits.tokens.capacity if limits.tokens is not None else None,
+                    "tokens_available": round(limits.tokens.level) if limits.tokens is not None else None,
+                    "blocked_sec": round(max(0.0, limits.blocked_until - now), 2),
+                    "waiting": len(limits.waiting),
+                    "rate_limited_429": limits.rate_limited,
+                    "overdue_sent": limits.overdue,
+                    "granted": {_PRIORITY_NAMES[p]: n for p, n in limits.granted.items()},
+                    "avg_wait_sec": {
+                        _PRIORITY_NAMES[p]: round(limits.waited_sec[p] / n, 3) if n else None
+                        for p, n in limits.granted.items()
+                    },
+                }
+            return {"enabled": GROQ_SCHEDULER_ENABLED, "background_headroom": GROQ_BACKGROUND_HEADROOM, "models": models}
+
+
+groq_scheduler = GroqScheduler()
+
+_clients: dict[str, tuple] = {}
+_clients_guard = threading.Lock()
+
+
+def http_clients(model: str) -> tuple:
+    """(httpx.Client, httpx.AsyncClient) for ChatGroq(model=...) that report rate-limit headers."""
+    with _clients_guard:
+        pair = _clients.get(model)
+        if pair is None:
+
+            def observe(response: httpx.Response) -> None:
+                groq_scheduler.observe(model, response.status_code, response.headers)
+                chat_limiter.record_upstream(response.status_code)
+
+            async def aobserve(response: httpx.Response) -> None:
+                observe(response)
+
+            pair = _clients[model] = (
+                httpx.Client(event_hooks={"response": [observe]}),
+                httpx.AsyncClient(event_hooks={"response": [aobserve]}),
+            )
+        return pair
+
+
+async def aclose_groq_clients() -> None:
+    """Close the hooked Groq clients (called from FastAPI lifespan shutdown)."""
+    with _clients_guard:
+        pairs = list(_clients.values())
+        _clients.clear()
+    for client, async_client in pairs:
+        client.close()
+        await async_client.aclose()
+
+
+def get_groq_scheduler_stats() -> dict:
+    return groq_scheduler.stats()
@@ -0,0 +1,186 @@
+"""
+Shared, connection-pooled HTTP clients for outbound tool calls.
+
+- One sync httpx.Client (tools running in pool threads) and one httpx.AsyncClient
+  (tools awaited by ToolNode on the async path) — keep-alive, no per-call TLS handshake.
+- HTTP/2 is negotiated when the optional `h2` package is installed.
+- Per-host connection caps so one slow upstream cannot take the whole pool.
+- Tool bodies are written once as request "flows" (generators that yield HttpRequest
+  and receive httpx.Response) and driven by run_flow / arun_flow.
+"""
+
+import asyncio
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Generator, Optional, TypeVar
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+T = TypeVar("T")
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+HTTP_KEEPALIVE_EXPIRY_SEC = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SEC", "30"))
+HTTP_DEFAULT_TIMEOUT_SEC = float(os.getenv("HTTP_DEFAULT_TIMEOUT_SEC", "15"))
+
+
+@dataclass
+class HttpRequest:
+    url: str
+    method: str = "GET"
+    params: Optional[dict] = None
+    headers: Optional[dict] = None
+    json: Optional[dict] = None
+    timeout: float = HTTP_DEFAULT_TIMEOUT_SEC
+    extra: dict = field(default_factory=dict)
+
+
+Flow = Generator[HttpRequest, httpx.Response, T]
+
+_limits = httpx.Limits(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SEC,
+)
+
+_sync_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_client_guard = threading.Lock()
+
+_host_sync_limits: dict[str, threading.BoundedSemaphore] = {}
+_host_async_limits: dict[str, asyncio.Semaphore] = {}
+
+
+def _get_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None:
+        with _client_guard:
+            if _sync_client is None:
+                _sync_client = httpx.Client(
+                    http2=HTTP2_AVAILABLE,
+                    limits=_limits,
+                    follow_redirects=True,
+                    timeout=HTTP_DEFAULT_TIMEOUT_SEC,
+                )
+    return _sync_client
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Created lazily inside the running event loop (httpx binds pools to a loop)."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=_limits,
+            follow_redirects=True,
+            timeout=HTTP_DEFAULT_TIMEOUT_SEC,
+        )
+    return _async_client
+
+
+def _host_key(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def _sync_host_limit(url: str) -> threading.BoundedSemaphore:
+    host = _host_key(url)
+    with _client_guard:
+        sem = _host_sync_limits.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+            _host_sync_limits[host] = sem
+        return sem
+
+
+def _async_host_limit(url: str) -> asyncio.Semaphore:
+    host = _host_key(url)
+    sem = _host_async_limits.get(host)
+    if sem is None:
+        sem = asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+        _host_async_limits[host] = sem
+    return sem
+
+
+def request(req: HttpRequest) -> httpx.Response:
+    """Blocking request on the pooled sync client."""
+    with _sync_host_limit(req.url):
+        return _get_sync_client().request(
+            req.method,
+            req.url,
+            params=req.params,
+            headers=req.headers,
+            json=req.json,
+            timeout=req.timeout,
+            **req.extra,
+        )
+
+
+async def arequest(req: HttpRequest) -> httpx.Response:
+    """Non-blocking request on the pooled async client."""
+    async with _async_host_limit(req.url):
+        return await _get_async_client().request(
+            req.method,
+            req.url,
+            params=req.params,
+            headers=req.headers,
+            json=req.json,
+            timeout=req.timeout,
+            **req.extra,
+        )
+
+
+def run_flow(flow: Flow) -> T:
+    """Drive a request flow with the sync client. Transport errors are thrown back into the flow."""
+    try:
+        req = next(flow)
+        while True:
+            try:
+                resp = request(req)
+            except Exception as exc:
+                req = flow.throw(exc)
+            else:
+                req = flow.send(resp)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def arun_flow(flow: Flow) -> T:
+    """Drive a request flow with the async client."""
+    try:
+        req = next(flow)
+        while True:
+            try:
+                resp = await arequest(req)
+            except Exception as exc:
+                req = flow.throw(exc)
+            else:
+                req = flow.send(resp)
+    except StopIteration as stop:
+        return stop.value
+
+
+def close_sync_client() -> None:
+    global _sync_client
+    with _client_guard:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+
+
+async def aclose_clients() -> None:
+    """Close both pools (called from FastAPI lifespan shutdown)."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    _host_async_limits.clear()
+    close_sync_client()
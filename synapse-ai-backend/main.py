@@ -1,34 +1,78 @@
 from contextlib import asynccontextmanager
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
 from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from langchain_core.messages import HumanMessage, AIMessage
 import uuid
-import json
 import asyncio
+import os
+import threading
 
 from chatbot_backend import (
     chatbot,
-    retrieve_all_threads,
+    list_threads,
+    get_thread_meta,
     delete_thread_data,
     generate_summary,
+    generate_thread_title,
+    take_pending_title,
     iter_chat_stream,
+    aiter_chat_stream,
+    init_async_graph,
+    close_async_graph,
+    async_graph_ready,
+    compaction_queue,
+    CHECKPOINT_BACKEND,
+    db_maintenance,
+    db_writer,
+    get_db_stats,
+    get_compaction_stats,
     get_thread_lock,
+    acquire_thread_turn,
     GROQ_API_KEY,
 )
+from thread_locks import (
+    THREAD_BUSY_POLICY,
+    THREAD_LOCK_MAX_WAITERS,
+    lock_stats,
+    release_turn_lock,
+    release_turn_lock_soon,
+    thread_waiters,
+)
+from thread_store import DEFAULT_TITLE, fallback_title
+from sse import DONE_FRAME, TokenCoalescer, sse_frame, sse_stats
+from tool_cache import get_tool_cache_stats
+from response_cache import get_response_cache_stats
+from tool_router import get_tool_router_stats
+from groq_limits import aclose_groq_clients, get_groq_scheduler_stats
+from http_client import aclose_clients
+from db_maintenance import DB_MAINTENANCE_ENABLED
+from retriever import RetrieverNotReady, retriever_status, start_warm_up
+from doc_collections import add_documents, delete_collection, list_documents
 from voice_service import VOICE_OPTIONS, synthesize_speech
 from concurrency import (
+    ASYNC_GRAPH,
     CHAT_STREAM_TIMEOUT_SEC,
+    DISCONNECT_POLL_SEC,
+    INGEST_TIMEOUT_SEC,
     IO_TIMEOUT_SEC,
+    JOB_CANCEL_POLL_SEC,
+    chat_limiter,
+    chat_pool,
     chat_slot,
+    ingest_pool,
     io_slot,
-    executor,
     get_concurrency_stats,
+    maintenance_pool,
+    raise_if_job_cancelled,
+    record_chat_stream_ended,
     run_in_pool,
     shutdown_pool,
+    title_pool,
 )
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -42,12 +86,54 @@ async def lifespan(app: FastAPI):
         print("WARNING: GROQ_API_KEY is missing — set it in synapse-ai-backend/.env")
     elif not GROQ_API_KEY.startswith("gsk_"):
         print("WARNING: GROQ_API_KEY format looks wrong — copy a fresh key from console.groq.com")
+    # Embeddings + FAISS load in the background so /health answers immediately.
+    start_warm_up()
+    if ASYNC_GRAPH and not await init_async_graph():
+        # Streams fall back to one chat_pool thread each: admit no more than it has workers.
+        print(
+            f"WARNING: ASYNC_GRAPH=1 but the async graph did not start — chat streams run on the "
+            f"thread pool, capped at {chat_pool.max_workers}"
+        )
+        chat_limiter.set_max_limit(chat_pool.max_workers)
+    maintenance = (
+        asyncio.create_task(db_maintenance.run_forever(maintenance_pool.run))
+        if DB_MAINTENANCE_ENABLED and CHECKPOINT_BACKEND == "sqlite"
+        else None
+    )
     yield
+    if maintenance is not None:
+        maintenance.cancel()
+    compaction_queue.shutdown()
+    await close_async_graph()
+    db_writer.close()
+    await aclose_clients()
+    await aclose_groq_clients()
     shutdown_pool()
 
 
 app = FastAPI(title="Synapse AI API", version="1.1.0", lifespan=lifespan)
 
+# gzip for JSON endpoints (thread lists, history, health). The SSE stream must stay
+# unbuffered and TTS audio is already compressed, so both bypass it.
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))  # 0 disables compression
+_GZIP_EXCLUDED_PATHS = {"/chat/stream", "/voice/tts"}
+
+
+class _SelectiveGZip:
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in _GZIP_EXCLUDED_PATHS:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+if GZIP_MIN_BYTES > 0:
+    app.add_middleware(_SelectiveGZip, minimum_size=GZIP_MIN_BYTES)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -65,6 +151,7 @@ class ChatRequest(BaseModel):
     thread_id: str
     message: str
     voice: bool = False
+    user_id: Optional[str] = None
 
 
 class SummaryRequest(BaseModel):
@@ -92,15 +179,26 @@ def _load_thread_history(thread_id: str) -> dict:
         elif isinstance(msg, AIMessage) and msg.content:
             messages.append({"role": "assistant", "content": msg.content})
 
-    user_msgs = [m for m in messages if m["role"] == "user"]
-    title = generate_summary(user_msgs[0]["content"]) if user_msgs else "New Conversation"
+    meta = get_thread_meta(thread_id)
+    title = meta["title"] if meta else DEFAULT_TITLE
+    if title == DEFAULT_TITLE:
+        user_msgs = [m for m in messages if m["role"] == "user"]
+        if user_msgs:
+            title = fallback_title(user_msgs[0]["content"])
 
     return {"thread_id": thread_id, "title": title, "messages": messages}
 
 
 def _delete_thread(thread_id: str) -> dict:
-    with get_thread_lock(thread_id):
+    lock = get_thread_lock(thread_id)
+    # Wait for a running turn in short steps, so a timed-out delete frees its worker.
+    while not lock.acquire(timeout=JOB_CANCEL_POLL_SEC):
+        raise_if_job_cancelled()
+    try:
         delete_thread_data(thread_id)
+        delete_collection("thread", thread_id)
+    finally:
+        lock.release()
     return {"deleted": thread_id}
 
 
@@ -108,17 +206,76 @@ def _graph_worker(
     message: str,
     thread_id: str,
     voice: bool,
+    user_id: Optional[str],
+    cancel: threading.Event,
     loop: asyncio.AbstractEventLoop,
     queue: asyncio.Queue,
 ) -> None:
-    """Runs in thread pool; pushes stream events onto the async queue."""
+    """
+    Runs in thread pool; pushes stream events onto the async queue. The caller holds the
+    thread lock and sets `cancel` when the client goes away; the graph then stops at its
+    next model chunk or node and this thread returns to the pool.
+    """
     try:
-        for event in iter_chat_stream(message, thread_id, voice=voice):
+        for event in iter_chat_stream(
+            message, thread_id, voice=voice, user_id=user_id, lock_held=True, cancel=cancel
+        ):
+            if cancel.is_set():
+                break
             loop.call_soon_threadsafe(queue.put_nowait, event)
     except Exception as exc:
         loop.call_soon_threadsafe(queue.put_nowait, ("error", str(exc)))
 
 
+async def _async_graph_worker(
+    message: str,
+    thread_id: str,
+    voice: bool,
+    user_id: Optional[str],
+    cancel: threading.Event,
+    queue: asyncio.Queue,
+) -> None:
+    """Event-loop task (ASYNC_GRAPH=1); same queue protocol as _graph_worker, no pool thread."""
+    try:
+        async for event in aiter_chat_stream(
+            message, thread_id, voice=voice, user_id=user_id, lock_held=True, cancel=cancel
+        ):
+            queue.put_nowait(event)
+    except Exception as exc:
+        queue.put_nowait(("error", str(exc)))
+
+
+class _LockedStreamingResponse(StreamingResponse):
+    """StreamingResponse that runs `on_finish` after sending, however it ended (e.g. before the body started)."""
+
+    def __init__(self, content, on_finish, **kwargs):
+        super().__init__(content, **kwargs)
+        self._on_finish = on_finish
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await asyncio.shield(self._on_finish())
+
+
+def _start_title_job(thread_id: str) -> None:
+    """Title a thread created by the turn that just ended, on the title pool (turn lock and slot already released)."""
+    message = take_pending_title(thread_id)
+    if message is not None:
+        title_pool.submit(generate_thread_title, thread_id, message)
+
+
+async def _watch_disconnect(request: Request, cancel: threading.Event, queue: asyncio.Queue) -> None:
+    """Flag the turn as cancelled once the client closes the connection, and wake the reader."""
+    while not cancel.is_set():
+        if await request.is_disconnected():
+            cancel.set()
+            queue.put_nowait(("cancelled", None))
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SEC)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # ROUTES
 # ─────────────────────────────────────────────────────────────────────────────
@@ -136,15 +293,38 @@ async def root():
 
 @app.get("/health")
 async def health():
+    """Liveness (`ok`) plus readiness (`ready`: Groq configured and document index loaded)."""
     stats = await get_concurrency_stats()
     groq_ok = bool(GROQ_API_KEY and GROQ_API_KEY.startswith("gsk_"))
+    rag = retriever_status()
     return {
         "ok": groq_ok,
+        "ready": groq_ok and rag["ready"],
         "groq_configured": groq_ok,
+        "retriever": rag,
+        "graph_mode": "async" if async_graph_ready() else "thread_pool",
         **stats,
+        "tool_cache": get_tool_cache_stats(),
+        "response_cache": get_response_cache_stats(),
+        "tool_router": get_tool_router_stats(),
+        "groq_limits": get_groq_scheduler_stats(),
+        "compaction": get_compaction_stats(),
+        "thread_locks": lock_stats(),
+        "sse": sse_stats(),
+        "db_maintenance": db_maintenance.stats(),
+        "db": get_db_stats(),
     }
 
 
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness probe: 503 until the document index has finished warming up."""
+    rag = retriever_status()
+    if not rag["ready"]:
+        raise HTTPException(status_code=503, detail=f"retriever {rag['status']}")
+    return {"ready": True, "retriever": rag}
+
+
 @app.post("/thread/new")
 async def new_thread():
     """Create a new thread ID."""
@@ -152,11 +332,23 @@ async def new_thread():
 
 
 @app.get("/threads")
-async def get_threads():
-    """Return all saved thread IDs."""
+async def get_threads(
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Return saved threads from the metadata table, most recent first.
+    `threads` keeps the legacy id list (oldest → newest, the UI reverses it);
+    `items` carries title / timestamps / message count / last snippet.
+    """
     async with io_slot():
-        threads = await run_in_pool(retrieve_all_threads, timeout=IO_TIMEOUT_SEC)
-    return {"threads": threads}
+        items = await run_in_pool(list_threads, limit, offset, timeout=IO_TIMEOUT_SEC)
+    return {
+        "threads": [row["thread_id"] for row in reversed(items)],
+        "items": items,
+        "limit": limit,
+        "offset": offset,
+    }
 
 
 @app.get("/thread/{thread_id}/history")
@@ -174,8 +366,56 @@ async def get_thread_history(thread_id: str):
 @app.delete("/thread/{thread_id}")
 async def delete_thread(thread_id: str):
     """Delete a thread and its data."""
-    async with io_slot():
-        return await run_in_pool(_delete_thread, thread_id, timeout=IO_TIMEOUT_SEC)
+    try:
+        async with io_slot():
+            return await run_in_pool(_delete_thread, thread_id, timeout=IO_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Delete timed out — the thread is still answering")
+
+
+async def _upload_documents(scope: str, owner: str, files: list) -> dict:
+    payload = [(f.filename, await f.read()) for f in files]
+    try:
+        async with io_slot(ingest_pool):
+            return await run_in_pool(
+                add_documents, scope, owner, payload, timeout=INGEST_TIMEOUT_SEC, pool=ingest_pool
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RetrieverNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Ingestion timed out")
+
+
+@app.post("/thread/{thread_id}/documents")
+async def upload_thread_documents(thread_id: str, files: list[UploadFile] = File(...)):
+    """Add PDF / text / markdown files to this thread's private document collection."""
+    return await _upload_documents("thread", thread_id, files)
+
+
+@app.get("/thread/{thread_id}/documents")
+async def get_thread_documents(thread_id: str):
+    """Documents indexed in this thread's collection."""
+    try:
+        return list_documents("thread", thread_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/user/{user_id}/documents")
+async def upload_user_documents(user_id: str, files: list[UploadFile] = File(...)):
+    """Add files to a user's collection, searched in every thread that sends this user_id."""
+    return await _upload_documents("user", user_id, files)
+
+
+@app.get("/user/{user_id}/documents")
+async def get_user_documents(user_id: str):
+    """Documents indexed in a user's collection."""
+    try:
+        return list_documents("user", user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/voice/config")
@@ -204,63 +444,148 @@ async def voice_tts(req: TtsRequest):
 @app.post("/chat/summary")
 async def summarize(req: SummaryRequest):
     """Generate a short title from the first user message."""
-    async with io_slot():
-        title = await run_in_pool(generate_summary, req.text, timeout=IO_TIMEOUT_SEC)
+    async with io_slot(title_pool):
+        title = await run_in_pool(generate_summary, req.text, timeout=IO_TIMEOUT_SEC, pool=title_pool)
     return {"title": title}
 
 
 @app.post("/chat/stream")
-async def chat_stream(req: ChatRequest):
+async def chat_stream(req: ChatRequest, request: Request):
     """
     Stream the assistant reply using SSE.
-    Up to MAX_CONCURRENT_REQUESTS (default 50) streams can run in parallel.
+    Up to MAX_CONCURRENT_STREAMS streams (fewer while the adaptive limit backs off) run at
+    once — one pool thread each on the sync path, or event-loop tasks only when the async
+    graph is enabled (ASYNC_GRAPH=1).
+    A message for a thread that is still answering is rejected with 409
+    (THREAD_BUSY_POLICY=reject, or too many already queued) or waits on the event loop,
+    holding neither a chat slot nor a pool thread, after a `queued` status event.
+    If the client disconnects, the run is cancelled (model stream closed, no further nodes)
+    and its slot, pool thread and thread lock are released as soon as it stops.
     """
+    thread_id = req.thread_id
+    lock = get_thread_lock(thread_id)
+    reject = THREAD_BUSY_POLICY == "reject" or thread_waiters(thread_id) >= THREAD_LOCK_MAX_WAITERS
+    # The reject check keeps the lock and hands it to the stream; nobody can take the turn in between.
+    prelocked = False
+    if reject:
+        if not await acquire_thread_turn(thread_id, lock, blocking=False):
+            raise HTTPException(status_code=409, detail="This conversation is still answering a previous message")
+        prelocked = True
+    body_started = False
+
+    async def release_if_unstarted() -> None:
+        # The client left before the body ran: the generator's finally never will, so release here.
+        if prelocked and not body_started:
+            await release_turn_lock(lock)
 
     async def event_generator():
-        async with chat_slot():
-            loop = asyncio.get_running_loop()
-            queue: asyncio.Queue = asyncio.Queue()
-            worker = loop.run_in_executor(
-                executor,
-                _graph_worker,
-                req.message,
-                req.thread_id,
-                req.voice,
-                loop,
-                queue,
-            )
-
-            try:
-                while True:
-                    try:
-                        kind, payload = await asyncio.wait_for(
-                            queue.get(),
-                            timeout=CHAT_STREAM_TIMEOUT_SEC,
-                        )
-                    except asyncio.TimeoutError:
-                        yield f"data: {json.dumps({'error': 'Request timed out. Please try again.'})}\n\n"
-                        break
-
-                    if kind == "done":
-                        yield "data: [DONE]\n\n"
-                        break
-
-                    if kind == "error":
-                        yield f"data: {json.dumps({'error': payload})}\n\n"
-                        break
-
-                    if kind == "status":
-                        yield f"data: {json.dumps({'status': payload})}\n\n"
-                        continue
-
-                    if kind == "token":
-                        yield f"data: {json.dumps({'token': payload})}\n\n"
-
-            finally:
-                await worker
-
-    return StreamingResponse(
+        nonlocal body_started
+        body_started = True
+        held = prelocked
+        worker = None
+        try:
+            if not held:
+                held = await acquire_thread_turn(thread_id, lock, blocking=False)
+            if not held:
+                yield sse_frame({"status": "queued"})
+                try:
+                    held = await asyncio.wait_for(acquire_thread_turn(thread_id, lock), CHAT_STREAM_TIMEOUT_SEC)
+                except asyncio.TimeoutError:
+                    yield sse_frame({"error": "Request timed out. Please try again."})
+                    return
+
+            async with chat_slot():
+                loop = asyncio.get_running_loop()
+                queue: asyncio.Queue = asyncio.Queue()
+                cancel = threading.Event()
+                finished = False
+                if async_graph_ready():
+                    worker = asyncio.create_task(
+                        _async_graph_worker(req.message, thread_id, req.voice, req.user_id, cancel, queue)
+                    )
+                else:
+                    worker = chat_pool.submit(
+                        _graph_worker,
+                        req.message,
+                        thread_id,
+                        req.voice,
+                        req.user_id,
+                        cancel,
+                        loop,
+                        queue,
+                        cancel=cancel,
+                    )
+                watcher = asyncio.create_task(_watch_disconnect(request, cancel, queue))
+                events = TokenCoalescer(queue)
+                started = loop.time()
+                first_output = True
+                throttled = 0.0  # seconds queued in groq_scheduler (our throttling, not Groq latency)
+                outcome = "error"  # how a stream that never reached [DONE] ended
+
+                try:
+                    while True:
+                        try:
+                            kind, payload = await events.get(timeout=CHAT_STREAM_TIMEOUT_SEC)
+                        except asyncio.TimeoutError:
+                            outcome = "timeout"
+                            yield sse_frame({"error": "Request timed out. Please try again."})
+                            break
+
+                        if kind == "cancelled":  # _watch_disconnect saw the client leave
+                            outcome = "cancelled"
+                            break
+
+                        if kind == "scheduler_wait":
+                            throttled += payload
+                            continue
+
+                        if first_output and kind in ("token", "status"):
+                            # First answer token or tool status: the admission limiter's latency signal.
+                            first_output = False
+                            chat_limiter.record_ttft(max(0.0, loop.time() - started - throttled))
+
+                        if kind == "done":
+                            finished = True
+                            yield DONE_FRAME
+                            break
+
+                        if kind == "error":
+                            yield sse_frame({"error": payload})
+                            break
+
+                        if kind == "status":
+                            yield sse_frame({"status": payload})
+                            continue
+
+                        if kind == "token":
+                            yield sse_frame({"token": payload})
+
+                except (GeneratorExit, asyncio.CancelledError):  # response closed: client gone
+                    outcome = "cancelled"
+                    raise
+                finally:
+                    watcher.cancel()
+                    if not finished:
+                        # Disconnect (generator closed or cancelled here), timeout or error:
+                        # stop the run instead of finishing an answer nobody reads.
+                        cancel.set()
+                        if isinstance(worker, asyncio.Task):
+                            worker.cancel()
+                        await record_chat_stream_ended(outcome)
+                    # After [DONE] the worker still records thread metadata; let it finish.
+                    await asyncio.gather(worker, return_exceptions=True)
+        finally:
+            if held:
+                if worker is not None and not worker.done():
+                    # Cancelled again while waiting above: keep the thread locked until the run stops.
+                    worker.add_done_callback(lambda _f: (release_turn_lock_soon(lock), _start_title_job(thread_id)))
+                else:
+                    await release_turn_lock(lock)
+                    _start_title_job(thread_id)
+
+    return _LockedStreamingResponse(
         event_generator(),
+        release_if_unstarted,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
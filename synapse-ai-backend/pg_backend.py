@@ -0,0 +1,120 @@
+"""
+Postgres storage (CHECKPOINT_BACKEND=postgres) for deployments spanning several hosts.
+
+- Checkpoints: langgraph's PostgresSaver / AsyncPostgresSaver over psycopg connection pools
+  (`pip install langgraph-checkpoint-postgres "psycopg[binary,pool]"`, POSTGRES_URL).
+- PgReaders / PgWriter give ThreadStore the interface of the SQLite reader pool and writer:
+  `readers.connection()` for reads, `writer.run(fn)` for one committed transaction. They run
+  on their own small pool with tuple rows (the savers' pool uses dict rows).
+- Checkpoint retention/vacuum (db_maintenance) is SQLite-only; Postgres autovacuum
+  reclaims space here.
+"""
+
+import os
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+POSTGRES_URL = os.getenv("POSTGRES_URL", "")
+POSTGRES_POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", "20"))
+POSTGRES_META_POOL_SIZE = int(os.getenv("POSTGRES_META_POOL_SIZE", "5"))
+
+
+def _require_url() -> str:
+    if not POSTGRES_URL:
+        raise RuntimeError("CHECKPOINT_BACKEND=postgres needs POSTGRES_URL")
+    return POSTGRES_URL
+
+
+def _saver_kwargs() -> dict:
+    from psycopg.rows import dict_row
+
+    return {"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row}
+
+
+def open_checkpointer():
+    """PostgresSaver on a connection pool; creates/migrates its tables."""
+    from langgraph.checkpoint.postgres import PostgresSaver
+    from psycopg_pool import ConnectionPool
+
+    pool = ConnectionPool(
+        _require_url(), min_size=1, max_size=POSTGRES_POOL_SIZE, kwargs=_saver_kwargs(), name="checkpoints"
+    )
+    saver = PostgresSaver(pool)
+    saver.setup()
+    return saver
+
+
+async def open_async_checkpointer():
+    """AsyncPostgresSaver for achatbot. Returns (saver, pool); close the pool on shutdown."""
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+    from psycopg_pool import AsyncConnectionPool
+
+    pool = AsyncConnectionPool(
+        _require_url(),
+        min_size=1,
+        max_size=POSTGRES_POOL_SIZE,
+        kwargs=_saver_kwargs(),
+        name="checkpoints-async",
+        open=False,
+    )
+    await pool.open()
+    saver = AsyncPostgresSaver(pool)
+    await saver.setup()
+    return saver, pool
+
+
+class _QmarkConnection:
+    """Accepts the SQLite-style `?` placeholders ThreadStore uses."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql: str, params=()):
+        return self._conn.execute(sql.replace("?", "%s"), params)
+
+
+_meta_pool = None
+
+
+def _get_meta_pool():
+    global _meta_pool
+    if _meta_pool is None:
+        from psycopg_pool import ConnectionPool
+
+        _meta_pool = ConnectionPool(
+            _require_url(),
+            min_size=1,
+            max_size=POSTGRES_META_POOL_SIZE,
+            kwargs={"autocommit": True},
+            name="thread-meta",
+        )
+    return _meta_pool
+
+
+class PgReaders:
+    @contextmanager
+    def connection(self) -> Iterator[_QmarkConnection]:
+        with _get_meta_pool().connection() as conn:
+            yield _QmarkConnection(conn)
+
+    def stats(self) -> dict:
+        return _get_meta_pool().get_stats()
+
+
+class PgWriter:
+    dialect = "postgres"
+
+    def run(self, fn: Callable[[Any], Any], timeout: Optional[float] = None) -> Any:
+        """Run fn(conn) in one transaction and return its result once committed."""
+        with _get_meta_pool().connection(timeout=timeout) as conn:
+            with conn.transaction():
+                return fn(_QmarkConnection(conn))
+
+    def close(self) -> None:
+        global _meta_pool
+        if _meta_pool is not None:
+            _meta_pool.close()
+            _meta_pool = None
+
+    def stats(self) -> dict:
+        return _get_meta_pool().get_stats()
@@ -0,0 +1,192 @@
+"""
+Semantic answer cache for opening messages (RESPONSE_CACHE_ENABLED=1).
+
+- Keyed on the embedding of the user's message (the retriever's model, via
+  tools.get_embeddings); a lookup hits when cosine similarity to a cached question is at
+  least RESPONSE_CACHE_THRESHOLD, so "explain quantum computing simply" and "Explain
+  quantum computing, simply!" share one answer.
+- Only a thread's first message is looked up or stored, and only answers the chat model
+  gave without calling tools and without a summary in the prompt — anything else depends
+  on history or live data. Voice and text answers are cached separately.
+- Questions about the date or time are never cached (the prompt carries the current time,
+  so the answer goes stale): see cacheable_question.
+- A hit also needs the same numbers and names (digits and capitalized words after the
+  first): "what is 234*19" and "what is 234*18" embed alike but are different questions.
+- Entries expire after RESPONSE_CACHE_TTL_SEC; beyond RESPONSE_CACHE_MAX_ENTRIES the least
+  recently used one is evicted. Vectors live in one preallocated matrix, so a lookup is a
+  single matrix-vector product.
+- Until the embeddings model has loaded, lookups are misses instead of waiting for it.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL_SEC = float(os.getenv("RESPONSE_CACHE_TTL_SEC", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = max(1, int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")))
+
+
+_TIME_DEPENDENT = re.compile(
+    r"\b(now|today|tonight|tomorrow|yesterday|current(ly)?|latest|recent(ly)?|ago|"
+    r"time|date|day|days|week|weekend|month|year|hour|hours|clock|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b",
+    re.IGNORECASE,
+)
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+_WORD = re.compile(r"\b[^\W\d_][\w'-]*", re.UNICODE)
+
+
+def cacheable_question(question: str) -> bool:
+    """False for questions whose answer depends on the current date or time."""
+    return not _TIME_DEPENDENT.search(question)
+
+
+def _signature(question: str) -> frozenset:
+    """Numbers and names in the question; a cached answer is only reused for the same ones."""
+    words = _WORD.findall(question)[1:]  # the first word is capitalized anyway
+    names = {w.casefold() for w in words if w[0].isupper()}
+    return frozenset(_NUMBER.findall(question)) | names
+
+
+class _Entry:
+    __slots__ = ("question", "signature", "answer", "expires_at")
+
+    def __init__(self, question: str, answer: str, expires_at: float):
+        self.question = question
+        self.signature = _signature(question)
+        self.answer = answer
+        self.expires_at = expires_at
+
+
+class SemanticResponseCache:
+    """TTL + LRU cache of answers, looked up by nearest question embedding. Thread-safe."""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = RESPONSE_CACHE_TTL_SEC,
+        threshold: float = RESPONSE_CACHE_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()  # slot -> entry, LRU order
+        self._matrix: Optional[np.ndarray] = None  # (max_entries, dim), unit rows
+        self._namespace = np.full(max_entries, -1, dtype=np.int16)  # -1 = free slot
+        self._namespaces: dict[str, int] = {}
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.unavailable = 0
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        from retriever import RetrieverNotReady
+        from tools import get_embeddings
+
+        try:
+            embeddings = get_embeddings(timeout=0)
+        except RetrieverNotReady:
+            with self._lock:
+                self.unavailable += 1
+            return None
+        vector = np.asarray(embeddings.embed_query(text), dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+
+    def _nearest(self, ns: int, vector: np.ndarray, signature: frozenset) -> tuple[int, float]:
+        """Most similar entry with the same numbers / names (slot -1 if none reaches the threshold)."""
+        scores = self._matrix @ vector
+        scores[self._namespace != ns] = -1.0
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for slot in candidates[np.argsort(-scores[candidates])]:
+            entry = self._entries.get(int(slot))
+            if entry is not None and entry.signature == signature:
+                return int(slot), float(scores[slot])
+        return -1, -1.0
+
+    def _drop(self, slot: int) -> None:
+        del self._entries[slot]
+        self._namespace[slot] = -1
+        self._free.append(slot)
+
+    def lookup(self, namespace: str, question: str) -> Optional[str]:
+        """Cached answer for a question similar enough to `question`, else None."""
+        vector = self._embed(question)
+        if vector is None:
+            return None
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None or self._matrix is None or not self._entries:
+                self.misses += 1
+                return None
+            slot, score = self._nearest(ns, vector, _signature(question))
+            if score < self.threshold:
+                self.misses += 1
+                return None
+            entry = self._entries[slot]
+            if entry.expires_at <= time.monotonic():
+                self._drop(slot)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return entry.answer
+
+    def store(self, namespace: str, question: str, answer: str) -> None:
+        vector = self._embed(question)
+        if vector is None or not answer:
+            return
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            ns = self._namespaces.setdefault(namespace, len(self._namespaces))
+            slot, score = self._nearest(ns, vector, _signature(question)) if self._entries else (-1, -1.0)
+            if score < self.threshold:  # new question; otherwise refresh the near-duplicate
+                if not self._free:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+                slot = self._free.pop()
+                self._matrix[slot] = vector
+                self._namespace[slot] = ns
+            self._entries[slot] = _Entry(question, answer, time.monotonic() + self.ttl)
+            self._entries.move_to_end(slot)
+
+    def clear(self) -> None:
+        with self._lock:
+            for slot in list(self._entries):
+                self._drop(slot)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": RESPONSE_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_sec": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "skipped_embeddings_loading": self.unavailable,
+            }
+
+
+response_cache = SemanticResponseCache()
+
+
+def get_response_cache_stats() -> dict:
+    return response_cache.stats()
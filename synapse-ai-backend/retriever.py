@@ -0,0 +1,312 @@
+"""
+Lazily loaded document retriever (embedding model + FAISS index).
+
+- Nothing heavy happens at import time — torch / sentence-transformers / FAISS load in a
+  background warm-up thread started from FastAPI lifespan (or on the first rag_tool call).
+- Callers that need the index (rag_tool, get_embeddings) wait on the warm-up instead of
+  blocking module import; /health reports readiness from retriever_status().
+- The embedding backend (torch / ONNX int8) is chosen in embeddings.py; chunk text and
+  metadata are read per hit from chunk_store.py (no pickled docstore in memory).
+- RAG_SEARCH_MODE=hybrid (default) fuses the FAISS ranking with a BM25 ranking from the
+  chunk store's FTS5 index via reciprocal rank fusion, so exact terms (section names,
+  acronyms, "quoted phrases") are found on the first call; RAG_SEARCH_MODE=vector disables it.
+- Per-thread / per-user collections (doc_collections.py) are separate index directories,
+  opened on first use and kept in a memory-budgeted LRU; search() fuses them with the shared index.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FAISS_DIR = os.path.join(BASE_DIR, "faiss_ethics_ch10")
+# Index served by rag_tool — defaults to the flat master index; point it at a directory
+# produced by `python faiss_index.py ... --type hnsw|ivf|ivfpq` to serve a scalable index.
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", FAISS_DIR)
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_WARMUP_TIMEOUT_SEC = float(os.getenv("RAG_WARMUP_TIMEOUT_SEC", "120"))
+RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "hybrid").lower()
+# Candidates taken from each ranking before fusion, and the RRF damping constant (Cormack et al.).
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# Resident budget for per-thread / per-user collection indexes (the shared index is not counted).
+RAG_COLLECTION_CACHE_MB = int(os.getenv("RAG_COLLECTION_CACHE_MB", "512"))
+RAG_COLLECTION_CACHE_MAX = int(os.getenv("RAG_COLLECTION_CACHE_MAX", "64"))
+
+
+class RetrieverNotReady(RuntimeError):
+    """Warm-up did not finish in time (or failed)."""
+
+
+class _LoadedIndex:
+    """One on-disk index directory opened for serving: FAISS index + read-only chunk store."""
+
+    def __init__(self, index_dir: str, embeddings):
+        import chunk_store
+        import faiss_index
+
+        chunks_path = os.path.join(index_dir, chunk_store.CHUNKS_DB)
+        if not os.path.exists(chunks_path):
+            # One-time upgrade of a LangChain index.pkl docstore (restricted unpickler, no code runs).
+            try:
+                n = chunk_store.migrate_legacy_docstore(index_dir)
+            except OSError as exc:
+                raise RuntimeError(
+                    f"{index_dir} has no {chunk_store.CHUNKS_DB} and cannot be migrated here ({exc}); "
+                    f"run `python chunk_store.py migrate {index_dir}` when building the image"
+                ) from exc
+            print(f"[retriever] migrated {n} chunks from {chunk_store.LEGACY_DOCSTORE} to {chunk_store.CHUNKS_DB}")
+        self.search_mode = RAG_SEARCH_MODE
+        if self.search_mode == "hybrid":
+            try:
+                # Writable open creates / backfills chunks_fts for stores built before it existed.
+                chunk_store.ChunkStore(chunks_path).close()
+            except sqlite3.Error as exc:
+                print(f"[retriever] BM25 index unavailable in {index_dir} ({exc}); using vector search only")
+                self.search_mode = "vector"
+
+        index_path = os.path.join(index_dir, faiss_index.INDEX_FILE)
+        self.index = faiss_index.read_index(index_path)
+        faiss_index.apply_search_params(self.index)
+        dim = len(embeddings.embed_query("dimension check"))
+        if dim != self.index.d:
+            raise ValueError(f"embeddings have dim {dim}, index in {index_dir} expects {self.index.d}")
+        self.index_dir = index_dir
+        self.index_kind = faiss_index.index_kind(self.index)
+        self.nbytes = os.path.getsize(index_path)
+        self.chunks = chunk_store.ChunkStore(chunks_path, readonly=True)
+
+    def rankings(self, vector, query: str, n: int) -> list:
+        """Candidate label rankings (best first): FAISS, plus BM25 in hybrid mode."""
+        _distances, labels = self.index.search(vector, n)
+        rankings = [labels[0][labels[0] != -1]]
+        if self.search_mode == "hybrid":
+            try:
+                rankings.append(self.chunks.search_lexical(query, n))
+            except sqlite3.Error as exc:
+                print(f"[retriever] BM25 search failed: {exc}")
+        return rankings
+
+
+class _IndexCache:
+    """
+    LRU of loaded collection indexes, bounded by RAG_COLLECTION_CACHE_MB (sum of index file
+    sizes) and RAG_COLLECTION_CACHE_MAX entries. Evicted indexes are only dereferenced, so a
+    search already holding one finishes normally; memory is released when it drops its reference.
+    """
+
+    def __init__(self, budget_bytes: int, max_entries: int):
+        self.budget_bytes = budget_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _LoadedIndex]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks: dict = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, index_dir: str, embeddings) -> _LoadedIndex:
+        with self._lock:
+            loaded = self._entries.get(index_dir)
+            if loaded is not None:
+                self._entries.move_to_end(index_dir)
+                self.hits += 1
+                return loaded
+            load_lock = self._load_locks.setdefault(index_dir, threading.Lock())
+        with load_lock:  # one load per directory; concurrent callers wait for it
+            try:
+                with self._lock:
+                    loaded = self._entries.get(index_dir)
+                    if loaded is not None:
+                        self._entries.move_to_end(index_dir)
+                        self.hits += 1
+                        return loaded
+                    self.misses += 1
+                loaded = _LoadedIndex(index_dir, embeddings)
+                with self._lock:
+                    self._entries[index_dir] = loaded
+                    self._bytes += loaded.nbytes
+                    while len(self._entries) > 1 and (
+                        self._bytes > self.budget_bytes or len(self._entries) > self.max_entries
+                    ):
+                        _dir, evicted = self._entries.popitem(last=False)
+                        self._bytes -= evicted.nbytes
+                        self.evictions += 1
+            finally:
+                # Also after a failed load, so the dict does not keep one lock per bad directory.
+                with self._lock:
+                    if self._load_locks.get(index_dir) is load_lock:
+                        del self._load_locks[index_dir]
+        return loaded
+
+    def invalidate(self, index_dir: str) -> None:
+        with self._lock:
+            loaded = self._entries.pop(index_dir, None)
+            if loaded is not None:
+                self._bytes -= loaded.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": len(self._entries),
+                "max_entries": self.max_entries,
+                "resident_mb": round(self._bytes / (1 << 20), 2),
+                "budget_mb": round(self.budget_bytes / (1 << 20), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class _RetrieverState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.embeddings = None
+        self.embedding_backend: Optional[str] = None
+        self.shared: Optional[_LoadedIndex] = None
+        self.collections = _IndexCache(RAG_COLLECTION_CACHE_MB << 20, RAG_COLLECTION_CACHE_MAX)
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.load_sec: Optional[float] = None
+
+
+_state = _RetrieverState()
+
+
+def _load() -> None:
+    started = time.perf_counter()
+    try:
+        from embeddings import load_embeddings
+
+        embeddings, backend = load_embeddings(EMBEDDING_MODEL)
+        _state.shared = _LoadedIndex(FAISS_INDEX_DIR, embeddings)
+        _state.embeddings = embeddings
+        _state.embedding_backend = backend
+    except Exception as exc:
+        _state.error = f"{type(exc).__name__}: {exc}"
+        print(f"[retriever] warm-up failed: {_state.error}")
+    finally:
+        _state.load_sec = round(time.perf_counter() - started, 3)
+        _state.ready.set()
+
+
+def start_warm_up() -> None:
+    """Start loading in a daemon thread (idempotent)."""
+    with _state.lock:
+        if _state.thread is not None:
+            return
+        _state.started_at = time.time()
+        _state.thread = threading.Thread(target=_load, name="retriever-warmup", daemon=True)
+        _state.thread.start()
+
+
+def wait_until_ready(timeout: Optional[float] = RAG_WARMUP_TIMEOUT_SEC) -> None:
+    """Block until warm-up completes; raise RetrieverNotReady on timeout or failure."""
+    start_warm_up()
+    if not _state.ready.wait(timeout):
+        raise RetrieverNotReady("Document index is still loading")
+    if _state.error:
+        raise RetrieverNotReady(f"Document index failed to load ({_state.error})")
+
+
+def get_embeddings(timeout: Optional[float] = RAG_WARMUP_TIMEOUT_SEC):
+    """The loaded embeddings model (waits up to `timeout` for warm-up; 0 = only if already loaded)."""
+    wait_until_ready(timeout)
+    return _state.embeddings
+
+
+def invalidate_collection(index_dir: str) -> None:
+    """Drop a cached collection index (after it was re-ingested or deleted)."""
+    _state.collections.invalidate(index_dir)
+
+
+def rrf_fuse(rankings: list, k: int, rrf_k: int = RAG_RRF_K) -> list:
+    """
+    Reciprocal rank fusion: score(label) = Σ 1 / (rrf_k + rank), rank 1-based per ranking.
+    Vectorized over all candidates; ties keep first-seen order (earlier rankings first).
+    """
+    import numpy as np
+
+    rankings = [np.asarray(r, dtype="int64") for r in rankings if len(r)]
+    if not rankings:
+        return []
+    labels = np.concatenate(rankings)
+    scores = np.concatenate([1.0 / (rrf_k + np.arange(1, len(r) + 1)) for r in rankings])
+    unique, first_seen, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    fused = np.bincount(inverse, weights=scores)
+    order = np.lexsort((first_seen, -fused))[:k]
+    return unique[order].tolist()
+
+
+# Fused keys are (source slot << _SLOT_SHIFT) | label, so rankings from several indexes
+# share one RRF pass; chunk labels stay far below 2**40.
+_SLOT_SHIFT = 40
+
+
+def search(query: str, k: int = RAG_TOP_K, collection_dirs: Sequence[str] = ()) -> list:
+    """
+    Top-k Documents for the query (waits for warm-up). Private collections in
+    collection_dirs are searched together with the shared index and fused into one
+    ranking. Only the k hit rows are read from disk.
+    """
+    import numpy as np
+    from langchain_core.documents import Document
+
+    wait_until_ready()
+    sources = []
+    for index_dir in collection_dirs:
+        try:
+            sources.append(_state.collections.get(index_dir, _state.embeddings))
+        except Exception as exc:
+            print(f"[retriever] skipping collection {index_dir}: {type(exc).__name__}: {exc}")
+    sources.append(_state.shared)
+    single = len(sources) == 1 and sources[0].search_mode != "hybrid"
+    n_candidates = k if single else max(k, RAG_HYBRID_CANDIDATES)
+
+    vector = np.asarray([_state.embeddings.embed_query(query)], dtype="float32")
+    rankings = []
+    for slot, source in enumerate(sources):
+        for ranking in source.rankings(vector, query, n_candidates):
+            rankings.append(np.asarray(ranking, dtype="int64") | (slot << _SLOT_SHIFT))
+    keys = rrf_fuse(rankings, k)
+
+    label_mask = (1 << _SLOT_SHIFT) - 1
+    rows = {}
+    for slot, source in enumerate(sources):
+        labels = [key & label_mask for key in keys if key >> _SLOT_SHIFT == slot]
+        for label, chunk in source.chunks.get_many(labels).items():
+            rows[(slot << _SLOT_SHIFT) | label] = chunk
+    return [
+        Document(page_content=rows[key].text, metadata=rows[key].metadata)
+        for key in keys
+        if key in rows
+    ]
+
+
+def retriever_status() -> dict:
+    if _state.thread is None:
+        status = "not_started"
+    elif not _state.ready.is_set():
+        status = "warming"
+    elif _state.error:
+        status = "failed"
+    else:
+        status = "ready"
+    return {
+        "status": status,
+        "ready": status == "ready",
+        "load_sec": _state.load_sec,
+        "error": _state.error,
+        "embedding_backend": _state.embedding_backend,
+        "index_kind": _state.shared.index_kind if _state.shared else None,
+        "search_mode": _state.shared.search_mode if _state.shared else None,
+        "query_embedding_cache": _state.embeddings.stats() if _state.embeddings is not None else None,
+        "collections": _state.collections.stats(),
+    }
@@ -0,0 +1,330 @@
+"""
+SQLite access for chatbot.db: a pool of read-only WAL readers and one writer thread.
+
+- Readers: SQLITE_READERS read-only connections (mode=ro). In WAL mode they read the last
+  committed snapshot without waiting for the writer, so /threads and history latency no
+  longer depends on how many streams are checkpointing.
+- Writer: a single connection owned by one thread. Callers submit jobs (fn(conn)) and wait
+  for their commit; jobs queued while a transaction is running are committed together in
+  the next one (group commit, up to SQLITE_WRITE_BATCH jobs). Each job runs in its own
+  savepoint, so one failing job does not roll back the others.
+- PooledSqliteSaver is SqliteSaver with reads routed to the pool and puts/deletes routed
+  through the writer. AsyncPooledSqliteSaver is its face for the async graph (ASYNC_GRAPH=1):
+  same reader pool and same writer, so chatbot.db never has a second writing connection
+  competing with the group commits for the database lock.
+"""
+
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+SQLITE_READERS = max(1, int(os.getenv("SQLITE_READERS", "8")))
+SQLITE_WRITE_BATCH = max(1, int(os.getenv("SQLITE_WRITE_BATCH", "64")))
+
+
+def _configure(conn: sqlite3.Connection) -> None:
+    conn.execute("PRAGMA busy_timeout=30000")
+
+
+class SqliteReaderPool:
+    """Read-only connections handed out one per caller; grows past `size` under load (extras are closed)."""
+
+    def __init__(self, path: str, size: int = SQLITE_READERS):
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.in_use = 0
+        self.overflow = 0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False, timeout=30)
+        _configure(conn)
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+            with self._lock:
+                self.opened += 1
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self.in_use -= 1
+                keep = self._idle.qsize() < self.size
+                if not keep:
+                    self.opened -= 1
+                    self.overflow += 1
+            if keep:
+                self._idle.put(conn)
+            else:
+                conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": self.size, "open": self.opened, "in_use": self.in_use, "overflow_closed": self.overflow}
+
+
+class SqliteWriter:
+    """Single writer connection fed by a queue; see module docstring."""
+
+    def __init__(self, conn: sqlite3.Connection, max_batch: int = SQLITE_WRITE_BATCH):
+        conn.isolation_level = None  # transactions are managed explicitly below
+        self.conn = conn
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[tuple[Callable, Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+        self._stats_lock = threading.Lock()
+        self.jobs = 0
+        self.transactions = 0
+        self.failed_jobs = 0
+        self.write_sec = 0.0
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any]) -> Future:
+        future: Future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def run(self, fn: Callable[[sqlite3.Connection], Any], timeout: Optional[float] = None) -> Any:
+        """Run fn(conn) in the writer thread and return its result once committed."""
+        if threading.current_thread() is self._thread:
+            return fn(self.conn)  # nested call from inside a job: already in its transaction
+        return self.submit(fn).result(timeout)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch: list) -> None:
+        started = time.perf_counter()
+        results = []
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for fn, _future in batch:
+                self.conn.execute("SAVEPOINT job")
+                try:
+                    results.append((fn(self.conn), None))
+                    self.conn.execute("RELEASE job")
+                except Exception as exc:
+                    self.conn.execute("ROLLBACK TO job")
+                    self.conn.execute("RELEASE job")
+                    results.append((None, exc))
+            self.conn.execute("COMMIT")
+        except Exception as exc:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            results = [(None, exc)] * len(batch)
+        with self._stats_lock:
+            self.transactions += 1
+            self.jobs += len(batch)
+            self.failed_jobs += sum(1 for _r, exc in results if exc is not None)
+            self.write_sec += time.perf_counter() - started
+        for (_fn, future), (result, exc) in zip(batch, results):
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "jobs": self.jobs,
+                "transactions": self.transactions,
+                "avg_jobs_per_commit": round(self.jobs / self.transactions, 2) if self.transactions else None,
+                "failed_jobs": self.failed_jobs,
+                "avg_commit_ms": round(1000 * self.write_sec / self.transactions, 2) if self.transactions else None,
+            }
+
+
+class _RecordingCursor:
+    """Collects a write cursor's statements so they can be replayed by the writer thread."""
+
+    def __init__(self):
+        self.ops = []
+
+    def execute(self, sql, params=()):
+        self.ops.append((False, sql, params))
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self.ops.append((True, sql, list(seq_of_params)))
+        return self
+
+    def replay(self, conn: sqlite3.Connection) -> None:
+        for many, sql, params in self.ops:
+            (conn.executemany if many else conn.execute)(sql, params)
+
+
+class _NoLock:
+    """SqliteSaver's connection lock is not needed: readers are per-thread, writes are queued."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def acquire(self, *args, **kwargs):
+        return True
+
+    def release(self):
+        pass
+
+
+class PooledSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver whose `cursor(transaction=False)` borrows a pooled reader (also exposed as
+    `self.conn` for the duration, since list() opens a second cursor on it) and whose write
+    cursors are recorded and committed by the SqliteWriter.
+    """
+
+    def __init__(self, writer: SqliteWriter, readers: SqliteReaderPool, **kwargs):
+        self._writer = writer
+        self._readers = readers
+        self._local = threading.local()
+        super().__init__(writer.conn, **kwargs)
+        self.lock = _NoLock()
+        # Before any job is queued: setup() uses executescript, which cannot run inside
+        # the writer's batch transaction.
+        SqliteSaver.setup(self)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        reader = getattr(self._local, "reader", None)
+        return reader if reader is not None else self._writer.conn
+
+    @conn.setter
+    def conn(self, value: sqlite3.Connection) -> None:
+        pass  # always the writer's connection (set in __init__)
+
+    def setup(self) -> None:
+        pass  # done once by __init__ through the writer
+
+    @contextmanager
+    def cursor(self, transaction: bool = True) -> Iterator[sqlite3.Cursor]:
+        if not transaction:
+            with self._readers.connection() as reader:
+                previous = getattr(self._local, "reader", None)
+                self._local.reader = reader
+                cur = reader.cursor()
+                try:
+                    yield cur
+                finally:
+                    cur.close()
+                    self._local.reader = previous
+            return
+        recorder = _RecordingCursor()
+        yield recorder
+        if recorder.ops:
+            deferred = getattr(self._local, "deferred", None)
+            if deferred is not None:
+                deferred.append(recorder)
+            else:
+                self._writer.run(recorder.replay)
+
+    def deferred_writes(self, fn: Callable, *args, **kwargs) -> tuple:
+        """
+        Run a write method (put, put_writes, delete_thread) with its statements collected
+        instead of sent: returns (result, replay) where replay(conn) is the writer job.
+        """
+        self._local.deferred = recorders = []
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            self._local.deferred = None
+
+        def replay(conn: sqlite3.Connection) -> None:
+            for recorder in recorders:
+                recorder.replay(conn)
+
+        return result, replay
+
+
+class AsyncPooledSqliteSaver(BaseCheckpointSaver):
+    """
+    Async checkpointer over a PooledSqliteSaver. Reads run in a worker thread on the reader
+    pool; writes are serialized in a worker thread, then awaited on the SqliteWriter (the
+    event loop waits for the commit, no thread does).
+    """
+
+    def __init__(self, saver: PooledSqliteSaver):
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+
+    async def _write(self, fn: Callable, *args, **kwargs) -> Any:
+        result, replay = await asyncio.to_thread(self.saver.deferred_writes, fn, *args, **kwargs)
+        await asyncio.wrap_future(self.saver._writer.submit(replay))
+        return result
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.saver.get_tuple, config)
+
+    async def alist(self, config, **kwargs):
+        items = await asyncio.to_thread(lambda: list(self.saver.list(config, **kwargs)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await self._write(self.saver.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, *args, **kwargs) -> None:
+        await self._write(self.saver.put_writes, config, writes, task_id, *args, **kwargs)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self._write(self.saver.delete_thread, thread_id)
+
+    # Sync callers (e.g. get_state on the async graph) use the pooled saver directly.
+    def get_tuple(self, config):
+        return self.saver.get_tuple(config)
+
+    def list(self, config, **kwargs):
+        return self.saver.list(config, **kwargs)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self.saver.put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, *args, **kwargs) -> None:
+        self.saver.put_writes(config, writes, task_id, *args, **kwargs)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.saver.delete_thread(thread_id)
+
+    def get_next_version(self, current, channel):
+        return self.saver.get_next_version(current, channel)
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+import adaptive_limit
+from adaptive_limit import ADAPTIVE_MIN_SAMPLES, AdaptiveLimiter
+
+
+@pytest.fixture
+def every_call_is_a_window(monkeypatch):
+    monkeypatch.setattr(adaptive_limit, "ADAPTIVE_WINDOW_SEC", 0.0)
+    monkeypatch.setattr(adaptive_limit, "ADAPTIVE_BACKOFF", 0.5)
+    monkeypatch.setattr(adaptive_limit, "ADAPTIVE_STEP", 2.0)
+
+
+def _limiter(limit=16, max_limit=32, min_limit=4, enabled=True):
+    limiter = AdaptiveLimiter(max_limit, min_limit=min_limit, enabled=enabled)
+    limiter.limit = float(limit)
+    return limiter
+
+
+def test_decide_needs_enough_upstream_responses():
+    limiter = _limiter()
+    # One request's 429 plus its SDK retries is not a trend.
+    assert limiter._decide(None, 0, 1.0, ADAPTIVE_MIN_SAMPLES - 1, 0)[0] == "hold"
+    assert limiter._decide(None, 0, 1.0, ADAPTIVE_MIN_SAMPLES, 0)[0] == "decrease"
+    assert limiter._decide(None, 0, 0.0, 100, 0)[0] == "hold"
+
+
+def test_decide_needs_enough_ttft_samples():
+    limiter = _limiter()
+    slow = adaptive_limit.ADAPTIVE_TTFT_TARGET_SEC * 2
+    assert limiter._decide(slow, ADAPTIVE_MIN_SAMPLES - 1, None, 0, 0)[0] == "hold"
+    assert limiter._decide(slow, ADAPTIVE_MIN_SAMPLES, None, 0, 0)[0] == "decrease"
+
+
+def test_decide_grows_only_under_queueing():
+    limiter = _limiter()
+    assert limiter._decide(0.1, 10, 0.0, 10, 3) == ("increase", "3 streams queued for a slot")
+    assert limiter._decide(0.1, 10, 0.0, 10, 0)[0] == "hold"
+    # Backing off wins over queueing.
+    assert limiter._decide(None, 0, 1.0, 10, 3)[0] == "decrease"
+
+
+def test_errors_back_off_multiplicatively_to_the_floor(every_call_is_a_window):
+    limiter = _limiter(limit=16, min_limit=4)
+
+    async def window_with_errors():
+        for _ in range(ADAPTIVE_MIN_SAMPLES):
+            limiter.record_upstream(429)
+        await limiter._maybe_adjust()
+
+    asyncio.run(window_with_errors())
+    assert limiter.limit == 8
+    asyncio.run(window_with_errors())
+    asyncio.run(window_with_errors())
+    assert limiter.limit == 4
+    assert limiter.decreases == 2
+    assert [d["limit"] for d in limiter.decisions] == [8, 4]
+
+
+def test_queueing_grows_additively_to_the_cap(every_call_is_a_window):
+    limiter = _limiter(limit=29, max_limit=32)
+
+    async def queued_window():
+        limiter._queued = 2
+        await limiter._maybe_adjust()
+
+    asyncio.run(queued_window())
+    assert limiter.limit == 31
+    asyncio.run(queued_window())
+    assert limiter.limit == 32
+    assert limiter.increases == 2
+
+
+def test_disabled_limiter_only_observes(every_call_is_a_window):
+    limiter = AdaptiveLimiter(32, min_limit=4, enabled=False)
+    for _ in range(10):
+        limiter.record_upstream(503)
+    asyncio.run(limiter._maybe_adjust())
+    assert limiter.limit == 32 and limiter.decreases == 0
+
+
+def test_acquire_waits_at_the_limit_and_release_wakes():
+    limiter = _limiter(limit=1, min_limit=1)
+
+    async def run():
+        await limiter.acquire()
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        await limiter.release()
+        waited = await asyncio.wait_for(second, 1.0)
+        assert waited > 0
+        assert limiter.in_flight == 1
+        assert limiter.stats()["current_window"]["queued"] == 1
+
+    asyncio.run(run())
+
+
+def test_set_max_limit_caps_the_current_limit():
+    limiter = _limiter(limit=16, max_limit=32, min_limit=4)
+    limiter.set_max_limit(8)
+    assert (limiter.limit, limiter.max_limit) == (8, 8)
+    fixed = AdaptiveLimiter(400, enabled=False)
+    fixed.set_max_limit(50)
+    assert fixed.limit == 50
@@ -0,0 +1,140 @@
+import os
+import pickle
+import sqlite3
+import sys
+import types
+
+import pytest
+
+import chunk_store
+from chunk_store import ChunkStore, fts_query, migrate_legacy_docstore
+
+
+def test_fts_query_ors_words_and_keeps_phrases():
+    assert fts_query('"data ethics" consent consent') == '"data ethics" OR "consent"'
+
+
+def test_fts_query_strips_fts_syntax():
+    # Operators and quotes in user text must not reach MATCH as syntax.
+    assert fts_query('NEAR(a*, "b-c") OR -x') == '"b c" OR "NEAR" OR "a" OR "OR" OR "x"'
+
+
+def test_fts_query_empty():
+    assert fts_query("") == ""
+    assert fts_query("?!") == ""
+    assert fts_query('""') == ""
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = ChunkStore(str(tmp_path / "chunks.db"))
+    yield s
+    s.close()
+
+
+def test_add_assigns_consecutive_labels_and_reads_back(store):
+    labels = store.add(["a", "b"], ["first text", "second text"], [{"page": 1}, {}])
+    store.commit()
+    assert labels == [0, 1]
+    assert store.next_label() == 2
+    chunks = store.get_many([1, 0, 99])
+    assert sorted(chunks) == [0, 1]
+    assert chunks[0].doc_id == "a" and chunks[0].metadata == {"page": 1}
+
+
+def test_search_lexical_ranks_by_bm25(store):
+    store.add(
+        ["a", "b", "c"],
+        [
+            "Privacy and informed consent in data collection.",
+            "Consent, consent and more consent: the consent chapter.",
+            "Algorithmic fairness and bias.",
+        ],
+        [{}, {}, {}],
+    )
+    store.commit()
+    assert store.search_lexical("consent", 10) == [1, 0]
+    assert store.search_lexical('"informed consent"', 10) == [0]
+    assert store.search_lexical("unrelated", 10) == []
+
+
+def test_fts_index_follows_deletes(store):
+    store.add(["a", "b"], ["alpha beta", "beta gamma"], [{}, {}])
+    assert store.delete_doc_ids(["a"]) == [0]
+    store.commit()
+    assert store.search_lexical("beta", 10) == [1]
+    assert store.count() == 1
+
+
+def test_store_without_fts_is_indexed_on_open(tmp_path):
+    path = str(tmp_path / "chunks.db")
+    conn = sqlite3.connect(path)  # a v1 store: chunks table only
+    conn.execute("CREATE TABLE chunks (label INTEGER PRIMARY KEY, doc_id TEXT NOT NULL UNIQUE, "
+                 "text TEXT NOT NULL, metadata TEXT NOT NULL DEFAULT '{}')")
+    conn.execute("INSERT INTO chunks VALUES (5, 'x', 'legacy chunk text', '{}')")
+    conn.commit()
+    conn.close()
+
+    store = ChunkStore(path)
+    try:
+        assert store.search_lexical("legacy", 10) == [5]
+    finally:
+        store.close()
+
+
+def _pickle_legacy_docstore(index_dir, payload):
+    """Write index.pkl the way LangChain did, with stand-in classes from a langchain* module."""
+    module = types.ModuleType("langchain_legacy_test")
+
+    class InMemoryDocstore:
+        pass
+
+    class Document:
+        pass
+
+    for cls in (InMemoryDocstore, Document):
+        cls.__module__ = module.__name__
+        cls.__qualname__ = cls.__name__
+        setattr(module, cls.__name__, cls)
+    sys.modules[module.__name__] = module
+    try:
+        docstore = InMemoryDocstore()
+        docstore._dict = {}
+        for doc_id, (text, metadata) in payload["docs"].items():
+            doc = Document()
+            doc.page_content = text
+            doc.metadata = metadata
+            docstore._dict[doc_id] = doc
+        with open(os.path.join(index_dir, chunk_store.LEGACY_DOCSTORE), "wb") as f:
+            pickle.dump((docstore, payload["index_to_id"]), f)
+    finally:
+        del sys.modules[module.__name__]  # loading must not need the classes
+
+
+def test_migrate_legacy_docstore(tmp_path):
+    _pickle_legacy_docstore(
+        tmp_path,
+        {
+            "docs": {"id-a": ("chapter ten intro", {"page": 10}), "id-b": ("closing remarks", {})},
+            "index_to_id": {1: "id-b", 0: "id-a", 2: "missing"},
+        },
+    )
+    assert migrate_legacy_docstore(str(tmp_path)) == 2
+    assert not os.path.exists(tmp_path / (chunk_store.CHUNKS_DB + ".tmp"))
+
+    store = ChunkStore.for_index_dir(str(tmp_path), readonly=True)
+    try:
+        chunks = store.get_many([0, 1])
+        assert (chunks[0].doc_id, chunks[0].text, chunks[0].metadata) == ("id-a", "chapter ten intro", {"page": 10})
+        assert chunks[1].doc_id == "id-b"
+        assert store.search_lexical("remarks", 10) == [1]
+    finally:
+        store.close()
+
+
+def test_migrate_refuses_foreign_globals(tmp_path):
+    with open(tmp_path / chunk_store.LEGACY_DOCSTORE, "wb") as f:
+        pickle.dump((os.getcwd, {}), f)
+    with pytest.raises(pickle.UnpicklingError):
+        migrate_legacy_docstore(str(tmp_path))
+    assert not os.path.exists(tmp_path / chunk_store.CHUNKS_DB)
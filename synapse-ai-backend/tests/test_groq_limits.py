@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+import concurrency
+
+pytest.importorskip("httpx")
+
+from groq_limits import (  # noqa: E402
+    PRIORITY_BACKGROUND,
+    PRIORITY_CHAT,
+    PRIORITY_VOICE,
+    GroqScheduler,
+    _Bucket,
+    _parse_duration,
+)
+
+MODEL = "test/model-1"
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setenv("GROQ_TPM_TEST_MODEL_1", "6000")
+    return GroqScheduler()
+
+
+def test_bucket_refills_continuously_up_to_capacity():
+    bucket = _Bucket(600)  # 10 units per second
+    bucket.level = 0
+    bucket.refill(bucket.updated + 3)
+    assert bucket.level == pytest.approx(30)
+    bucket.refill(bucket.updated + 3600)
+    assert bucket.level == 600
+
+
+def test_bucket_wait_for():
+    bucket = _Bucket(600)
+    bucket.level = 100
+    assert bucket.wait_for(50) == 0
+    assert bucket.wait_for(160) == pytest.approx(6.0)
+    # More than the capacity waits for a full bucket, not forever.
+    assert bucket.wait_for(10_000) == pytest.approx(50.0)
+
+
+@pytest.mark.parametrize(
+    "value, seconds",
+    [("7.66s", 7.66), ("2m59.56s", 179.56), ("120ms", 0.12), ("1h", 3600.0), ("3", 3.0), ("", None), ("soon", None)],
+)
+def test_parse_duration(value, seconds):
+    assert _parse_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_unconfigured_model_is_not_throttled():
+    scheduler = GroqScheduler()
+    for _ in range(100):
+        assert scheduler.wait_turn("other/model", PRIORITY_CHAT, 50_000) < 0.05
+    stats = scheduler.stats()["models"]["other/model"]
+    assert stats["rpm"] is None and stats["tpm"] is None
+    assert stats["granted"]["chat"] == 100
+
+
+def test_waiters_are_served_by_priority_then_arrival(scheduler):
+    background = scheduler._enqueue(MODEL, PRIORITY_BACKGROUND)
+    chat_first = scheduler._enqueue(MODEL, PRIORITY_CHAT)
+    voice = scheduler._enqueue(MODEL, PRIORITY_VOICE)
+    chat_second = scheduler._enqueue(MODEL, PRIORITY_CHAT)
+
+    served = []
+    pending = [background, chat_first, voice, chat_second]
+    while pending:
+        for ticket in list(pending):
+            if scheduler._try(MODEL, ticket, 10, overdue=False) == 0:
+                served.append(ticket)
+                pending.remove(ticket)
+                break
+        else:
+            pytest.fail("no ticket could be served")
+    assert served == [chat_first, chat_second, voice, background]
+
+
+def test_background_keeps_headroom_for_chat(scheduler):
+    limits = scheduler._limits(MODEL)
+    limits.tokens.level = 2000  # headroom = 0.3 * 6000 = 1800
+    background = scheduler._enqueue(MODEL, PRIORITY_BACKGROUND)
+    assert scheduler._try(MODEL, background, 500, overdue=False) > 0
+    scheduler._abandon(MODEL, background)
+
+    chat = scheduler._enqueue(MODEL, PRIORITY_CHAT)
+    assert scheduler._try(MODEL, chat, 500, overdue=False) == 0
+    assert limits.tokens.level == pytest.approx(1500, abs=5)
+
+
+def test_overdue_call_goes_out_anyway(scheduler):
+    scheduler._limits(MODEL).tokens.level = 0
+    started = time.monotonic()
+    scheduler.wait_turn(MODEL, PRIORITY_CHAT, 3000, max_wait=0.2)
+    assert 0.15 <= time.monotonic() - started < 1.0
+    assert scheduler.stats()["models"][MODEL]["overdue_sent"] == 1
+
+
+def test_observe_learns_tpm_from_headers():
+    scheduler = GroqScheduler()
+    scheduler.observe("other/model", 200, {"x-ratelimit-limit-tokens": "8000", "x-ratelimit-remaining-tokens": "1200"})
+    tokens = scheduler._limits("other/model").tokens
+    assert tokens.capacity == 8000
+    assert tokens.level == pytest.approx(1200, abs=5)
+
+
+def test_observe_blocks_on_429_and_exhausted_requests(scheduler):
+    scheduler.observe(MODEL, 429, {"retry-after": "2"})
+    assert scheduler._limits(MODEL).blocked_until - time.monotonic() == pytest.approx(2, abs=0.1)
+
+    scheduler.observe(MODEL, 200, {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1m"})
+    assert scheduler._limits(MODEL).blocked_until - time.monotonic() == pytest.approx(60, abs=0.1)
+    assert scheduler.stats()["models"][MODEL]["rate_limited_429"] == 1
+
+
+def test_cancelled_job_leaves_the_queue(scheduler):
+    scheduler._limits(MODEL).tokens.level = 0
+    cancel = threading.Event()
+    cancel.set()
+    token = concurrency._job_cancel.set(cancel)  # as inside a pool job whose caller gave up
+    try:
+        with pytest.raises(concurrency.JobCancelled):
+            scheduler.wait_turn(MODEL, PRIORITY_CHAT, 3000, max_wait=5)
+    finally:
+        concurrency._job_cancel.reset(token)
+    assert scheduler._limits(MODEL).waiting == []
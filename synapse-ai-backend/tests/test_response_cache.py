@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from response_cache import SemanticResponseCache, cacheable_question  # noqa: E402
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    # Embeds ignoring digits and names: near-duplicates that differ only in those score
+    # 1.0, as they come close to doing with the real model.
+    def embed(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        words = text.split()
+        for i, word in enumerate(words):
+            if i and word[0].isupper():
+                continue
+            vector[hash("".join(c for c in word.lower() if not c.isdigit())) % 64] += 1.0
+        return vector / np.linalg.norm(vector)
+
+    monkeypatch.setattr(SemanticResponseCache, "_embed", embed)
+    return SemanticResponseCache(max_entries=8, ttl=60, threshold=0.95)
+
+
+@pytest.mark.parametrize(
+    "question",
+    ["What day is it?", "what time is it now", "Today's date please", "What year is it", "Is it Friday?"],
+)
+def test_date_and_time_questions_are_not_cacheable(question):
+    assert not cacheable_question(question)
+
+
+def test_timeless_questions_are_cacheable():
+    assert cacheable_question("Explain quantum computing simply")
+
+
+def test_hit_on_rephrased_question(cache):
+    cache.store("text", "explain quantum computing simply", "answer")
+    assert cache.lookup("text", "Explain quantum computing simply") == "answer"
+
+
+def test_numbers_must_match(cache):
+    cache.store("text", "what is 234*19", "4446")
+    assert cache.lookup("text", "what is 234*18") is None
+    assert cache.lookup("text", "what is 234*19") == "4446"
+    cache.store("text", "what is 234*18", "4212")
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup("text", "what is 234*18") == "4212"
+
+
+def test_names_must_match(cache):
+    cache.store("text", "Tell me about Paris", "paris answer")
+    assert cache.lookup("text", "Tell me about Rome") is None
+    assert cache.lookup("text", "tell me about Paris") == "paris answer"
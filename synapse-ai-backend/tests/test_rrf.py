@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from retriever import rrf_fuse  # noqa: E402
+
+
+def test_label_in_both_rankings_wins():
+    assert rrf_fuse([[1, 2, 3], [3, 4, 5]], k=5, rrf_k=60) == [3, 1, 2, 4, 5]
+
+
+def test_scores_sum_reciprocal_ranks():
+    # 9: 1/62 + 1/61 beats 7: 1/61 + 1/63; 8 appears once.
+    assert rrf_fuse([[7, 9], [9, 8, 7]], k=3, rrf_k=60) == [9, 7, 8]
+
+
+def test_ties_keep_first_seen_order():
+    assert rrf_fuse([[10, 20], [20, 10]], k=2) == [10, 20]
+    assert rrf_fuse([[20, 10], [10, 20]], k=2) == [20, 10]
+
+
+def test_truncates_to_k_and_skips_empty_rankings():
+    assert rrf_fuse([[], [4, 5, 6], []], k=2) == [4, 5]
+    assert rrf_fuse([[], []], k=3) == []
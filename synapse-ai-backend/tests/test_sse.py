@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+from sse import DONE_FRAME, TokenCoalescer, sse_frame
+
+
+def _drain(events, window_sec=0.0, max_chars=1024, late=()):
+    """Feed `events` (and `late` ones after a short delay) through a coalescer until done/error."""
+
+    async def run():
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in events:
+            queue.put_nowait(event)
+
+        async def feed_late():
+            await asyncio.sleep(0.01)
+            for event in late:
+                queue.put_nowait(event)
+
+        feeder = asyncio.create_task(feed_late())
+        coalescer = TokenCoalescer(queue, window_sec=window_sec, max_chars=max_chars)
+        out = []
+        while True:
+            event = await coalescer.get(timeout=1.0)
+            out.append(event)
+            if event[0] in ("done", "error"):
+                break
+        await feeder
+        return out
+
+    return asyncio.run(run())
+
+
+def test_queued_tokens_merge_into_one_frame():
+    out = _drain([("token", "Hel"), ("token", "lo"), ("token", "!"), ("done", None)])
+    assert out == [("token", "Hello!"), ("done", None)]
+
+
+def test_other_events_flush_tokens_in_order():
+    out = _drain(
+        [
+            ("token", "a"),
+            ("token", "b"),
+            ("status", "using_tools"),
+            ("token", "c"),
+            ("error", "boom"),
+        ]
+    )
+    assert out == [("token", "ab"), ("status", "using_tools"), ("token", "c"), ("error", "boom")]
+
+
+def test_frames_are_capped_at_max_chars():
+    out = _drain([("token", "aaaa"), ("token", "bbbb"), ("token", "cc"), ("done", None)], max_chars=8)
+    assert out == [("token", "aaaabbbb"), ("token", "cc"), ("done", None)]
+
+
+def test_window_waits_for_late_tokens():
+    out = _drain([("token", "a")], window_sec=0.5, late=[("token", "b"), ("done", None)])
+    assert out == [("token", "ab"), ("done", None)]
+
+
+def test_zero_window_does_not_wait():
+    out = _drain([("token", "a")], window_sec=0.0, late=[("token", "b"), ("done", None)])
+    assert out == [("token", "a"), ("token", "b"), ("done", None)]
+
+
+def test_timeout_when_nothing_arrives():
+    async def run():
+        await TokenCoalescer(asyncio.Queue()).get(timeout=0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+
+
+def test_frames():
+    frame = sse_frame({"token": "naïve\n"})
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    assert b"\n" not in frame[:-2]
+    assert json.loads(frame[6:-2]) == {"token": "naïve\n"}
+    assert DONE_FRAME == b"data: [DONE]\n\n"
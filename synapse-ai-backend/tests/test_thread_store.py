@@ -0,0 +1,64 @@
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+from thread_store import DEFAULT_TITLE, ThreadStore
+
+
+class Db:
+    """One connection as both the reader pool and the single writer."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+    @contextmanager
+    def connection(self):
+        yield self.conn
+
+    def run(self, fn, timeout=None):
+        with self.conn:
+            return fn(self.conn)
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Db(tmp_path / "chatbot.db")
+
+
+def test_first_turn_creates_the_row(db):
+    store = ThreadStore(db, db)
+    store.setup()
+    assert store.record_turn("t1", "What is the capital of France?", "Paris.") is True
+    row = store.get("t1")
+    assert row["title"] == "What is the capital of Fran..."
+    assert row["message_count"] == 2
+    assert row["created_at"] == row["updated_at"]
+    assert row["last_snippet"] == "Paris."
+
+
+def test_later_turns_update_without_creating(db):
+    store = ThreadStore(db, db)
+    store.setup()
+    store.record_turn("t1", "hi", "hello")
+    assert store.record_turn("t1", "again", "") is False
+    row = store.get("t1")
+    assert row["message_count"] == 3
+    # A turn without a reply (cancelled/failed) keeps the previous snippet.
+    assert row["last_snippet"] == "hello"
+    assert row["title"] == "hi"
+
+
+def test_backfilled_thread_starts_counting(db):
+    db.conn.execute("CREATE TABLE checkpoints (thread_id TEXT)")
+    db.conn.execute("INSERT INTO checkpoints VALUES ('legacy')")
+    store = ThreadStore(db, db)
+    store.setup()
+    assert store.get("legacy")["message_count"] is None
+
+    assert store.record_turn("legacy", "back again", "welcome back") is False
+    row = store.get("legacy")
+    assert row["message_count"] == 2
+    assert row["created_at"] is None and row["updated_at"] is not None
+    assert row["title"] == DEFAULT_TITLE
+    assert store.list_recent()[0]["thread_id"] == "legacy"
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import token_budget
+from token_budget import (
+    MESSAGE_OVERHEAD_TOKENS,
+    context_limit,
+    count_message_tokens,
+    count_tokens,
+    history_budget,
+    merge_token_counts,
+    trim_start,
+)
+
+
+class Msg:
+    """The message attributes token_budget reads (id, type, content, tool_calls)."""
+
+    def __init__(self, id, type, content="", tool_calls=None):
+        self.id = id
+        self.type = type
+        self.content = content
+        self.tool_calls = tool_calls or []
+
+
+@pytest.fixture(autouse=True)
+def estimated_counts(monkeypatch):
+    # chars/4 estimate: deterministic with or without tiktoken installed.
+    monkeypatch.setattr(token_budget, "_encoding_loaded", True)
+    monkeypatch.setattr(token_budget, "_encoding", None)
+
+
+def test_count_tokens_estimate():
+    assert count_tokens("") == 0
+    assert count_tokens("abcdefgh") == 3
+
+
+def test_count_message_tokens_includes_tool_calls_and_overhead():
+    call = {"name": "get_weather", "args": {"location": "Chennai"}}
+    text = "get_weather" + json.dumps(call["args"])
+    message = Msg("1", "ai", tool_calls=[call])
+    assert count_message_tokens(message) == count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def test_count_message_tokens_reads_content_blocks():
+    blocks = [{"type": "text", "text": "hello "}, "world", {"type": "image_url"}]
+    assert count_message_tokens(Msg("1", "human", blocks)) == count_tokens("hello world") + MESSAGE_OVERHEAD_TOKENS
+
+
+def test_merge_token_counts_adds_and_drops():
+    merged = merge_token_counts({"a": 5, "b": 7}, {"b": None, "c": 3})
+    assert merged == {"a": 5, "c": 3}
+    assert merge_token_counts(None, None) == {}
+
+
+def test_per_model_budgets(monkeypatch):
+    monkeypatch.setenv("CONTEXT_TOKEN_LIMIT_QWEN_QWEN3_6_27B", "12000")
+    monkeypatch.setenv("HISTORY_TOKEN_BUDGET_OPENAI_GPT_OSS_120B", "900")
+    assert context_limit("qwen/qwen3.6-27b") == 12000
+    assert context_limit("openai/gpt-oss-120b") == token_budget.CONTEXT_TOKEN_LIMIT
+    assert history_budget("openai/gpt-oss-120b") == 900
+
+
+def _history():
+    # Two turns; the second used a tool. Sizes come from counts, not content.
+    history = [
+        Msg("h1", "human"),
+        Msg("a1", "ai"),
+        Msg("h2", "human"),
+        Msg("a2", "ai"),
+        Msg("t2", "tool"),
+        Msg("a3", "ai"),
+    ]
+    counts = {"h1": 10, "a1": 40, "h2": 10, "a2": 5, "t2": 60, "a3": 20}
+    return history, counts
+
+
+def test_trim_keeps_everything_that_fits():
+    history, counts = _history()
+    assert trim_start(history, counts, 145) == 0
+
+
+def test_trim_cuts_at_a_user_message():
+    history, counts = _history()
+    # 95 tokens fit the whole second turn but not the first turn's answer.
+    assert trim_start(history, counts, 100) == 2
+    # A budget ending mid-turn still cuts at that turn's user message, never at the tool result.
+    assert trim_start(history, counts, 140) == 2
+
+
+def test_trim_keeps_the_last_turn_when_it_alone_is_over_budget():
+    history, counts = _history()
+    assert trim_start(history, counts, 30) == 2
+
+
+def test_trim_counts_uncounted_messages():
+    history = [Msg("h1", "human", "x" * 400), Msg("h2", "human", "short")]
+    assert trim_start(history, {}, 50) == 1
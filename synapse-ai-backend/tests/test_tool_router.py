@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import tool_router  # noqa: E402
+from tool_router import acall_with_route, call_with_route, is_routing_miss  # noqa: E402
+
+MISS = RuntimeError(
+    "Error code: 400 - {'error': {'message': 'tool call validation failed: attempted to call tool "
+    "'get_weather' which was not in request.tools', 'code': 'tool_use_failed'}}"
+)
+
+
+class Model:
+    """Fails with a routing miss unless every tool is bound; records the routes it was called with."""
+
+    def __init__(self, error=MISS):
+        self.error = error
+        self.calls = []
+
+    def __call__(self, tool_names):
+        self.calls.append(tool_names)
+        if tool_names is not None:
+            raise self.error
+        return "answer"
+
+
+@pytest.fixture(autouse=True)
+def fresh_router(monkeypatch):
+    monkeypatch.setattr(tool_router, "tool_router", tool_router.ToolRouter())
+
+
+def test_is_routing_miss_only_for_a_routed_subset():
+    assert is_routing_miss(MISS, ("calculator",))
+    assert is_routing_miss(MISS, ())
+    assert not is_routing_miss(MISS, None)
+    assert not is_routing_miss(RuntimeError("tool_use_failed: failed to call a function"), ("calculator",))
+
+
+def test_routing_miss_retries_once_with_all_tools():
+    model = Model()
+    assert call_with_route(model, ("calculator",)) == "answer"
+    assert model.calls == [("calculator",), None]
+    assert tool_router.tool_router.stats()["misses"] == 1
+
+
+def test_other_failures_are_not_retried():
+    model = Model(error=RuntimeError("tool_use_failed"))
+    with pytest.raises(RuntimeError, match="tool_use_failed"):
+        call_with_route(model, ("calculator",))
+    assert model.calls == [("calculator",)]
+
+
+def test_full_set_miss_is_not_retried():
+    def full_set_fails(tool_names):
+        raise MISS
+
+    with pytest.raises(RuntimeError):
+        call_with_route(full_set_fails, None)
+    assert tool_router.tool_router.stats()["misses"] == 0
+
+
+def test_async_routing_miss_retries_with_all_tools():
+    model = Model()
+
+    async def call(tool_names):
+        return model(tool_names)
+
+    assert asyncio.run(acall_with_route(call, ())) == "answer"
+    assert model.calls == [(), None]
@@ -0,0 +1,425 @@
+"""
+Per-conversation locks, pluggable so several uvicorn workers / replicas can share a DB.
+
+THREAD_LOCK_BACKEND:
+- memory (default): one threading.Lock per thread id — correct for a single worker only.
+- file: fcntl.lockf byte-range locks, one byte per thread id (at its 63-bit hash offset) in
+  one lock file in THREAD_LOCK_DIR — several workers on one host. Unrelated threads never
+  share a range, and the kernel drops a dead worker's locks with the process.
+- sqlite: lease rows in THREAD_LOCK_DB — several workers on one host; a crashed worker's
+  lease expires after THREAD_LOCK_LEASE_SEC (keep it above the longest chat turn).
+- postgres: pg_try_advisory_lock on a pooled session held for the turn — several hosts
+  (POSTGRES_URL; needs `pip install "psycopg[binary,pool]"`). Each in-flight turn pins one
+  connection, so the pool defaults to MAX_CONCURRENT_STREAMS plus room for deletes/compaction.
+
+Every backend also takes an in-process lock first, so threads of one worker queue locally
+and only one of them at a time touches the shared store. Lock objects follow the
+threading.Lock protocol (acquire(blocking, timeout) / release / with-statement). The shared
+part is blocking I/O: async callers go through acquire_turn_lock / release_turn_lock, which
+run it on a small dedicated pool instead of the event loop.
+
+In-process locks live in a reference-counted table: an entry exists only while someone holds
+or waits for that thread, so memory is bounded by in-flight turns, not by every thread id
+ever seen. The table also counts waiters per thread (see THREAD_BUSY_POLICY in main).
+"""
+
+import abc
+import asyncio
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from concurrency import MAX_CONCURRENT_STREAMS, WorkerPool
+
+THREAD_LOCK_BACKEND = os.getenv("THREAD_LOCK_BACKEND", "memory").strip().lower()
+THREAD_LOCK_DIR = os.getenv("THREAD_LOCK_DIR", "/tmp/synapse-thread-locks")
+THREAD_LOCK_DB = os.getenv("THREAD_LOCK_DB", "thread_locks.db")
+THREAD_LOCK_LEASE_SEC = float(os.getenv("THREAD_LOCK_LEASE_SEC", "600"))
+THREAD_LOCK_PG_POOL_SIZE = int(os.getenv("THREAD_LOCK_PG_POOL_SIZE", str(MAX_CONCURRENT_STREAMS + 10)))
+# Workers running shared-store lock attempts / releases for the event loop.
+THREAD_LOCK_POOL_SIZE = int(os.getenv("THREAD_LOCK_POOL_SIZE", "8"))
+POSTGRES_URL = os.getenv("POSTGRES_URL", "")
+
+_OWNER_PREFIX = f"{socket.gethostname()}:{os.getpid()}"
+
+# What a chat request does when its thread already has a turn in flight:
+# queue — wait (without a pool thread) and send a `queued` status; reject — HTTP 409.
+THREAD_BUSY_POLICY = os.getenv("THREAD_BUSY_POLICY", "queue").strip().lower()
+# Queued requests per thread (this process) beyond which new ones are rejected anyway.
+THREAD_LOCK_MAX_WAITERS = max(0, int(os.getenv("THREAD_LOCK_MAX_WAITERS", "2")))
+
+
+class _Entry:
+    __slots__ = ("lock", "refs", "waiters")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refs = 0  # holders + waiters + in-flight acquire attempts
+        self.waiters = 0
+
+
+_entries: dict[str, _Entry] = {}
+_entries_guard = threading.Lock()
+_evicted = 0
+
+
+def _checkout(thread_id: str, waiting: bool = False) -> _Entry:
+    with _entries_guard:
+        entry = _entries.get(thread_id)
+        if entry is None:
+            entry = _entries[thread_id] = _Entry()
+        entry.refs += 1
+        if waiting:
+            entry.waiters += 1
+        return entry
+
+
+def _checkin(thread_id: str, entry: _Entry, waiting: bool = False) -> None:
+    global _evicted
+    with _entries_guard:
+        entry.refs -= 1
+        if waiting:
+            entry.waiters -= 1
+        if entry.refs == 0:
+            del _entries[thread_id]
+            _evicted += 1
+
+
+@contextmanager
+def waiting(thread_id: str) -> Iterator[None]:
+    """Count the caller as a waiter on thread_id while it polls for the lock (async paths)."""
+    entry = _checkout(thread_id, waiting=True)
+    try:
+        yield
+    finally:
+        _checkin(thread_id, entry, waiting=True)
+
+
+def thread_waiters(thread_id: str) -> int:
+    """Requests in this process currently waiting for thread_id's lock."""
+    with _entries_guard:
+        entry = _entries.get(thread_id)
+        return entry.waiters if entry is not None else 0
+
+
+class LocalThreadLock:
+    """In-process lock handle for one thread id; the table entry is dropped once unused."""
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self._entry: Optional[_Entry] = None
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        entry = _checkout(self.thread_id, waiting=blocking)
+        try:
+            acquired = entry.lock.acquire(blocking, timeout)
+        except BaseException:
+            _checkin(self.thread_id, entry, waiting=blocking)
+            raise
+        if blocking:
+            with _entries_guard:
+                entry.waiters -= 1
+        if not acquired:
+            _checkin(self.thread_id, entry)
+            return False
+        self._entry = entry
+        return True
+
+    def release(self) -> None:
+        entry, self._entry = self._entry, None
+        if entry is None:
+            raise RuntimeError("release unlocked thread lock")
+        entry.lock.release()
+        _checkin(self.thread_id, entry)
+
+    def locked(self) -> bool:
+        with _entries_guard:
+            entry = _entries.get(self.thread_id)
+            return entry is not None and entry.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+
+def _key64(thread_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(thread_id.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+class _SharedLock(abc.ABC):
+    """In-process lock + an inter-process part provided by subclasses (_try_shared / _release_shared)."""
+
+    POLL_SEC = 0.05
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self._local = LocalThreadLock(thread_id)
+
+    @abc.abstractmethod
+    def _try_shared(self) -> bool:
+        """Take the inter-process part without blocking; True on success."""
+
+    @abc.abstractmethod
+    def _release_shared(self) -> None:
+        """Release what _try_shared took."""
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        deadline = time.monotonic() + timeout if blocking and timeout is not None and timeout >= 0 else None
+        if not self._local.acquire(blocking, timeout if deadline is not None else -1):
+            return False
+        try:
+            while not self._try_shared():
+                if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    self._local.release()
+                    return False
+                time.sleep(self.POLL_SEC)
+        except BaseException:
+            self._local.release()
+            raise
+        return True
+
+    def release(self) -> None:
+        try:
+            self._release_shared()
+        finally:
+            self._local.release()
+
+    def locked(self) -> bool:
+        return self._local.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+
+_lock_fd: Optional[int] = None
+_lock_fd_guard = threading.Lock()
+
+
+def _get_lock_fd() -> int:
+    # POSIX record locks belong to the process and closing *any* descriptor of the file drops
+    # them all, so the process keeps exactly one descriptor open for its lifetime.
+    global _lock_fd
+    with _lock_fd_guard:
+        if _lock_fd is None:
+            os.makedirs(THREAD_LOCK_DIR, exist_ok=True)
+            _lock_fd = os.open(os.path.join(THREAD_LOCK_DIR, "threads.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        return _lock_fd
+
+
+class FileThreadLock(_SharedLock):
+    """One-byte lockf range per thread id; the in-process lock keeps same-process callers apart."""
+
+    def __init__(self, thread_id: str):
+        super().__init__(thread_id)
+        self._offset = _key64(thread_id) & 0x3FFF_FFFF_FFFF_FFFF  # non-negative off_t
+
+    def _try_shared(self) -> bool:
+        import fcntl
+
+        try:
+            fcntl.lockf(_get_lock_fd(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, self._offset)
+        except (BlockingIOError, PermissionError):
+            return False
+        return True
+
+    def _release_shared(self) -> None:
+        import fcntl
+
+        fcntl.lockf(_get_lock_fd(), fcntl.LOCK_UN, 1, self._offset)
+
+
+class _LeaseDb:
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_leases ("
+            " thread_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self.lock = threading.Lock()
+
+
+_lease_db: Optional[_LeaseDb] = None
+_lease_db_guard = threading.Lock()
+
+
+def _get_lease_db() -> _LeaseDb:
+    global _lease_db
+    with _lease_db_guard:
+        if _lease_db is None:
+            _lease_db = _LeaseDb(THREAD_LOCK_DB)
+        return _lease_db
+
+
+class SqliteLeaseThreadLock(_SharedLock):
+    def __init__(self, thread_id: str):
+        super().__init__(thread_id)
+        self._owner: Optional[str] = None
+
+    def _try_shared(self) -> bool:
+        db = _get_lease_db()
+        owner = f"{_OWNER_PREFIX}:{uuid.uuid4().hex}"
+        now = time.time()
+        with db.lock:
+            cur = db.conn.execute(
+                "INSERT INTO thread_leases (thread_id, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE thread_leases.expires_at < ?",
+                (self.thread_id, owner, now + THREAD_LOCK_LEASE_SEC, now),
+            )
+        if cur.rowcount != 1:
+            return False
+        self._owner = owner
+        return True
+
+    def _release_shared(self) -> None:
+        owner, self._owner = self._owner, None
+        if owner is None:
+            return
+        db = _get_lease_db()
+        with db.lock:
+            db.conn.execute(
+                "DELETE FROM thread_leases WHERE thread_id = ? AND owner = ?", (self.thread_id, owner)
+            )
+
+
+_pg_pool = None
+_pg_pool_guard = threading.Lock()
+
+
+def _get_pg_pool():
+    global _pg_pool
+    with _pg_pool_guard:
+        if _pg_pool is None:
+            from psycopg_pool import ConnectionPool
+
+            if not POSTGRES_URL:
+                raise RuntimeError("THREAD_LOCK_BACKEND=postgres needs POSTGRES_URL")
+            _pg_pool = ConnectionPool(
+                POSTGRES_URL,
+                min_size=1,
+                max_size=THREAD_LOCK_PG_POOL_SIZE,
+                kwargs={"autocommit": True},
+                name="thread-locks",
+            )
+        return _pg_pool
+
+
+class PostgresAdvisoryThreadLock(_SharedLock):
+    """Session-level advisory lock: the pooled connection is held until release()."""
+
+    def __init__(self, thread_id: str):
+        super().__init__(thread_id)
+        self._conn = None
+
+    def _try_shared(self) -> bool:
+        pool = _get_pg_pool()
+        conn = pool.getconn()
+        try:
+            acquired = conn.execute("SELECT pg_try_advisory_lock(%s)", (_key64(self.thread_id),)).fetchone()[0]
+        except BaseException:
+            pool.putconn(conn)
+            raise
+        if not acquired:
+            pool.putconn(conn)
+            return False
+        self._conn = conn
+        return True
+
+    def _release_shared(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        pool = _get_pg_pool()
+        try:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (_key64(self.thread_id),))
+        finally:
+            pool.putconn(conn)
+
+
+_BACKENDS = {
+    "file": FileThreadLock,
+    "sqlite": SqliteLeaseThreadLock,
+    "postgres": PostgresAdvisoryThreadLock,
+}
+
+
+def get_thread_lock(thread_id: str):
+    """Lock serializing checkpoint access for one conversation (see THREAD_LOCK_BACKEND)."""
+    if THREAD_LOCK_BACKEND == "memory":
+        return LocalThreadLock(thread_id)
+    try:
+        return _BACKENDS[THREAD_LOCK_BACKEND](thread_id)
+    except KeyError:
+        raise ValueError(
+            f"Unknown THREAD_LOCK_BACKEND {THREAD_LOCK_BACKEND!r}; expected memory, {', '.join(_BACKENDS)}"
+        ) from None
+
+
+_lock_pool = WorkerPool("thread-locks", THREAD_LOCK_POOL_SIZE)
+
+
+async def acquire_turn_lock(lock) -> bool:
+    """Non-blocking acquire from the event loop; shared-store backends run on the lock pool."""
+    if THREAD_LOCK_BACKEND == "memory":
+        return lock.acquire(blocking=False)
+    attempt = _lock_pool.submit(lock.acquire, False)
+
+    def give_back(future) -> None:
+        if not future.cancelled() and future.exception() is None and future.result():
+            release_turn_lock_soon(lock)
+
+    try:
+        return await asyncio.shield(attempt)
+    except asyncio.CancelledError:
+        # The caller gave up mid-attempt: a lock the attempt took anyway is handed back.
+        attempt.add_done_callback(give_back)
+        raise
+
+
+async def release_turn_lock(lock) -> None:
+    if THREAD_LOCK_BACKEND == "memory":
+        lock.release()
+        return
+    await asyncio.shield(_lock_pool.submit(lock.release))
+
+
+def release_turn_lock_soon(lock) -> None:
+    """release_turn_lock for synchronous callbacks on the event loop (e.g. Future.add_done_callback)."""
+    if THREAD_LOCK_BACKEND == "memory":
+        lock.release()
+    else:
+        _lock_pool.submit(lock.release)
+
+
+def lock_stats() -> dict:
+    with _entries_guard:
+        held = sum(1 for e in _entries.values() if e.lock.locked())
+        waiters = sum(e.waiters for e in _entries.values())
+        busiest = max((e.waiters for e in _entries.values()), default=0)
+        return {
+            "backend": THREAD_LOCK_BACKEND,
+            "busy_policy": THREAD_BUSY_POLICY,
+            "max_waiters_per_thread": THREAD_LOCK_MAX_WAITERS,
+            "tracked_threads": len(_entries),
+            "held": held,
+            "waiters": waiters,
+            "most_waiters_on_one_thread": busiest,
+            "evicted": _evicted,
+            "lock_pool": _lock_pool.stats() if THREAD_LOCK_BACKEND != "memory" else None,
+        }
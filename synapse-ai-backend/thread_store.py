@@ -0,0 +1,164 @@
+"""
+Thread metadata store (title, timestamps, message count, last snippet).
+
+- One indexed row per conversation, written after its first turn (completed, failed or
+  cancelled — the checkpoint has the user's message either way).
+- Threads backfilled from older checkpoints have NULL timestamps / message_count (unknown,
+  not "now" / 0) and sort after every thread with real timestamps. Their next turn sets
+  updated_at and starts message_count from that turn; created_at stays NULL.
+- /threads and /thread/{id}/history read from here — no checkpoint scans, no LLM calls.
+- Runs on SQLite (sqlite_pool) or Postgres (pg_backend); the writer's `dialect` picks the
+  few statements that differ.
+"""
+
+import sqlite3
+import time
+from typing import Optional
+
+DEFAULT_TITLE = "New Conversation"
+SNIPPET_CHARS = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thread_meta (
+    thread_id     TEXT PRIMARY KEY,
+    title         TEXT NOT NULL,
+    created_at    REAL,
+    updated_at    REAL,
+    message_count INTEGER,
+    last_snippet  TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_thread_meta_updated ON thread_meta (updated_at DESC);
+"""
+
+_COLUMNS = ("thread_id", "title", "created_at", "updated_at", "message_count", "last_snippet")
+
+
+def fallback_title(text: str) -> str:
+    """Cheap title from the first user message — used when no generated title exists."""
+    text = " ".join((text or "").split())
+    if not text:
+        return DEFAULT_TITLE
+    return text if len(text) < 30 else text[:27] + "..."
+
+
+def _snippet(text: str) -> str:
+    text = " ".join((text or "").split())
+    return text[:SNIPPET_CHARS]
+
+
+def _table_exists(conn, name: str, dialect: str) -> bool:
+    if dialect == "postgres":
+        return conn.execute("SELECT to_regclass(?)", (name,)).fetchone()[0] is not None
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+class ThreadStore:
+    """Thread metadata: reads from the reader pool, writes through the single writer."""
+
+    def __init__(self, readers, writer):
+        self.readers = readers
+        self.writer = writer
+        self.dialect = getattr(writer, "dialect", "sqlite")
+
+    def setup(self) -> None:
+        """Create the table; on first creation backfill thread ids already in checkpoints."""
+
+        postgres = self.dialect == "postgres"
+        schema = _SCHEMA.replace("REAL", "DOUBLE PRECISION") if postgres else _SCHEMA
+
+        def create(conn: sqlite3.Connection) -> None:
+            existed = _table_exists(conn, "thread_meta", self.dialect)
+            for statement in schema.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            if not existed and _table_exists(conn, "checkpoints", self.dialect):
+                # Times and counts of legacy threads are unknown here: left NULL, not guessed.
+                backfill = (
+                    "INSERT INTO thread_meta (thread_id, title) "
+                    "SELECT DISTINCT thread_id, CAST(? AS TEXT) FROM checkpoints ON CONFLICT DO NOTHING"
+                    if postgres
+                    else "INSERT OR IGNORE INTO thread_meta (thread_id, title) "
+                    "SELECT DISTINCT thread_id, ? FROM checkpoints"
+                )
+                conn.execute(backfill, (DEFAULT_TITLE,))
+
+        self.writer.run(create)
+
+    def get(self, thread_id: str) -> Optional[dict]:
+        with self.readers.connection() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM thread_meta WHERE thread_id = ?",
+                (thread_id,),
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def list_recent(self, limit: int = 50, offset: int = 0) -> list[dict]:
+        """Most recently updated threads first."""
+        with self.readers.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM thread_meta "
+                "ORDER BY updated_at DESC NULLS LAST LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+        return [dict(zip(_COLUMNS, r)) for r in rows]
+
+    def list_ids(self) -> list[str]:
+        """All thread ids, oldest first (legacy ordering of retrieve_all_threads)."""
+        with self.readers.connection() as conn:
+            rows = conn.execute(
+                "SELECT thread_id FROM thread_meta ORDER BY updated_at ASC NULLS FIRST"
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def record_turn(self, thread_id: str, message: str, reply: str) -> bool:
+        """
+        Upsert metadata after a turn; returns True when this created the thread's row.
+        A new row is titled fallback_title(message) — a generated title replaces it later
+        (set_title), outside the turn. message_count adds the user message plus the reply,
+        when there is one; a backfilled row (NULL count) starts counting from this turn.
+        """
+        title = fallback_title(message)
+        added = 1 + (1 if reply.strip() else 0)
+        snippet = _snippet(reply)
+        now = time.time()
+
+        def upsert(conn: sqlite3.Connection) -> bool:
+            # Decided inside the writer job: concurrent turns can't both see "new thread".
+            inserted = conn.execute(
+                """
+                INSERT INTO thread_meta (thread_id, title, created_at, updated_at, message_count, last_snippet)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(thread_id) DO NOTHING
+                """,
+                (thread_id, title, now, now, added, snippet),
+            ).rowcount
+            if inserted:
+                return True
+            conn.execute(
+                """
+                UPDATE thread_meta SET
+                    updated_at = ?,
+                    message_count = COALESCE(message_count, 0) + ?,
+                    last_snippet = CASE WHEN ? = '' THEN last_snippet ELSE ? END
+                WHERE thread_id = ?
+                """,
+                (now, added, snippet, snippet, thread_id),
+            )
+            return False
+
+        return self.writer.run(upsert)
+
+    def set_title(self, thread_id: str, title: str) -> None:
+        """Replace a thread's title (no-op if the thread was deleted meanwhile)."""
+        self.writer.run(
+            lambda conn: conn.execute("UPDATE thread_meta SET title = ? WHERE thread_id = ?", (title, thread_id))
+        )
+
+    def delete(self, thread_id: str, conn: Optional[sqlite3.Connection] = None) -> None:
+        """Delete a thread's row; pass `conn` to run inside a writer job that is already open."""
+        if conn is None:
+            self.writer.run(lambda c: self.delete(thread_id, c))
+            return
+        conn.execute("DELETE FROM thread_meta WHERE thread_id = ?", (thread_id,))
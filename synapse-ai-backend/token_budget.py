@@ -0,0 +1,115 @@
+"""
+Token accounting for the chat context.
+
+- Messages are counted once with a real BPE tokenizer (tiktoken, o200k_base — the
+  vocabulary of the gpt-oss models; override with TOKENIZER_ENCODING). The count is stored in
+  graph state next to the message (ChatState.token_counts, keyed by message id) together with
+  a running total (ChatState.history_tokens), so routing never re-walks the history.
+- Budgets are per model: HISTORY_TOKEN_BUDGET (raw history kept before summarizing) and
+  CONTEXT_TOKEN_LIMIT (hard cap on the prompt sent), each overridable per model with a
+  suffix, e.g. CONTEXT_TOKEN_LIMIT_QWEN_QWEN3_6_27B=12000. Counts use one tokenizer for all
+  models, so leave some headroom in the fallback model's limits.
+- History is trimmed in whole turns: a cut only ever lands on a user message (trim_start).
+- Without tiktoken installed, counts fall back to a chars/4 estimate (with a warning).
+"""
+
+import json
+import os
+import re
+from typing import Optional
+
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKEN_LIMIT = int(os.getenv("CONTEXT_TOKEN_LIMIT", "16000"))
+# After a summary, keep this fraction of the history budget raw, so the next few turns
+# fit without summarizing again.
+SUMMARY_KEEP_RATIO = float(os.getenv("SUMMARY_KEEP_RATIO", "0.5"))
+
+# Role markers / separators the chat template adds around each message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as exc:
+            print(f"[token_budget] tokenizer unavailable, estimating chars/4: {type(exc).__name__}: {exc}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _content_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block if isinstance(block, str) else str(block.get("text", "")) if isinstance(block, dict) else ""
+            for block in content
+        )
+    return str(content or "")
+
+
+def count_message_tokens(message) -> int:
+    """Tokens one message adds to the prompt: content, tool-call payloads and role overhead."""
+    text = _content_text(getattr(message, "content", ""))
+    for call in getattr(message, "tool_calls", None) or []:
+        text += call.get("name", "") + json.dumps(call.get("args", {}), ensure_ascii=False)
+    return count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def merge_token_counts(left: Optional[dict], right: Optional[dict]) -> dict:
+    """ChatState reducer: merge new counts; a None value drops that message id."""
+    merged = dict(left or {})
+    for message_id, count in (right or {}).items():
+        if count is None:
+            merged.pop(message_id, None)
+        else:
+            merged[message_id] = count
+    return merged
+
+
+def trim_start(history: list, counts: dict, budget: int) -> int:
+    """
+    Index of the first history message to keep so the kept tail fits in `budget` tokens.
+    Cuts only at a user message (type "human"), so a turn is never split from its tool calls;
+    if even the last turn is over budget it is kept whole anyway.
+    """
+    total = 0
+    cut = None
+    for i in range(len(history) - 1, -1, -1):
+        total += counts.get(history[i].id) or count_message_tokens(history[i])
+        if total > budget:
+            break
+        if history[i].type == "human":
+            cut = i
+    if cut is None:
+        cut = next((i for i in range(len(history) - 1, -1, -1) if history[i].type == "human"), 0)
+    return cut
+
+
+def _model_key(model: str) -> str:
+    return re.sub(r"\W", "_", model).upper()
+
+
+def history_budget(model: str) -> int:
+    return int(os.getenv(f"HISTORY_TOKEN_BUDGET_{_model_key(model)}", HISTORY_TOKEN_BUDGET))
+
+
+def context_limit(model: str) -> int:
+    return int(os.getenv(f"CONTEXT_TOKEN_LIMIT_{_model_key(model)}", CONTEXT_TOKEN_LIMIT))
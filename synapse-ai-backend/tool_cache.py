@@ -0,0 +1,241 @@
+"""
+Process-wide result cache for outbound tools.
+
+- Per-tool freshness (TTL), size-bounded LRU eviction shared by all tools.
+- Arguments are normalized (trimmed, case-folded) so "Chennai " and "chennai" share one entry.
+- Single-flight: concurrent identical calls wait on one upstream request (at most
+  TOOL_CACHE_WAIT_SEC, then they call upstream themselves). An error raised by that request
+  reaches its waiters; if the leader is cancelled instead, a waiter takes over the call.
+- Failures are never cached: a tool marks a failed result by returning it wrapped in
+  ToolFailure (callers get the unwrapped value).
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Awaitable, Callable, Optional
+
+from concurrency import JobCancelled
+
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "2048"))
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "1") != "0"
+# Longest wait on another caller's identical in-flight request.
+TOOL_CACHE_WAIT_SEC = float(os.getenv("TOOL_CACHE_WAIT_SEC", "30"))
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class ToolFailure:
+    """Wraps a tool's failure result (error text / dict for the model) so it is not cached."""
+
+    __slots__ = ("result",)
+
+    def __init__(self, result: Any):
+        self.result = result
+
+
+def _unwrap(value: Any) -> Any:
+    return value.result if isinstance(value, ToolFailure) else value
+
+
+class _LeaderGone(Exception):
+    """Set on an in-flight slot whose caller was cancelled: waiters retry instead of failing."""
+
+
+class ToolResultCache:
+    """TTL + LRU cache with single-flight de-duplication. Thread-safe."""
+
+    def __init__(self, max_entries: int = TOOL_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, int]] = {}
+
+    def _bump(self, tool_name: str, counter: str) -> None:
+        per_tool = self._stats.setdefault(
+            tool_name,
+            {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0, "wait_timeouts": 0},
+        )
+        per_tool[counter] += 1
+
+    def _begin(self, tool_name: str, key: str):
+        """Return ("hit", value), ("lead", future) or ("wait", future)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._bump(tool_name, "hits")
+                    return "hit", value
+                del self._entries[key]
+                self._bump(tool_name, "expired")
+
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = Future()
+                self._inflight[key] = pending
+                self._bump(tool_name, "misses")
+                return "lead", pending
+            self._bump(tool_name, "coalesced")
+            return "wait", pending
+
+    def _finish(self, key: str, ttl: float, pending: Future, value: Any) -> Any:
+        failed = isinstance(value, ToolFailure)
+        if failed:
+            value = value.result
+        with self._lock:
+            self._inflight.pop(key, None)
+            if not failed:
+                self._entries[key] = (time.monotonic() + ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    evicted_key, _ = self._entries.popitem(last=False)
+                    self._bump(evicted_key.split(":", 1)[0], "evictions")
+        pending.set_result(value)
+        return value
+
+    def _fail(self, key: str, pending: Future, exc: BaseException) -> None:
+        """Release the in-flight slot. Errors reach the waiters; a cancelled leader's waiters retry."""
+        with self._lock:
+            self._inflight.pop(key, None)
+        cancelled = isinstance(exc, JobCancelled) or not isinstance(exc, Exception)
+        pending.set_exception(_LeaderGone() if cancelled else exc)
+
+    def _wait_timed_out(self, tool_name: str) -> None:
+        with self._lock:
+            self._bump(tool_name, "wait_timeouts")
+
+    def get_or_compute(self, tool_name: str, key: str, ttl: float, compute: Callable[[], Any]) -> Any:
+        while True:
+            state, slot = self._begin(tool_name, key)
+            if state == "hit":
+                return slot
+            if state == "lead":
+                break
+            try:
+                return slot.result(timeout=TOOL_CACHE_WAIT_SEC)
+            except _LeaderGone:
+                continue
+            except FutureTimeout:
+                self._wait_timed_out(tool_name)
+                return _unwrap(compute())
+        try:
+            value = compute()
+        except BaseException as exc:
+            self._fail(key, slot, exc)
+            raise
+        return self._finish(key, ttl, slot, value)
+
+    async def aget_or_compute(
+        self, tool_name: str, key: str, ttl: float, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Async twin of get_or_compute — shares entries and in-flight calls with the sync path."""
+        while True:
+            state, slot = self._begin(tool_name, key)
+            if state == "hit":
+                return slot
+            if state == "lead":
+                break
+            try:
+                # shield: a cancelled waiter must not cancel the slot other callers share.
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(slot)), TOOL_CACHE_WAIT_SEC)
+            except _LeaderGone:
+                continue
+            except asyncio.TimeoutError:
+                self._wait_timed_out(tool_name)
+                return _unwrap(await compute())
+        try:
+            value = await compute()
+        except BaseException as exc:
+            self._fail(key, slot, exc)
+            raise
+        return self._finish(key, ttl, slot, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            per_tool = {name: dict(counts) for name, counts in self._stats.items()}
+            size = len(self._entries)
+        return {
+            "enabled": TOOL_CACHE_ENABLED,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "tools": per_tool,
+        }
+
+
+tool_cache = ToolResultCache()
+
+
+def cached_tool(ttl: float, name: Optional[str] = None):
+    """
+    Cache a tool function's result for `ttl` seconds (override per tool with
+    TOOL_CACHE_TTL_<NAME>, e.g. TOOL_CACHE_TTL_GET_WEATHER=300). Apply *under* @tool so the
+    wrapped signature/docstring still drive the tool schema:
+
+        @tool
+        @cached_tool(ttl=600)
+        def get_weather(location: str) -> str: ...
+
+    Coroutine functions get an async wrapper that shares the same entries. Return
+    ToolFailure(result) for a result that must not be cached; callers get `result`.
+    """
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        tool_name = name or fn.__name__
+        ttl_sec = float(os.getenv(f"TOOL_CACHE_TTL_{tool_name.upper()}", ttl))
+        signature = inspect.signature(fn)
+
+        def _key(args, kwargs) -> str:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            normalized = _normalize(dict(bound.arguments))
+            return f"{tool_name}:{json.dumps(normalized, sort_keys=True, default=str)}"
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not TOOL_CACHE_ENABLED:
+                    return _unwrap(await fn(*args, **kwargs))
+                return await tool_cache.aget_or_compute(
+                    tool_name, _key(args, kwargs), ttl_sec, lambda: fn(*args, **kwargs)
+                )
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TOOL_CACHE_ENABLED:
+                return _unwrap(fn(*args, **kwargs))
+            return tool_cache.get_or_compute(tool_name, _key(args, kwargs), ttl_sec, lambda: fn(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+def get_tool_cache_stats() -> dict:
+    return tool_cache.stats()
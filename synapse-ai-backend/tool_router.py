@@ -0,0 +1,236 @@
+"""
+Embedding-based tool routing (TOOL_ROUTER_ENABLED=1).
+
+- Each tool has a few exemplar requests; their embeddings (the retriever's model, via
+  tools.get_embeddings) are computed once. A user turn is scored against them: a tool's
+  score is its best exemplar's cosine similarity.
+- Small talk (greetings, thanks, creative writing) has exemplars too: when it clearly wins,
+  the turn is sent with no tools bound at all.
+- Otherwise the top TOOL_ROUTER_TOP_K tools scoring at least TOOL_ROUTER_MIN_SCORE are bound.
+  When no tool is confident enough — or the model is still loading — route() returns None
+  and the caller binds the full tool set, so routing can only shrink the prompt, never
+  hide a tool the turn obviously needs.
+- When the model still calls a tool the route left out, Groq rejects the request ("... which
+  was not in request.tools"); call_with_route retries that call once with the full tool set.
+"""
+
+import os
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import numpy as np
+
+TOOL_ROUTER_ENABLED = os.getenv("TOOL_ROUTER_ENABLED", "0") == "1"
+TOOL_ROUTER_TOP_K = max(1, int(os.getenv("TOOL_ROUTER_TOP_K", "3")))
+# Below this best-tool similarity the router is not confident: bind every tool.
+TOOL_ROUTER_MIN_SCORE = float(os.getenv("TOOL_ROUTER_MIN_SCORE", "0.35"))
+# Small talk must beat the best tool by this margin (and reach MIN_SCORE) to bind no tools.
+TOOL_ROUTER_SMALL_TALK_MARGIN = float(os.getenv("TOOL_ROUTER_SMALL_TALK_MARGIN", "0.1"))
+
+SMALL_TALK = "__small_talk__"
+
+_ROUTING_MISS = "which was not in request.tools"
+
+T = TypeVar("T")
+
+EXEMPLARS = {
+    "web_search": [
+        "latest news today",
+        "who won the election",
+        "what happened in the match yesterday",
+        "current price of gold",
+        "who is the current CEO of the company",
+        "recent developments in AI this week",
+    ],
+    "get_weather": [
+        "what's the weather in Chennai",
+        "will it rain tomorrow in London",
+        "temperature in New York right now",
+        "is it hot outside in Delhi",
+    ],
+    "wikipedia_search": [
+        "who was Alan Turing",
+        "history of the Roman Empire",
+        "tell me about the Eiffel Tower",
+        "biography of Marie Curie",
+        "what is photosynthesis according to wikipedia",
+    ],
+    "convert_currency": [
+        "convert 100 USD to INR",
+        "how many euros is 50 dollars",
+        "exchange rate from GBP to JPY",
+    ],
+    "get_stock_price": [
+        "Apple stock price",
+        "how is TSLA trading today",
+        "NVDA share price",
+        "price of Microsoft shares",
+    ],
+    "calculator": [
+        "what is 234 * 19",
+        "calculate 15% of 2400",
+        "square root of 729",
+        "add 1234 and 9876",
+    ],
+    "github_search": [
+        "find GitHub repos for langgraph",
+        "GitHub user torvalds",
+        "popular repositories for web scraping",
+    ],
+    "geo_lookup": [
+        "where is IP 8.8.8.8 located",
+        "look up this IP address",
+        "which ISP owns 1.1.1.1",
+    ],
+    "current_datetime": [
+        "what time is it",
+        "what is today's date",
+        "current time in Tokyo",
+    ],
+    "rag_tool": [
+        "what does the ethics chapter say about privacy",
+        "summarize the uploaded document",
+        "according to the course material, what is utilitarianism",
+        "find the section in my PDF about consent",
+    ],
+    SMALL_TALK: [
+        "hi",
+        "hello, how are you?",
+        "thanks a lot",
+        "good morning",
+        "write a short poem about the sea",
+        "tell me a joke",
+        "explain recursion simply",
+        "who are you",
+    ],
+}
+
+
+class ToolRouter:
+    """Scores a user turn against per-tool exemplar vectors. Thread-safe, lazily initialised."""
+
+    def __init__(self, exemplars: dict = EXEMPLARS):
+        self._exemplars = exemplars
+        self._names: list[str] = []
+        self._owner: Optional[np.ndarray] = None  # exemplar row -> index into _names
+        self._matrix: Optional[np.ndarray] = None  # unit exemplar vectors
+        self._embeddings = None
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.no_tools = 0
+        self.full_set = 0
+        self.bound_tools = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def _ready(self) -> bool:
+        if self._matrix is not None:
+            return True
+        from retriever import RetrieverNotReady
+        from tools import get_embeddings
+
+        try:
+            embeddings = get_embeddings(timeout=0)
+        except RetrieverNotReady:
+            return False
+        with self._lock:
+            if self._matrix is None:
+                names = list(self._exemplars)
+                texts, owner = [], []
+                for i, name in enumerate(names):
+                    texts.extend(self._exemplars[name])
+                    owner.extend([i] * len(self._exemplars[name]))
+                self._names = names
+                self._owner = np.asarray(owner)
+                self._embeddings = embeddings
+                self._matrix = self._unit(embeddings.embed_documents(texts))
+        return True
+
+    def scores(self, text: str) -> Optional[dict]:
+        """Best exemplar similarity per tool (and SMALL_TALK); None until embeddings are loaded."""
+        if not self._ready():
+            return None
+        query = self._unit(self._embeddings.embed_query(text))
+        sims = self._matrix @ query
+        best = np.full(len(self._names), -1.0, dtype=np.float32)
+        np.maximum.at(best, self._owner, sims)
+        return dict(zip(self._names, best.tolist()))
+
+    def route(self, text: str) -> Optional[tuple]:
+        """Tool names to bind for this turn: () for none, None for the full set."""
+        scores = self.scores(text) if text.strip() else None
+        if scores is None:
+            with self._lock:
+                self.full_set += 1
+            return None
+        small_talk = scores.pop(SMALL_TALK, -1.0)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best = ranked[0][1] if ranked else -1.0
+        with self._lock:
+            if small_talk >= TOOL_ROUTER_MIN_SCORE and small_talk >= best + TOOL_ROUTER_SMALL_TALK_MARGIN:
+                self.no_tools += 1
+                return ()
+            if best < TOOL_ROUTER_MIN_SCORE:
+                self.full_set += 1
+                return None
+            chosen = tuple(name for name, score in ranked[:TOOL_ROUTER_TOP_K] if score >= TOOL_ROUTER_MIN_SCORE)
+            self.routed += 1
+            self.bound_tools += len(chosen)
+            return chosen
+
+    def record_miss(self, tool_names: tuple, exc: Exception) -> None:
+        with self._lock:
+            self.misses += 1
+        print(f"[tool_router] model called a tool outside {tool_names}; retrying with all tools: {exc}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": TOOL_ROUTER_ENABLED,
+                "top_k": TOOL_ROUTER_TOP_K,
+                "min_score": TOOL_ROUTER_MIN_SCORE,
+                "routed": self.routed,
+                "no_tools": self.no_tools,
+                "full_set": self.full_set,
+                "avg_tools_bound": round(self.bound_tools / self.routed, 2) if self.routed else None,
+                "misses": self.misses,
+            }
+
+
+tool_router = ToolRouter()
+
+
+def get_tool_router_stats() -> dict:
+    return tool_router.stats()
+
+
+def is_routing_miss(exc: Exception, tool_names: Optional[tuple]) -> bool:
+    """Groq rejected a call to a tool that this route did not bind (never true for the full set)."""
+    return tool_names is not None and _ROUTING_MISS in str(exc).lower()
+
+
+def call_with_route(call: Callable[[Optional[tuple]], T], tool_names: Optional[tuple]) -> T:
+    """call(tool_names); on a routing miss, call(None) once instead of failing the turn."""
+    try:
+        return call(tool_names)
+    except Exception as exc:
+        if not is_routing_miss(exc, tool_names):
+            raise
+        tool_router.record_miss(tool_names, exc)
+    return call(None)
+
+
+async def acall_with_route(call: Callable[[Optional[tuple]], Awaitable[T]], tool_names: Optional[tuple]) -> T:
+    """Async twin of call_with_route."""
+    try:
+        return await call(tool_names)
+    except Exception as exc:
+        if not is_routing_miss(exc, tool_names):
+            raise
+        tool_router.record_miss(tool_names, exc)
+    return await call(None)
@@ -1,33 +1,29 @@
+import functools
 import os
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Optional
+from urllib.parse import quote
 
+import httpx
 import pytz
-import requests
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_core.tools import tool
-from tavily import TavilyClient
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-FAISS_DIR = os.path.join(BASE_DIR, "faiss_ethics_ch10")
-
-_embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-_vector_store = FAISS.load_local(
-    FAISS_DIR,
-    _embeddings,
-    allow_dangerous_deserialization=True,
-)
-_retriever = _vector_store.as_retriever(search_kwargs={"k": 4})
-def get_embeddings():
-    """Expose the already-loaded embeddings model for reuse elsewhere (tool routing)."""
-    return _embeddings
-
-def _tavily_client() -> TavilyClient:
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool, tool
+
+import retriever
+from doc_collections import resolve_collection_dirs
+from http_client import Flow, HttpRequest, arun_flow, request, run_flow
+from tool_cache import ToolFailure, cached_tool
+
+
+def get_embeddings(timeout: Optional[float] = retriever.RAG_WARMUP_TIMEOUT_SEC):
+    """Expose the embeddings model for reuse elsewhere (tool routing, response cache). Waits for retriever warm-up."""
+    return retriever.get_embeddings(timeout)
+
+def _tavily_api_key() -> str:
     api_key = os.getenv("TAVILY_API_KEY")
     if not api_key:
         raise ValueError("TAVILY_API_KEY is not configured")
-    return TavilyClient(api_key=api_key)
+    return api_key
 
 
 def _http_get(
@@ -35,14 +31,50 @@ def _http_get(
     timeout: int = 15,
     headers: Optional[dict] = None,
     params: Optional[dict] = None,
-) -> requests.Response:
-    return requests.get(url, timeout=timeout, headers=headers or {}, params=params or {})
+) -> httpx.Response:
+    """One-off GET on the pooled sync client (for tools without an async variant)."""
+    return request(HttpRequest(url, params=params, headers=headers, timeout=timeout))
+
+
+def http_tool(ttl: float):
+    """
+    Build a cached tool from a request flow: a generator that yields HttpRequest and
+    receives httpx.Response. The same body backs a sync func (pool threads) and an
+    awaitable coroutine (ToolNode on the async path); both share one result cache.
+    The flow's docstring becomes the tool description; it returns ToolFailure(...) for
+    results that must not be cached.
+    """
+
+    def decorator(flow: Callable[..., Flow]) -> StructuredTool:
+        name = flow.__name__
+
+        @cached_tool(ttl=ttl, name=name)
+        @functools.wraps(flow)
+        def sync_fn(*args, **kwargs):
+            return run_flow(flow(*args, **kwargs))
+
+        @cached_tool(ttl=ttl, name=name)
+        @functools.wraps(flow)
+        async def async_fn(*args, **kwargs):
+            return await arun_flow(flow(*args, **kwargs))
+
+        return StructuredTool.from_function(
+            func=sync_fn,
+            coroutine=async_fn,
+            name=name,
+            description=(flow.__doc__ or "").strip(),
+        )
+
+    return decorator
 
 
 @tool
-def rag_tool(query: str) -> str:
-    """Retrieve relevant passages from the stored PDF document index."""
-    docs = _retriever.invoke(query)
+def rag_tool(query: str, config: RunnableConfig) -> str:
+    """Retrieve relevant passages from the stored PDF document index and any documents the user uploaded to this conversation. Matches meaning and exact terms; put exact phrases (section titles, names) in double quotes."""
+    try:
+        docs = retriever.search(query, collection_dirs=resolve_collection_dirs(config))
+    except retriever.RetrieverNotReady as exc:
+        return f"{exc} — please try again in a moment."
     if not docs:
         return "No matching document passages found."
     parts = []
@@ -51,16 +83,18 @@ def rag_tool(query: str) -> str:
     return "\n\n".join(parts)
 
 
-@tool
+@http_tool(ttl=15 * 60)
 def web_search(query: str) -> str:
     """Search the web via Tavily for up-to-date information. Use for current office holders, news, sports, commodities (silver/gold), and any fact that may have changed. Include the current year in the query."""
     try:
-        client = _tavily_client()
-        response = client.search(
-            query=query,
-            max_results=3,
-            include_answer=True,
+        r = yield HttpRequest(
+            "https://api.tavily.com/search",
+            method="POST",
+            headers={"Authorization": f"Bearer {_tavily_api_key()}"},
+            json={"query": query, "max_results": 3, "include_answer": True},
         )
+        r.raise_for_status()
+        response = r.json()
 
         parts = []
         answer = response.get("answer")
@@ -79,7 +113,7 @@ def web_search(query: str) -> str:
         combined = "\n\n".join(parts)
         return combined[:1800]  # hard cap on total tool-result size
     except Exception as e:
-        return f"Web search failed: {type(e).__name__}: {e}"
+        return ToolFailure(f"Web search failed: {type(e).__name__}: {e}")
 
 
 @tool
@@ -109,19 +143,19 @@ def calculator(first_num: float, second_num: float, operation: str) -> dict:
         return {"error": str(e)}
 
 
-@tool
+@http_tool(ttl=24 * 3600)
 def get_stock_price(symbol: str) -> dict:
     """Return the latest daily close price for a stock symbol (e.g., AAPL, TSLA)."""
     symbol = symbol.strip().upper()
     url = f"https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={symbol}&apikey=MU5WKN30VAC2LCDG"
 
     try:
-        r = requests.get(url, timeout=15)
+        r = yield HttpRequest(url)
         data = r.json()
 
         ts = data.get("Time Series (Daily)")
         if not ts:
-            return {"symbol": symbol, "error": "No data returned", "raw": data}
+            return ToolFailure({"symbol": symbol, "error": "No data returned", "raw": data})
 
         latest_date = max(ts.keys())
         latest = ts[latest_date]
@@ -137,17 +171,17 @@ def get_stock_price(symbol: str) -> dict:
         }
 
     except Exception as e:
-        return {"symbol": symbol, "error": str(e)}
+        return ToolFailure({"symbol": symbol, "error": str(e)})
 
 
-@tool
+@http_tool(ttl=10 * 60)
 def get_weather(location: str) -> str:
     """Get current weather and short forecast for a city or place name (e.g. Chennai, London, New York). Free Open-Meteo data — no API key."""
     location = location.strip()
     if not location:
-        return "Please provide a location name."
+        return ToolFailure("Please provide a location name.")
     try:
-        geo = _http_get(
+        geo = yield HttpRequest(
             "https://geocoding-api.open-meteo.com/v1/search",
             params={"name": location, "count": 1, "language": "en", "format": "json"},
         )
@@ -163,7 +197,7 @@ def get_weather(location: str) -> str:
         admin = place.get("admin1", "")
         label = ", ".join(p for p in (name, admin, country) if p)
 
-        forecast = _http_get(
+        forecast = yield HttpRequest(
             "https://api.open-meteo.com/v1/forecast",
             params={
                 "latitude": lat,
@@ -196,7 +230,7 @@ def get_weather(location: str) -> str:
                 lines.append(f"  {day}: {tmin}–{tmax}°C, {_weather_code_label(d_code)}")
         return "\n".join(lines)
     except Exception as e:
-        return f"Weather lookup failed: {type(e).__name__}: {e}"
+        return ToolFailure(f"Weather lookup failed: {type(e).__name__}: {e}")
 
 
 def _weather_code_label(code: Optional[int]) -> str:
@@ -226,14 +260,14 @@ def _weather_code_label(code: Optional[int]) -> str:
     return labels.get(code, f"weather code {code}")
 
 
-@tool
+@http_tool(ttl=24 * 3600)
 def wikipedia_search(query: str) -> str:
     """Search Wikipedia for encyclopedia summaries. Use for historical facts, definitions, biographies, science concepts — not for live news or prices."""
     query = query.strip()
     if not query:
-        return "Please provide a search query."
+        return ToolFailure("Please provide a search query.")
     try:
-        search = _http_get(
+        search = yield HttpRequest(
             "https://en.wikipedia.org/w/api.php",
             params={
                 "action": "query",
@@ -252,8 +286,8 @@ def wikipedia_search(query: str) -> str:
         parts = []
         for hit in hits[:3]:
             title = hit.get("title", "")
-            summary = _http_get(
-                f"https://en.wikipedia.org/api/rest_v1/page/summary/{requests.utils.quote(title, safe='')}",
+            summary = yield HttpRequest(
+                f"https://en.wikipedia.org/api/rest_v1/page/summary/{quote(title, safe='')}",
                 headers={"User-Agent": "SynapseAI/1.0 (education chatbot)"},
             )
             if summary.status_code != 200:
@@ -264,19 +298,19 @@ def wikipedia_search(query: str) -> str:
             parts.append(f"**{title}**\n{extract}\nSource: {url}")
 
         if not parts:
-            return f"Could not load Wikipedia summaries for '{query}'."
+            return ToolFailure(f"Could not load Wikipedia summaries for '{query}'.")
         return "\n\n".join(parts)
     except Exception as e:
-        return f"Wikipedia search failed: {type(e).__name__}: {e}"
+        return ToolFailure(f"Wikipedia search failed: {type(e).__name__}: {e}")
 
 
-@tool
+@http_tool(ttl=10 * 60)
 def convert_currency(amount: float, from_currency: str, to_currency: str) -> str:
     """Convert money between currencies using live exchange rates (Frankfurter/ECB). Use ISO codes like USD, EUR, INR, GBP."""
     from_currency = from_currency.strip().upper()
     to_currency = to_currency.strip().upper()
     try:
-        r = _http_get(
+        r = yield HttpRequest(
             "https://api.frankfurter.app/latest",
             params={"amount": amount, "from": from_currency, "to": to_currency},
         )
@@ -291,7 +325,7 @@ def convert_currency(amount: float, from_currency: str, to_currency: str) -> str
             f"(rate date: {rate_date}, source: ECB via Frankfurter)"
         )
     except Exception as e:
-        return f"Currency conversion failed: {type(e).__name__}: {e}"
+        return ToolFailure(f"Currency conversion failed: {type(e).__name__}: {e}")
 
 
 @tool
@@ -351,12 +385,12 @@ def fetch_url(url: str) -> str:
         return f"URL fetch failed: {type(e).__name__}: {e}"
 
 
-@tool
+@http_tool(ttl=60 * 60)
 def github_search(query: str, search_type: str = "repositories") -> str:
     """Search GitHub for repositories or users. search_type: 'repositories' or 'users'. Use for open-source projects, repos, GitHub profiles."""
     query = query.strip()
     if not query:
-        return "Please provide a search query."
+        return ToolFailure("Please provide a search query.")
     search_type = search_type.strip().lower()
     if search_type not in ("repositories", "users"):
         search_type = "repositories"
@@ -371,13 +405,13 @@ def github_search(query: str, search_type: str = "repositories") -> str:
 
     try:
         if search_type == "users":
-            r = _http_get(
+            r = yield HttpRequest(
                 "https://api.github.com/search/users",
                 params={"q": query, "per_page": 5},
                 headers=headers,
             )
         else:
-            r = _http_get(
+            r = yield HttpRequest(
                 "https://api.github.com/search/repositories",
                 params={"q": query, "sort": "stars", "order": "desc", "per_page": 5},
                 headers=headers,
@@ -403,22 +437,22 @@ def github_search(query: str, search_type: str = "repositories") -> str:
                 )
         return "\n\n".join(parts)
     except Exception as e:
-        return f"GitHub search failed: {type(e).__name__}: {e}"
+        return ToolFailure(f"GitHub search failed: {type(e).__name__}: {e}")
 
 
-@tool
+@http_tool(ttl=60 * 60)
 def geo_lookup(ip: str = "") -> str:
     """Look up geographic location for an IP address. Leave ip empty to look up the server's public IP. Use for 'where is this IP' questions — not for street-level user location."""
     ip = ip.strip()
     try:
         if not ip:
-            ip_resp = _http_get("https://api.ipify.org?format=json")
+            ip_resp = yield HttpRequest("https://api.ipify.org?format=json")
             ip_resp.raise_for_status()
             ip = ip_resp.json().get("ip", "")
             if not ip:
-                return "Could not determine public IP."
+                return ToolFailure("Could not determine public IP.")
 
-        r = _http_get(
+        r = yield HttpRequest(
             f"http://ip-api.com/json/{ip}",
             params={
                 "fields": "status,message,country,countryCode,regionName,city,lat,lon,timezone,isp,query",
@@ -437,7 +471,7 @@ def geo_lookup(ip: str = "") -> str:
             f"ISP: {data.get('isp')}"
         )
     except Exception as e:
-        return f"Geo lookup failed: {type(e).__name__}: {e}"
+        return ToolFailure(f"Geo lookup failed: {type(e).__name__}: {e}")
 
 
 @tool